@@ -0,0 +1,142 @@
+"""Bandwidth scheduling shared by every download of the process.
+
+Each running job gets a token bucket. Its rate is the job's share of
+the global limit, split max-min fair: jobs capped below an equal share
+keep their cap and the rest is divided evenly among the others, so one
+big video can't starve small audio jobs. Limits can change at any time,
+sleeping downloads pick up the new rate within a fraction of a second.
+"""
+
+import re
+import time
+import threading
+
+# A sleeping download rechecks its rate and stop request this often
+MAX_SLEEP = 0.25
+# Bytes a bucket can save up while a job is idle, in seconds of its rate
+BURST_SECONDS = 0.5
+MIN_BURST = 64 * 1024
+
+_RATE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)(?:i?[bB](?:/s)?)?\s*$")
+_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_rate(text):
+    """Parse a rate like "500K" or "2.5M" into bytes per second, 0 is no limit.
+
+    Returns None for no limit, raises ValueError on anything else.
+    """
+    match = _RATE_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid rate: {text}")
+    rate = float(match.group(1)) * _UNITS[match.group(2).lower()]
+    return rate or None
+
+
+def format_rate(rate):
+    if rate is None:
+        return "unlimited"
+    return f"{rate / 1024 / 1024:.2f} MB/s"
+
+
+class _Bucket:
+    def __init__(self, cap):
+        self.cap = cap
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate is not None:
+            burst = max(MIN_BURST, self.rate * BURST_SECONDS)
+            self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class BandwidthScheduler:
+    """Token buckets with a global limit and optional per-job caps, in bytes/s."""
+
+    def __init__(self, global_limit=None):
+        self._global_limit = global_limit
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def global_limit(self):
+        return self._global_limit
+
+    def set_global_limit(self, rate):
+        with self._lock:
+            self._global_limit = rate or None
+            self._allocate()
+
+    def set_job_limit(self, job_id, rate):
+        with self._lock:
+            bucket = self._buckets.get(job_id)
+            if bucket is not None:
+                bucket.cap = rate or None
+                self._allocate()
+
+    def register(self, job_id, cap=None):
+        """Start sharing the bandwidth with a job that begins downloading."""
+        with self._lock:
+            self._buckets[job_id] = _Bucket(cap or None)
+            self._allocate()
+
+    def unregister(self, job_id):
+        with self._lock:
+            if self._buckets.pop(job_id, None) is not None:
+                self._allocate()
+
+    def rate(self, job_id):
+        """The effective rate of a job right now, None if it's unlimited."""
+        with self._lock:
+            bucket = self._buckets.get(job_id)
+            return bucket.rate if bucket is not None else None
+
+    def consume(self, job_id, count, should_stop=None):
+        """Account for ``count`` downloaded bytes, sleeping while over the rate.
+
+        Returns early once ``should_stop()`` is true.
+        """
+        while True:
+            with self._lock:
+                bucket = self._buckets.get(job_id)
+                if bucket is None:
+                    return
+                now = time.monotonic()
+                bucket.refill(now)
+                if bucket.rate is None:
+                    bucket.tokens = 0.0
+                    return
+                if count:
+                    bucket.tokens -= count
+                    count = 0
+                if bucket.tokens >= 0:
+                    return
+                wait = min(MAX_SLEEP, -bucket.tokens / bucket.rate)
+            if should_stop is not None and should_stop():
+                return
+            time.sleep(wait)
+
+    def _allocate(self):
+        # Called with the lock held
+        now = time.monotonic()
+        for bucket in self._buckets.values():
+            # Settle the tokens at the old rate before it changes
+            bucket.refill(now)
+
+        if self._global_limit is None:
+            for bucket in self._buckets.values():
+                bucket.rate = bucket.cap
+            return
+
+        remaining = self._global_limit
+        buckets = sorted(
+            self._buckets.values(),
+            key=lambda bucket: bucket.cap if bucket.cap is not None else float("inf"),
+        )
+        for index, bucket in enumerate(buckets):
+            share = remaining / (len(buckets) - index)
+            bucket.rate = share if bucket.cap is None else min(bucket.cap, share)
+            remaining -= bucket.rate
@@ -0,0 +1,190 @@
+"""Offline benchmarks of the download pipeline.
+
+Starts a local media server, then runs every selected scenario in a
+fresh interpreter against it, through a stub yt-dlp extractor instead of
+YouTube. Run from the repository root:
+
+    python -m benchmarks
+    python -m benchmarks single-large parallel --scale 0.25 --repeat 3
+    python -m benchmarks --rate 1M --latency 0.2 --json results.json
+    python -m benchmarks many-small --no-session-reuse
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from bandwidth import format_rate, parse_rate
+from benchmarks.media_server import MediaServer
+from benchmarks.scenarios import SCENARIOS
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# Reported as the median of the repeats
+COLUMNS = [
+    ("wall_seconds", "wall s", "{:.2f}"),
+    ("bytes_per_second", "MB/s", None),
+    ("cpu_seconds", "cpu s", "{:.2f}"),
+    ("ffmpeg_cpu_seconds", "ffmpeg s", "{:.2f}"),
+    ("peak_rss_bytes", "RSS MB", None),
+    ("progress_hooks_per_second", "hooks/s", "{:.0f}"),
+    ("ui_rows_redrawn_per_second", "rows/s", "{:.1f}"),
+    ("log_records_per_second", "logs/s", "{:.1f}"),
+    ("connections", "conns", "{:.0f}"),
+    ("connection_reuse", "reuse", "{:.0%}"),
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark downloads against a local stand-in media server.",
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help="scenarios to run (default: all of %s)" % ", ".join(sorted(SCENARIOS)),
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply file sizes and counts, e.g. 0.1 for a quick run",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs per scenario (default: 1)"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        help="seconds before the server answers each request",
+    )
+    parser.add_argument(
+        "--rate",
+        type=parse_rate,
+        default=False,
+        metavar="RATE",
+        help="bandwidth of each server connection, e.g. 2M, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--no-ranges",
+        action="store_true",
+        help="let the server ignore range requests",
+    )
+    parser.add_argument(
+        "--no-session-reuse",
+        action="store_true",
+        help="give every job a new YoutubeDL instance, as before session pooling",
+    )
+    parser.add_argument(
+        "--json", metavar="PATH", help="also write all results to PATH as JSON"
+    )
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {unknown[0]!r}")
+    args.scenarios = args.scenarios or sorted(SCENARIOS)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    return args
+
+
+def run_scenario(spec):
+    env = dict(os.environ)
+    # The benchmarks directory holds the yt_dlp_plugins package of the stub
+    env["PYTHONPATH"] = os.pathsep.join(
+        [BENCHMARKS_DIR, REPO_DIR] + [p for p in [env.get("PYTHONPATH")] if p]
+    )
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.runner", json.dumps(spec)],
+        cwd=REPO_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def format_value(key, value, template):
+    if value is None:
+        return "-"
+    if key == "bytes_per_second":
+        return f"{value / 1024 / 1024:.1f}"
+    if key == "peak_rss_bytes":
+        return f"{value / 1024 / 1024:.0f}"
+    return template.format(value)
+
+
+def print_table(rows):
+    header = ["scenario"] + [title for _, title, _ in COLUMNS]
+    lines = [header]
+    for name, result in rows:
+        lines.append(
+            [name]
+            + [
+                format_value(key, result[key], template)
+                for key, title, template in COLUMNS
+            ]
+        )
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    for line in lines:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+
+def median_result(results):
+    merged = dict(results[0])
+    for key, _, _ in COLUMNS:
+        values = [r[key] for r in results if r[key] is not None]
+        merged[key] = statistics.median(values) if values else None
+    return merged
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = {}
+    if args.latency is not None:
+        overrides["latency"] = args.latency
+    if args.rate is not False:
+        overrides["rate"] = args.rate
+    if args.no_ranges:
+        overrides["ranges"] = False
+
+    server = MediaServer().start()
+    rows = []
+    report = {"scale": args.scale, "overrides": overrides, "scenarios": {}}
+    try:
+        with tempfile.TemporaryDirectory(prefix="easy-yt-saver-media-") as workdir:
+            for name in args.scenarios:
+                server.clear()
+                spec = SCENARIOS[name](server, workdir, scale=args.scale, **overrides)
+                if spec is None:
+                    print(f"{name}: skipped, ffmpeg not found", file=sys.stderr)
+                    continue
+                spec["reuse_sessions"] = not args.no_session_reuse
+                results = []
+                for attempt in range(args.repeat):
+                    result = run_scenario(spec)
+                    for error in result["errors"]:
+                        print(f"{name}: {error}", file=sys.stderr)
+                    results.append(result)
+                report["scenarios"][name] = results
+                rows.append((name, median_result(results)))
+    finally:
+        server.stop()
+
+    print_table(rows)
+    if "rate" in overrides:
+        print(f"server rate per connection: {format_rate(overrides['rate'])}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(r["completed"] < r["jobs"] for _, r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Local stand-in for YouTube's metadata and media servers.
+
+Serves ``/info/<video id>.json`` for the stub extractor and the media
+files it points to under ``/media/<name>``. Files are either synthetic
+(a repeating byte pattern of any size, nothing is kept in memory or on
+disk) or real files such as an audio clip for the MP3 scenario. Each
+file has its own latency before the first byte, per-connection rate
+limit and range support.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BLOCK_SIZE = 64 * 1024
+_PATTERN = bytes(range(256)) * (2 * BLOCK_SIZE // 256)
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class MediaFile:
+    """A served file, ``size`` synthetic bytes or the contents of ``path``.
+
+    ``rate`` is in bytes per second per connection, None is unlimited.
+    """
+
+    def __init__(self, name, size=None, path=None, latency=0.0, rate=None, ranges=True):
+        if path is not None:
+            size = os.path.getsize(path)
+        self.name = name
+        self.size = size
+        self.path = path
+        self.latency = latency
+        self.rate = rate
+        self.ranges = ranges
+
+    def blocks(self, start, end):
+        """Yield the bytes from ``start`` to ``end`` (exclusive) in blocks."""
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                while start < end:
+                    block = f.read(min(BLOCK_SIZE, end - start))
+                    if not block:
+                        return
+                    start += len(block)
+                    yield block
+            return
+        while start < end:
+            offset = start % 256
+            count = min(BLOCK_SIZE, end - start)
+            yield _PATTERN[offset : offset + count]
+            start += count
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.media_server
+        server.count_request()
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/info/") and path.endswith(".json"):
+            self._send_info(server, path[len("/info/") : -len(".json")])
+        elif path.startswith("/media/"):
+            self._send_media(server.files.get(path[len("/media/") :]))
+        else:
+            self.send_error(404)
+
+    def _send_info(self, server, video_id):
+        video = server.videos.get(video_id)
+        if video is None:
+            self.send_error(404)
+            return
+        time.sleep(video["latency"])
+        body = json.dumps(server.info(video_id)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_media(self, media):
+        if media is None:
+            self.send_error(404)
+            return
+        time.sleep(media.latency)
+        start, end = 0, media.size
+        match = _RANGE_RE.match(self.headers.get("Range") or "")
+        if match and media.ranges:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)) + 1)
+            if start >= end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{media.size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        if media.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        started = time.monotonic()
+        sent = 0
+        try:
+            for block in media.blocks(start, end):
+                self.wfile.write(block)
+                sent += len(block)
+                if media.rate:
+                    # Sleep until the connection is back on its rate
+                    delay = sent / media.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            # Cancelled downloads and finished ranged requests hang up early
+            self.close_connection = True
+
+
+class MediaServer:
+    """Threaded HTTP server with a catalog of stub videos, run with ``start``."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.files = {}
+        self.videos = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.media_server = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def clear(self):
+        self.files.clear()
+        self.videos.clear()
+
+    def add_video(self, video_id, title, formats, latency=0.0):
+        """Add a video, ``formats`` are yt-dlp format dicts with a ``file``.
+
+        ``file`` is the ``MediaFile`` the format is served from, ``latency``
+        is the delay of the extractor's metadata request.
+        """
+        for fmt in formats:
+            self.files[fmt["file"].name] = fmt["file"]
+        self.videos[video_id] = {
+            "title": title,
+            "formats": formats,
+            "latency": latency,
+        }
+        return self.page_url(video_id)
+
+    def page_url(self, video_id):
+        return f"{self.base_url}/watch?v={video_id}"
+
+    def media_url(self, name):
+        return f"{self.base_url}/media/{name}"
+
+    def info(self, video_id):
+        """The metadata the stub extractor turns into an info dict."""
+        video = self.videos[video_id]
+        formats = []
+        for fmt in video["formats"]:
+            fmt = dict(fmt)
+            media = fmt.pop("file")
+            fmt.update({"url": self.media_url(media.name), "filesize": media.size})
+            formats.append(fmt)
+        return {"id": video_id, "title": video["title"], "formats": formats}
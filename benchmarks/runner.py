@@ -0,0 +1,162 @@
+"""Runs one scenario spec in this process and prints its measurements.
+
+Started by ``python -m benchmarks`` in a fresh interpreter for every run,
+so CPU time and peak RSS only cover the download pipeline: the same
+``run_job``, ``DownloadQueue`` and ``TranscodePool`` the GUI and the CLI
+use. The GUI's progress hook only publishes to a ``ProgressBoard`` that
+the Tk thread samples UI_FPS times a second, the runner samples it the
+same way on a thread and counts the rows a frame would redraw.
+Jobs share a ``SessionPool`` unless the spec sets ``reuse_sessions`` to
+false, then the pool keeps no idle sessions and every job gets new ones.
+Either way the pool counts the HTTP requests and new connections.
+"""
+
+import sys
+import json
+import time
+import logging
+import resource
+import tempfile
+import threading
+
+from download_core import COMPLETED, DownloadJob, DownloadQueue, run_job
+from job_metrics import MetricsRecorder
+from metadata_cache import MetadataCache
+from progress_state import ProgressBoard
+from session_pool import SessionPool
+from transcode_pool import TranscodePool
+
+# Same rate as youtube_downloader.UI_FPS, which can't be imported headless
+UI_FPS = 10
+
+
+class _CountingHandler(logging.Handler):
+    """Counts the records the GUI's log pane would have to append."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def _rusage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children
+
+
+def _peak_rss(usage):
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def run(spec):
+    log_counter = _CountingHandler()
+    logger = logging.getLogger("YouTubeDownloader")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(log_counter)
+
+    board = ProgressBoard()
+    hook_calls = [0]
+
+    def on_progress(job, d):
+        hook_calls[0] += 1
+        board.publish(job)
+
+    # The Tk thread's sample_progress loop
+    frames = {"ticks": 0, "busy_ticks": 0, "rows": 0}
+    stop_sampling = threading.Event()
+
+    def sample():
+        while not stop_sampling.wait(1 / UI_FPS):
+            changed = board.collect()
+            frames["ticks"] += 1
+            if changed:
+                frames["busy_ticks"] += 1
+                frames["rows"] += len(changed)
+
+    cache = MetadataCache(cache_dir=None)
+    if spec.get("reuse_sessions", True):
+        sessions = SessionPool()
+    else:
+        sessions = SessionPool(max_idle=0)
+    metrics = MetricsRecorder()
+    transcoder = TranscodePool(
+        max_workers=spec.get("transcodes", 1),
+        on_update=lambda job: download_queue.notify(job),
+    )
+
+    def run_one(job):
+        run_job(
+            job,
+            on_progress=on_progress,
+            cache=cache,
+            transcoder=transcoder,
+            metrics=metrics,
+            sessions=sessions,
+        )
+
+    download_queue = DownloadQueue(
+        run_one, max_workers=spec.get("jobs", 1), on_update=board.publish
+    )
+
+    with tempfile.TemporaryDirectory(prefix="easy-yt-saver-bench-") as output:
+        sampler = threading.Thread(target=sample, daemon=True)
+        own_before, children_before = _rusage()
+        started = time.perf_counter()
+        sampler.start()
+
+        jobs = [
+            DownloadJob(
+                url,
+                output,
+                spec["file_format"],
+                spec["quality"],
+                connections=spec.get("connections", 1),
+            )
+            for url in spec["urls"]
+        ]
+        for job in jobs:
+            download_queue.submit(job)
+        download_queue.join()
+        transcoder.join()
+
+        wall = time.perf_counter() - started
+        stop_sampling.set()
+        sampler.join()
+        own_after, children_after = _rusage()
+
+    summary = metrics.summary()
+    connection_stats = sessions.connections.snapshot()
+    cpu = (own_after.ru_utime - own_before.ru_utime) + (
+        own_after.ru_stime - own_before.ru_stime
+    )
+    children_cpu = (children_after.ru_utime - children_before.ru_utime) + (
+        children_after.ru_stime - children_before.ru_stime
+    )
+    return {
+        "jobs": len(jobs),
+        "completed": sum(1 for job in jobs if job.state == COMPLETED),
+        "errors": sorted({job.error for job in jobs if job.error}),
+        "wall_seconds": round(wall, 3),
+        "bytes": summary["bytes"],
+        "bytes_per_second": round(summary["bytes"] / wall) if wall else None,
+        "cpu_seconds": round(cpu, 3),
+        "ffmpeg_cpu_seconds": round(children_cpu, 3),
+        "peak_rss_bytes": _peak_rss(own_after),
+        "progress_hooks_per_second": round(hook_calls[0] / wall, 1),
+        "ui_frames_with_changes_per_second": round(frames["busy_ticks"] / wall, 1),
+        "ui_rows_redrawn_per_second": round(frames["rows"] / wall, 1),
+        "log_records_per_second": round(log_counter.count / wall, 1),
+        "http_requests": connection_stats["requests"],
+        "connections": connection_stats["connections"],
+        "connection_reuse": connection_stats["reuse"],
+        "avg_spans": summary["avg_spans"],
+    }
+
+
+if __name__ == "__main__":
+    result = run(json.loads(sys.argv[1]))
+    sys.stdout.write(json.dumps(result) + "\n")
@@ -0,0 +1,143 @@
+"""Benchmark scenarios.
+
+Each scenario adds its videos to the media server and returns the spec
+the runner downloads: the URLs and the job and queue settings. Sizes are
+multiplied by ``scale`` so quick smoke runs and long runs use the same
+scenarios.
+"""
+
+import os
+import shutil
+import subprocess
+
+from benchmarks.media_server import MediaFile
+
+MB = 1024 * 1024
+
+# Native audio and progressive MP4, the formats select_format copies as-is
+AUDIO_FORMAT = {
+    "format_id": "140",
+    "ext": "m4a",
+    "acodec": "mp4a.40.2",
+    "vcodec": "none",
+    "abr": 128,
+}
+VIDEO_FORMAT = {
+    "format_id": "18",
+    "ext": "mp4",
+    "acodec": "mp4a.40.2",
+    "vcodec": "avc1.42001E",
+    "height": 360,
+    "tbr": 600,
+}
+
+
+def _video(server, video_id, fmt, media, latency):
+    return server.add_video(
+        video_id, f"Benchmark {video_id}", [dict(fmt, file=media)], latency=latency
+    )
+
+
+def single_large(server, workdir, scale=1.0, latency=0.05, rate=None, ranges=True):
+    """One big progressive MP4, the single-stream download path."""
+    media = MediaFile(
+        "large.mp4",
+        size=int(256 * MB * scale),
+        latency=latency,
+        rate=rate,
+        ranges=ranges,
+    )
+    return {
+        "urls": [_video(server, "large000001", VIDEO_FORMAT, media, latency)],
+        "file_format": "mp4",
+        "quality": "Best",
+        "jobs": 1,
+    }
+
+
+def many_small(server, workdir, scale=1.0, latency=0.05, rate=None, ranges=True):
+    """Lots of short audio files, extraction and per-job overhead dominate."""
+    count = max(1, int(100 * scale))
+    urls = []
+    for index in range(count):
+        media = MediaFile(
+            f"small{index}.m4a",
+            size=512 * 1024,
+            latency=latency,
+            rate=rate,
+            ranges=ranges,
+        )
+        urls.append(_video(server, f"small{index:06d}", AUDIO_FORMAT, media, latency))
+    return {"urls": urls, "file_format": "audio", "quality": "Best", "jobs": 4}
+
+
+def parallel(server, workdir, scale=1.0, latency=0.05, rate=2 * MB, ranges=True):
+    """Mid-sized videos on throttled connections, several at a time."""
+    count = max(1, int(8 * scale))
+    urls = []
+    for index in range(count):
+        media = MediaFile(
+            f"parallel{index}.mp4",
+            size=int(32 * MB * scale) or MB,
+            latency=latency,
+            rate=rate,
+            ranges=ranges,
+        )
+        urls.append(_video(server, f"para{index:07d}", VIDEO_FORMAT, media, latency))
+    return {
+        "urls": urls,
+        "file_format": "mp4",
+        "quality": "Best",
+        "jobs": 4,
+        "connections": 4,
+    }
+
+
+def mp3_transcode(server, workdir, scale=1.0, latency=0.05, rate=None, ranges=True):
+    """Real AAC audio downloaded and encoded to MP3 by the transcode pool."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    seconds = max(1, int(300 * scale))
+    path = os.path.join(workdir, f"tone{seconds}.m4a")
+    if not os.path.isfile(path):
+        subprocess.run(
+            [
+                ffmpeg,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency=440:duration={seconds}",
+                "-c:a",
+                "aac",
+                "-b:a",
+                "128k",
+                "-y",
+                path,
+            ],
+            check=True,
+        )
+    urls = []
+    for index in range(4):
+        media = MediaFile(
+            f"tone{index}.m4a", path=path, latency=latency, rate=rate, ranges=ranges
+        )
+        urls.append(_video(server, f"tone{index:07d}", AUDIO_FORMAT, media, latency))
+    return {
+        "urls": urls,
+        "file_format": "mp3",
+        "quality": "192kbps",
+        "jobs": 2,
+        "transcodes": 2,
+    }
+
+
+SCENARIOS = {
+    "single-large": single_large,
+    "many-small": many_small,
+    "mp3-transcode": mp3_transcode,
+    "parallel": parallel,
+}
@@ -0,0 +1,24 @@
+"""yt-dlp extractor for the benchmark media server.
+
+yt-dlp loads extractor plugins from ``yt_dlp_plugins`` packages on
+``sys.path`` and tries them before its own extractors, the benchmark
+runner puts the ``benchmarks`` directory on the path to enable it.
+"""
+
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchStubIE(InfoExtractor):
+    IE_NAME = "benchstub"
+    _VALID_URL = r"https?://127\.0\.0\.1:\d+/watch\?v=(?P<id>[0-9A-Za-z_-]+)"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base_url = url.split("/watch", 1)[0]
+        info = self._download_json(f"{base_url}/info/{video_id}.json", video_id)
+        return {
+            "id": video_id,
+            "title": info["title"],
+            "formats": info["formats"],
+            "webpage_url": url,
+        }
@@ -0,0 +1,151 @@
+"""SQLite index of finished downloads.
+
+Every finished download is recorded under its extractor, video ID and
+format/quality profile, together with the file path, size and SHA-256
+of the content. Batches look jobs up here before any network access
+and skip videos that are already on disk.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+_KEY_WHERE = "extractor = ? AND video_id = ? AND profile = ?"
+
+# Output files are named "<title> [<video id>].<ext>"
+_FILENAME_ID_RE = re.compile(r"\[([0-9A-Za-z_-]{11})\]\.(\w+)$")
+
+# File extensions of existing files and the format they count as on import
+IMPORT_FORMATS = {"mp3": "mp3", "mp4": "mp4", "m4a": "audio", "opus": "audio"}
+
+
+def profile_key(file_format, quality):
+    return f"{file_format}/{quality}"
+
+
+def _any_quality(file_format):
+    # Imported files have an unknown quality and match any of their format
+    return profile_key(file_format, "*")
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadArchive:
+    """Thread-safe archive of downloaded videos, keyed by primary key lookups."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    extractor TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    downloaded_at REAL NOT NULL,
+                    PRIMARY KEY (extractor, video_id, profile)
+                )
+                """)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, extractor, video_id, file_format, quality):
+        """Return the archived entry for a video and profile, or None."""
+        with self._lock:
+            for profile in (
+                profile_key(file_format, quality),
+                _any_quality(file_format),
+            ):
+                row = self._db.execute(
+                    f"SELECT * FROM downloads WHERE {_KEY_WHERE}",
+                    (extractor, video_id, profile),
+                ).fetchone()
+                if row is not None:
+                    return dict(row)
+        return None
+
+    def add(self, extractor, video_id, profile, path):
+        """Record a finished file, hashing it on the calling thread."""
+        size = os.path.getsize(path)
+        sha256 = file_sha256(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    extractor,
+                    video_id,
+                    profile,
+                    os.path.abspath(path),
+                    size,
+                    sha256,
+                    time.time(),
+                ),
+            )
+
+    def remove(self, extractor, video_id, profile):
+        with self._lock, self._db:
+            self._db.execute(
+                f"DELETE FROM downloads WHERE {_KEY_WHERE}",
+                (extractor, video_id, profile),
+            )
+
+    def import_directory(self, directory):
+        """Record existing downloads in a directory, returns how many were added.
+
+        Only files named by the default output template, which carries
+        the video ID, can be recognised.
+        """
+        added = 0
+        for name in sorted(os.listdir(directory)):
+            match = _FILENAME_ID_RE.search(name)
+            path = os.path.join(directory, name)
+            if not match or not os.path.isfile(path):
+                continue
+            file_format = IMPORT_FORMATS.get(match.group(2).lower())
+            if file_format is None:
+                continue
+            video_id = match.group(1)
+            if self.lookup("youtube", video_id, file_format, "*") is None:
+                self.add("youtube", video_id, _any_quality(file_format), path)
+                added += 1
+        return added
+
+    def verify(self, remove_bad=False):
+        """Check that archived files still exist with the recorded content.
+
+        Returns a list of ``(entry, problem)`` tuples. With ``remove_bad``
+        the failing entries are dropped so they get downloaded again.
+        """
+        with self._lock:
+            entries = [dict(row) for row in self._db.execute("SELECT * FROM downloads")]
+
+        problems = []
+        for entry in entries:
+            path = entry["path"]
+            if not os.path.isfile(path):
+                problems.append((entry, "missing"))
+            elif os.path.getsize(path) != entry["size"]:
+                problems.append((entry, "size mismatch"))
+            elif file_sha256(path) != entry["sha256"]:
+                problems.append((entry, "hash mismatch"))
+
+        if remove_bad:
+            for entry, _ in problems:
+                self.remove(entry["extractor"], entry["video_id"], entry["profile"])
+        return problems
@@ -0,0 +1,891 @@
+"""Download logic shared by the Tk application and the command line interface.
+
+Nothing in this module may import tkinter or PIL, so headless batch runs
+start fast and work on machines without a display. yt-dlp is imported
+on first use, it takes longer to import than everything else together.
+"""
+
+import os
+import re
+import glob
+import itertools
+import subprocess
+import queue
+import threading
+import time
+import logging
+import sqlite3
+
+from download_archive import profile_key
+from format_selector import select_format
+from job_metrics import JobMetrics
+from progress_state import SpeedMeter, StageStats
+from stream_encode import is_pipeable, pick_stream_format, stream_mp3
+
+MP3_QUALITIES = ["128kbps", "192kbps", "256kbps", "320kbps"]
+MP4_QUALITIES = ["360p", "480p", "720p", "1080p", "Best"]
+# Native audio keeps the downloaded m4a or opus stream, nothing is re-encoded
+AUDIO_QUALITIES = ["128kbps", "160kbps", "Best"]
+
+QUALITIES = {"mp3": MP3_QUALITIES, "mp4": MP4_QUALITIES, "audio": AUDIO_QUALITIES}
+
+# The video ID keeps videos with the same title apart and lets the
+# download archive recognise existing files
+OUTPUT_TEMPLATE = "%(title)s [%(id)s].%(ext)s"
+
+# Job states
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PROCESSING = "processing"
+WAITING_TRANSCODE = "waiting"
+TRANSCODING = "transcoding"
+PAUSED = "paused"
+COMPLETED = "completed"
+SKIPPED = "skipped"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, SKIPPED, FAILED, CANCELLED)
+
+# Read size of rate limited downloads
+THROTTLE_BLOCK_SIZE = 64 * 1024
+RUNNING_STATES = (DOWNLOADING, PROCESSING, WAITING_TRANSCODE, TRANSCODING)
+# yt-dlp downloads into the output name plus this until the file is complete
+PART_SUFFIX = ".part"
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+def is_valid_youtube_url(url):
+    youtube_regex = r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$"
+    return bool(re.match(youtube_regex, url))
+
+
+_VIDEO_ID_RE = re.compile(
+    r"(?:youtu\.be/|youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/))"
+    r"([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])"
+)
+
+
+def extract_video_id(url):
+    """Return the canonical YouTube video ID of a URL, or None for other URLs."""
+    match = _VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def sanitize_filename(filename):
+    # Remove invalid characters for filenames
+    invalid_chars = r'[\\/*?:"<>|]'
+    return re.sub(invalid_chars, "_", filename)
+
+
+def is_part_file(path):
+    return bool(path) and path.endswith(PART_SUFFIX)
+
+
+class DownloadInterrupted(Exception):
+    """Raised from the progress hook to stop a job that was cancelled or paused."""
+
+
+def _terminate(process):
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class DownloadJob:
+    """A single queued download with its own snapshot of the chosen settings."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, url, download_path, file_format, quality, **options):
+        self.id = next(DownloadJob._ids)
+        self.url = url
+        self.download_path = download_path
+        self.file_format = file_format
+        self.quality = quality
+        # Optional per-job settings, e.g. stream_audio=True
+        self.options = options
+        self.title = url
+        self.state = QUEUED
+        self.progress = 0.0
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        # Bandwidth share while downloading, None when unlimited
+        self.rate_limit = None
+        self.speed_meter = SpeedMeter()
+        self.error = None
+        self.last_logged_percent = 0
+        # Seconds spent in each pipeline stage
+        self.timings = {}
+        # Spans and counters of the latest run
+        self.metrics = JobMetrics()
+        self.queued_at = time.monotonic()
+        # CANCELLED or PAUSED while a stop has been requested
+        self.stop_request = None
+        # The .part files yt-dlp wrote for this job, removed again on cancel
+        self.partial_files = set()
+        self._processes = []
+        self._process_lock = threading.Lock()
+
+    @property
+    def is_finished(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "download_path": self.download_path,
+            "file_format": self.file_format,
+            "quality": self.quality,
+            "options": self.options,
+            "title": self.title,
+            "state": self.state,
+            "partial_files": sorted(self.partial_files),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(
+            data["url"],
+            data["download_path"],
+            data["file_format"],
+            data["quality"],
+            **data.get("options", {}),
+        )
+        job.title = data.get("title") or job.url
+        job.partial_files = {
+            path for path in data.get("partial_files", []) if is_part_file(path)
+        }
+        return job
+
+    def request_stop(self, reason):
+        """Ask the running download to stop, ``reason`` is CANCELLED or PAUSED.
+
+        The download notices it on its next progress update, child ffmpeg
+        processes are terminated right away.
+        """
+        with self._process_lock:
+            self.stop_request = reason
+            processes = list(self._processes)
+        for process in processes:
+            _terminate(process)
+
+    def add_process(self, process):
+        with self._process_lock:
+            self._processes = [p for p in self._processes if p.poll() is None]
+            self._processes.append(process)
+            stopping = self.stop_request is not None
+        if stopping:
+            _terminate(process)
+
+    def check_stop(self):
+        if self.stop_request is not None:
+            raise DownloadInterrupted(f"Download {self.stop_request} by user")
+
+    def remove_partial_files(self):
+        """Delete the .part, fragment and ffmpeg temp files of this job.
+
+        The finished files are left alone, a cancel must not delete an
+        output that was already there.
+        """
+        for path in self.partial_files:
+            filename = path[: -len(PART_SUFFIX)]
+            stem = os.path.splitext(filename)[0]
+            # The .part file itself, its fragments and segment state
+            candidates = (
+                glob.glob(glob.escape(path) + "*")
+                + [filename + ".ytdl"]
+                + glob.glob(glob.escape(stem) + ".temp.*")
+            )
+            for candidate in candidates:
+                try:
+                    os.remove(candidate)
+                except OSError:
+                    pass
+        self.partial_files.clear()
+
+
+class WorkerPool:
+    """Resizable pool of worker threads calling ``handle(item)`` per queued item.
+
+    ``pending`` is the ``queue.Queue`` the workers take items from,
+    ``task_done`` is called after each one. ``spawn`` starts missing
+    workers and is called with ``lock`` held, the owner's lock if it
+    guards more than the pool. Surplus workers exit once idle, all of them
+    after ``stop``.
+    """
+
+    def __init__(self, handle, pending, max_workers, lock=None):
+        self.handle = handle
+        self.pending = pending
+        self.lock = lock or threading.Lock()
+        self.stopped = False
+        self._max_workers = max(1, int(max_workers))
+        self._worker_count = 0
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def set_max_workers(self, count):
+        # Extra workers are started right away, surplus ones exit once idle
+        with self.lock:
+            self._max_workers = max(1, int(count))
+            self.spawn()
+
+    def spawn(self):
+        # Called with the lock held
+        while not self.stopped and self._worker_count < self._max_workers:
+            self._worker_count += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def stop(self, timeout=None):
+        """Let the workers exit after their current item and wait for them.
+
+        Items still queued stay queued. Returns False if workers were still
+        busy after ``timeout`` seconds.
+        """
+        with self.lock:
+            self.stopped = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if self._worker_count == 0:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                if self.stopped or self._worker_count > self._max_workers:
+                    self._worker_count -= 1
+                    return
+            try:
+                item = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                self.handle(item)
+            finally:
+                self.pending.task_done()
+
+
+class DownloadQueue:
+    """Runs download jobs on a bounded pool of worker threads.
+
+    ``run_job`` is called on a worker thread for every job, ``on_update``
+    whenever a job is added or one of its workers is done with it.
+    """
+
+    def __init__(self, run_job, max_workers=2, on_update=None, journal=None):
+        self.run_job = run_job
+        self.on_update = on_update
+        self.journal = journal
+        self.stats = StageStats("download")
+        self.jobs = []
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._journal_closed = False
+        # Shares the lock, job state changes and worker starts go together
+        self._workers = WorkerPool(self._run, self._pending, max_workers, self._lock)
+
+    @property
+    def max_workers(self):
+        return self._workers.max_workers
+
+    def set_max_workers(self, count):
+        self._workers.set_max_workers(count)
+
+    def submit(self, job, paused=False):
+        """Add a job, a ``paused`` one is listed but waits for ``resume``."""
+        with self._lock:
+            self.jobs.append(job)
+            job.queued_at = time.monotonic()
+            if paused:
+                job.state = PAUSED
+            else:
+                self._pending.put(job)
+                self._workers.spawn()
+        self.notify(job)
+
+    def restore(self, paused=False):
+        """Submit the unfinished jobs of the journal, return them.
+
+        ``paused`` is whether the restored jobs start paused, or a function
+        that decides it from a job's journal entry. Entries that aren't a
+        valid job are skipped.
+        """
+        jobs = []
+        if not self.journal:
+            return jobs
+        for entry in self.journal.load():
+            try:
+                job = DownloadJob.from_dict(entry)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping invalid journal entry: {str(e)}")
+                continue
+            self.submit(job, paused=paused(entry) if callable(paused) else paused)
+            jobs.append(job)
+        return jobs
+
+    def cancel(self, job):
+        """Cancel a job, stopping it if it's running. Returns True on success."""
+        with self._lock:
+            state = job.state
+            if state in (QUEUED, PAUSED):
+                job.state = CANCELLED
+            elif state not in RUNNING_STATES:
+                return False
+
+        if state in RUNNING_STATES:
+            # The worker marks it cancelled and cleans up once it has stopped
+            job.request_stop(CANCELLED)
+            return True
+
+        job.remove_partial_files()
+        self.notify(job)
+        return True
+
+    def pause(self, job):
+        """Pause a queued or running job, keeping its partial files."""
+        with self._lock:
+            state = job.state
+            if state == QUEUED:
+                job.state = PAUSED
+            elif state not in RUNNING_STATES:
+                return False
+
+        if state in RUNNING_STATES:
+            job.request_stop(PAUSED)
+        else:
+            self.notify(job)
+        return True
+
+    def resume(self, job):
+        """Queue a paused or failed job again, it continues from its .part files."""
+        with self._lock:
+            if job.state not in (PAUSED, FAILED):
+                return False
+            job.state = QUEUED
+            job.stop_request = None
+            job.error = None
+            job.queued_at = time.monotonic()
+            self._pending.put(job)
+            self._workers.spawn()
+        self.notify(job)
+        return True
+
+    def clear_finished(self):
+        with self._lock:
+            removed = [job for job in self.jobs if job.is_finished]
+            self.jobs = [job for job in self.jobs if not job.is_finished]
+        if self.journal:
+            for job in removed:
+                self.journal.forget(job.id)
+        return removed
+
+    def get_job(self, job_id):
+        with self._lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs:
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return counts
+
+    def join(self):
+        """Block until every submitted job has been processed."""
+        self._pending.join()
+
+    def stop(self, timeout=None, resume=()):
+        """Stop the workers once their current job is done, wait for them.
+
+        From then on the journal is left alone, except that the jobs of
+        ``resume`` that ended up paused are journaled as queued, so they
+        continue when the journal is restored. Returns False if workers were
+        still busy after ``timeout`` seconds.
+        """
+        stopped = self._workers.stop(timeout)
+        with self._lock:
+            if self.journal:
+                for job in resume:
+                    if job.state == PAUSED:
+                        self._journal(dict(job.to_dict(), state=QUEUED), job)
+            self._journal_closed = True
+        return stopped
+
+    def notify(self, job):
+        if self.journal:
+            with self._lock:
+                # After stop the journal holds what the next start restores
+                if not self._journal_closed:
+                    self._journal(job.to_dict(), job)
+        if self.on_update:
+            self.on_update(job)
+
+    def _journal(self, entry, job):
+        # Called with the lock held
+        try:
+            if job.state in (COMPLETED, SKIPPED, CANCELLED):
+                self.journal.forget(job.id)
+            else:
+                self.journal.record(job.id, entry)
+        except OSError as e:
+            logger.warning(f"Can't update the job journal: {str(e)}")
+
+    def _run(self, job):
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = DOWNLOADING
+
+        self.notify(job)
+        started = time.monotonic()
+        try:
+            self.run_job(job)
+        finally:
+            # Time blocked on a full transcode queue isn't download work
+            busy = time.monotonic() - started - job.timings.get("handoff_wait", 0.0)
+            self.stats.record(busy, started - job.queued_at)
+            self.notify(job)
+
+
+def build_ydl_opts(
+    job,
+    progress_hook=None,
+    extract_audio=True,
+    choice=None,
+    throttle=None,
+    metrics=None,
+):
+    """Build the yt-dlp options for a job's format, quality and download path.
+
+    With ``extract_audio`` False MP3 jobs only download the audio stream,
+    converting it is left to the transcode stage. ``choice`` is the
+    ``FormatChoice`` to download, without one the format falls back to a
+    yt-dlp format string for the quality. ``throttle(count)`` is called
+    with the bytes downloaded by segmented connections. ``metrics`` (a
+    ``JobMetrics``) gets the postprocessor timings and counts retries.
+    """
+    ydl_opts = {
+        "outtmpl": os.path.join(job.download_path, OUTPUT_TEMPLATE),
+        "progress_hooks": [progress_hook] if progress_hook else [],
+        "quiet": True,
+        "no_warnings": True,
+        # Progress is reported through the hooks, keep stdout clean for the CLI
+        "noprogress": True,
+        # A job is one video, even for a watch URL with a &list= parameter
+        "noplaylist": True,
+    }
+
+    if metrics is not None:
+        ydl_opts["postprocessor_hooks"] = [metrics.postprocessor_hook]
+        ydl_opts["logger"] = metrics.ydl_logger()
+
+    connections = job.options.get("connections", 1)
+    if connections > 1:
+        # Ranged requests for single streams, parallel fragments for DASH/HLS
+        ydl_opts["segmented_connections"] = connections
+        ydl_opts["concurrent_fragment_downloads"] = connections
+
+    if throttle is not None:
+        ydl_opts["throttle"] = throttle
+        # Small fixed blocks, so a rate limit isn't met in multi-MB bursts
+        ydl_opts["buffersize"] = THROTTLE_BLOCK_SIZE
+        ydl_opts["noresizebuffer"] = True
+
+    if job.file_format == "mp3":
+        # Audio download options
+        bitrate = job.quality.replace("kbps", "")
+        ydl_opts["format"] = "bestaudio/best"
+        if extract_audio:
+            ydl_opts["postprocessors"] = [
+                {
+                    "key": "FFmpegExtractAudio",
+                    "preferredcodec": "mp3",
+                    "preferredquality": bitrate,
+                }
+            ]
+    elif job.file_format == "audio":
+        # "best" copies AAC and opus into their own container, no re-encode
+        ydl_opts["format"] = "bestaudio[ext=m4a]/bestaudio"
+        ydl_opts["postprocessors"] = [
+            {"key": "FFmpegExtractAudio", "preferredcodec": "best"}
+        ]
+    else:
+        # Video download options
+        if job.quality == "Best":
+            format_code = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+        else:
+            height = job.quality.replace("p", "")
+            format_code = f"bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}][ext=mp4]/best"
+
+        ydl_opts.update(
+            {
+                "format": format_code,
+                "merge_output_format": "mp4",
+            }
+        )
+
+    if choice is not None:
+        ydl_opts["format"] = choice.format_spec
+    return ydl_opts
+
+
+def update_job_progress(job, d):
+    """Apply a yt-dlp progress hook dict to a job."""
+    if d["status"] == "downloading":
+        title = d.get("info_dict", {}).get("title")
+        if title:
+            job.title = title
+
+        job.downloaded_bytes = d.get("downloaded_bytes") or 0
+        job.total_bytes = d.get("total_bytes") or d.get("total_bytes_estimate")
+        # Smoothed instead of yt-dlp's jumpy per-block speed
+        job.speed = job.speed_meter.update(job.downloaded_bytes)
+        job.eta = job.speed_meter.eta(job.downloaded_bytes, job.total_bytes)
+
+        # Calculate progress
+        if job.total_bytes:
+            job.progress = (job.downloaded_bytes / job.total_bytes) * 100
+
+        # Log progress occasionally (every 10%)
+        if job.downloaded_bytes and d.get("total_bytes"):
+            percentage = int(job.progress)
+            if percentage % 10 == 0 and job.last_logged_percent != percentage:
+                job.last_logged_percent = percentage
+                mb_down = job.downloaded_bytes / 1024 / 1024
+                mb_total = job.total_bytes / 1024 / 1024
+                logger.info(
+                    f"#{job.id}: Downloaded {mb_down:.1f}MB of {mb_total:.1f}MB ({job.progress:.1f}%)"
+                )
+
+    elif d["status"] == "finished":
+        job.state = PROCESSING
+        logger.info(f"Download #{job.id} finished, now processing...")
+
+
+# The job a worker thread is running, so subprocesses can be tied to it
+_current = threading.local()
+_tracker_lock = threading.Lock()
+_tracker_installed = False
+
+
+def _install_process_tracker():
+    """Register every subprocess yt-dlp starts with the job of its thread.
+
+    yt-dlp runs ffmpeg for merging and post-processing through its own
+    ``Popen`` class, wrapping its constructor is the only way to get hold
+    of those processes so they can be terminated on cancel.
+    """
+    global _tracker_installed
+    with _tracker_lock:
+        if _tracker_installed:
+            return
+        import yt_dlp.utils
+
+        popen_class = yt_dlp.utils.Popen
+        original_init = popen_class.__init__
+
+        def __init__(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            job = getattr(_current, "job", None)
+            if job is not None:
+                job.add_process(self)
+
+        popen_class.__init__ = __init__
+        _tracker_installed = True
+
+
+def fetch_info(url, cache=None, ydl=None, metrics=None, sessions=None):
+    """Extract the info dict for a URL without downloading it.
+
+    Single videos are looked up in and stored to ``cache`` (a
+    ``MetadataCache``) by video ID. ``ydl`` is an existing YoutubeDL
+    instance to extract with, without one a session of ``sessions`` (a
+    ``SessionPool``) is used, or a quiet one is created. The cache hit or
+    miss is noted on ``metrics`` (a ``JobMetrics``).
+    """
+    video_id = extract_video_id(url)
+    if cache is not None and video_id:
+        info = cache.get(video_id)
+        if metrics is not None:
+            metrics.cache_hit = info is not None
+        if info is not None:
+            return info
+
+    if ydl is None and sessions is not None:
+        with sessions.session() as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    elif ydl is None:
+        import yt_dlp
+
+        with yt_dlp.YoutubeDL(
+            {"quiet": True, "no_warnings": True, "noplaylist": True}
+        ) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    else:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    if cache is not None and video_id and info.get("_type", "video") == "video":
+        cache.put(video_id, info)
+    return info
+
+
+def final_filepath(info):
+    """Return the path of the finished file for a downloaded info dict."""
+    downloads = info.get("requested_downloads") or [info]
+    return downloads[-1].get("filepath")
+
+
+def archive_download(archive, job, info, path=None):
+    """Record a finished job in a ``DownloadArchive``."""
+    path = path or final_filepath(info)
+    if not path or not os.path.isfile(path) or not info.get("id"):
+        return
+    extractor = (info.get("extractor_key") or "youtube").lower()
+    try:
+        archive.add(
+            extractor, info["id"], profile_key(job.file_format, job.quality), path
+        )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Can't add download #{job.id} to the archive: {str(e)}")
+
+
+def find_archived(archive, job):
+    """Return the archive entry of a job whose file is still on disk, or None."""
+    video_id = extract_video_id(job.url)
+    if not video_id:
+        return None
+    entry = archive.lookup("youtube", video_id, job.file_format, job.quality)
+    if entry is None or not os.path.isfile(entry["path"]):
+        return None
+    return entry
+
+
+def finish_interrupted(job, error):
+    """Set the final state of a job whose run stopped early with ``error``.
+
+    Killing ffmpeg surfaces as an ordinary error, so the job's stop
+    request decides whether it was paused, cancelled or really failed.
+    """
+    if job.stop_request == PAUSED:
+        job.state = PAUSED
+        logger.info(f"Download #{job.id} paused")
+    elif job.stop_request == CANCELLED:
+        job.state = CANCELLED
+        job.remove_partial_files()
+        logger.info(f"Download #{job.id} cancelled")
+    else:
+        job.state = FAILED
+        job.error = error
+        logger.error(f"Download #{job.id} error: {job.error}")
+    job.metrics.finish(job)
+
+
+def format_timings(timings):
+    return ", ".join(
+        f"{stage.replace('_', ' ')} {seconds:.1f}s"
+        for stage, seconds in timings.items()
+    )
+
+
+def try_stream_mp3(job, ydl, info, progress_hook, choice=None):
+    """Encode an MP3 job while it downloads, without an intermediate file.
+
+    Returns the path of the MP3, or None if the audio can't be piped and
+    the job has to take the regular download-then-encode path.
+    """
+    if choice is not None and is_pipeable(choice.formats[0]):
+        fmt = choice.formats[0]
+    else:
+        fmt = pick_stream_format(info)
+    if fmt is None:
+        logger.info(f"#{job.id}: no pipeable audio stream, using the regular MP3 path")
+        return None
+
+    target = ydl.prepare_filename(dict(info, ext="mp3"))
+    logger.info(f"#{job.id}: streaming format {fmt.get('format_id')} into ffmpeg")
+    try:
+        stream_mp3(job, info, fmt, target, progress_hook, ydl)
+    except Exception as e:
+        if job.stop_request is not None:
+            raise
+        logger.warning(
+            f"#{job.id}: streaming failed ({str(e)}), using the regular MP3 path"
+        )
+        return None
+    return target
+
+
+def run_job(
+    job,
+    on_progress=None,
+    cache=None,
+    archive=None,
+    transcoder=None,
+    bandwidth=None,
+    prefetcher=None,
+    metrics=None,
+    sessions=None,
+):
+    """Download a single job on the calling thread.
+
+    ``on_progress(job, d)`` is called after every yt-dlp progress update,
+    once the job itself has been updated. With a ``cache`` the download
+    starts from cached info instead of extracting the video again. With an
+    ``archive`` videos already downloaded in the same profile are skipped
+    without touching the network, and finished ones are recorded. With a
+    ``transcoder`` (a ``TranscodePool``) MP3 jobs hand the downloaded audio
+    to it and return, the pool finishes the job. With ``bandwidth`` (a
+    ``BandwidthScheduler``) the download shares the bandwidth limits with
+    the other running jobs. With a ``prefetcher`` (an ``InfoPrefetcher``)
+    an extraction of the same video already in flight is reused. With
+    ``metrics`` (a ``MetricsRecorder``) the job's spans and counters are
+    reported to it once it finishes. With ``sessions`` (a ``SessionPool``)
+    the job runs in a YoutubeDL instance, and on connections, left open
+    by earlier jobs. Errors are stored on the job instead of being raised.
+    """
+    job.metrics = JobMetrics(metrics)
+    job.metrics.start("total")
+    if archive is not None:
+        entry = find_archived(archive, job)
+        if entry is not None:
+            job.state = SKIPPED
+            job.progress = 100.0
+            logger.info(f"Skipping #{job.id}, already downloaded: {entry['path']}")
+            job.metrics.finish(job)
+            return
+
+    logger.info(f"Starting download #{job.id}: {job.url}")
+    logger.info(f"Format: {job.file_format.upper()}, Quality: {job.quality}")
+
+    def stopping():
+        return job.stop_request is not None
+
+    def throttle(count):
+        bandwidth.consume(job.id, count, stopping)
+
+    # Bytes of each file already accounted for in the bandwidth scheduler,
+    # fragment downloads call the hook from several threads at once
+    throttled_bytes = {}
+    throttled_lock = threading.Lock()
+
+    def progress_hook(d):
+        # Raising here is how a cancel or pause reaches the download
+        job.check_stop()
+        # Only the temporary name, with --no-part it is the output itself
+        if is_part_file(d.get("tmpfilename")):
+            job.partial_files.add(d["tmpfilename"])
+
+        if bandwidth is not None and d["status"] == "downloading":
+            # Segmented downloads are throttled per block on their connections
+            if not d.get("throttled"):
+                key = d.get("tmpfilename") or d.get("filename")
+                downloaded = d.get("downloaded_bytes") or 0
+                with throttled_lock:
+                    count = max(0, downloaded - throttled_bytes.get(key, 0))
+                    if count:
+                        throttled_bytes[key] = downloaded
+                throttle(count)
+            job.rate_limit = bandwidth.rate(job.id)
+            job.check_stop()
+
+        job.metrics.progress(d)
+        update_job_progress(job, d)
+        if on_progress:
+            on_progress(job, d)
+
+    transcode = transcoder is not None and job.file_format == "mp3"
+    stream = job.file_format == "mp3" and job.options.get("stream_audio", False)
+    job.timings.clear()
+
+    def finish(info, path=None):
+        if info and info.get("title"):
+            job.title = info["title"]
+        if "transcode" in job.timings:
+            job.metrics.add("postprocess", job.timings["transcode"])
+        if archive is not None and info:
+            archive_download(archive, job, info, path)
+        job.state = COMPLETED
+        job.progress = 100.0
+        job.partial_files.clear()
+        logger.info(f"Download #{job.id} completed successfully")
+        logger.info(f"#{job.id} timings: {format_timings(job.timings)}")
+        job.metrics.finish(job)
+
+    _install_process_tracker()
+    _current.job = job
+    started = time.monotonic()
+    try:
+        # Resolve once, pick the format from the (possibly cached) info
+        # dict and download from it
+        job.metrics.start("extract")
+        if prefetcher is not None:
+            info = prefetcher.fetch(job.url, job.metrics)
+        else:
+            info = fetch_info(job.url, cache, metrics=job.metrics, sessions=sessions)
+        job.metrics.stop("extract")
+        choice = select_format(info, job.file_format, job.quality)
+        if choice is not None:
+            logger.info(f"#{job.id}: format {choice.format_spec} ({choice.describe()})")
+        ydl_opts = build_ydl_opts(
+            job,
+            progress_hook,
+            extract_audio=not transcode,
+            choice=choice,
+            throttle=throttle if bandwidth is not None else None,
+            metrics=job.metrics,
+        )
+        if bandwidth is not None:
+            bandwidth.register(job.id, job.options.get("rate_limit"))
+
+        if sessions is not None:
+            # An open session of an earlier job, set up with this job's options
+            session = sessions.session(ydl_opts)
+        else:
+            from segmented import SegmentedYoutubeDL
+
+            session = SegmentedYoutubeDL(ydl_opts)
+        with session as ydl:
+            job.metrics.start_transfer()
+            mp3_path = stream and try_stream_mp3(job, ydl, info, progress_hook, choice)
+            if mp3_path:
+                job.timings["download_and_encode"] = time.monotonic() - started
+                finish(info, mp3_path)
+                return
+            info = ydl.process_ie_result(info, download=True)
+            job.metrics.end_transfer()
+
+        job.timings["download"] = time.monotonic() - started
+
+        if transcode:
+            # Free this worker for the next download while ffmpeg encodes
+            waited = transcoder.submit(
+                job, final_filepath(info), lambda path: finish(info, path)
+            )
+            if waited is None:
+                finish_interrupted(job, None)
+            else:
+                job.timings["handoff_wait"] = waited
+        else:
+            finish(info)
+    except Exception as e:
+        finish_interrupted(job, str(e))
+    finally:
+        _current.job = None
+        if bandwidth is not None:
+            bandwidth.unregister(job.id)
+        job.rate_limit = None
@@ -0,0 +1,670 @@
+"""Long-running download service with a local HTTP/JSON API.
+
+The service owns the download queue, the transcode pool, the bandwidth
+scheduler and the caches, so every client shares one set of workers and
+the machine's bandwidth and CPU are scheduled in one place. Downloads
+keep running when a client (e.g. the Tk window) goes away.
+
+Endpoints, all JSON unless noted:
+
+    GET  /health                   service is up
+    GET  /jobs                     all jobs
+    POST /jobs                     submit a video or playlist URL
+    GET  /jobs/<id>                one job
+    POST /jobs/<id>/cancel         also pause, resume
+    POST /jobs/clear               forget the finished jobs
+    POST /playlists/<id>/stop      stop adding a playlist's videos
+    GET  /settings, POST /settings worker counts and bandwidth limits
+    GET  /stats                    queue, stage, cache and job metrics
+    GET  /metrics                  the same in the Prometheus text format
+    GET  /events                   server-sent events, a snapshot first
+
+Only local tools are meant to use it: it listens on 127.0.0.1, rejects
+requests carrying a browser ``Origin`` and POST bodies that aren't JSON,
+so web pages can't submit downloads.
+
+Example:
+
+    python download_service.py --jobs 4 --limit-rate 5M
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import queue
+import logging
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from download_core import (
+    PAUSED,
+    QUALITIES,
+    RUNNING_STATES,
+    DownloadJob,
+    DownloadQueue,
+    is_valid_youtube_url,
+    run_job,
+)
+from bandwidth import BandwidthScheduler, parse_rate
+from download_archive import DownloadArchive
+from job_journal import JobJournal
+from job_metrics import MetricsRecorder
+from metadata_cache import CACHE_DIR, MetadataCache
+from playlist import PlaylistIngest, is_collection_url, parse_items
+from prefetch import InfoPrefetcher
+from progress_state import ProgressBoard
+from session_pool import SessionPool, format_connection_stats
+from transcode_pool import TranscodePool, default_workers
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Progress events per job and second sent to clients, like the GUI's UI_FPS
+EVENT_FPS = 10
+HEARTBEAT_SECONDS = 15
+# A client that falls this far behind the event stream is disconnected
+MAX_PENDING_EVENTS = 1000
+# Options a client may set on a job
+JOB_OPTIONS = ("stream_audio", "connections", "rate_limit")
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+def _parse_count(name, value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(
+            f"Invalid {name}: {value!r}, expected an integer of at least 1"
+        )
+    return value
+
+
+def _parse_limit(name, value):
+    """Bytes per second, 0 or null is no limit, strings like "500K" are parsed."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return parse_rate(value) or 0
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not math.isfinite(value)
+        or value < 0
+    ):
+        raise ValueError(
+            f"Invalid {name}: {value!r}, expected a non-negative number of bytes/s"
+        )
+    return value
+
+
+def parse_settings(data):
+    """Check the body of a POST /settings, raises ValueError.
+
+    ``max_workers`` and ``max_transcodes`` are integers of at least 1,
+    ``rate_limit`` and ``job_rate_limit`` bytes per second like the job
+    option. Other keys are ignored.
+    """
+    parsed = {}
+    for key in ("max_workers", "max_transcodes"):
+        if key in data:
+            parsed[key] = _parse_count(key, data[key])
+    for key in ("rate_limit", "job_rate_limit"):
+        if key in data:
+            parsed[key] = _parse_limit(key, data[key])
+    return parsed
+
+
+def parse_job_options(options):
+    """Check the ``options`` of a POST /jobs body, raises ValueError.
+
+    ``connections`` is an integer of at least 1, ``rate_limit`` bytes per
+    second (0 or null is no limit) or a rate like "500K", ``stream_audio`` a bool.
+    Other keys are ignored.
+    """
+    if not isinstance(options, dict):
+        raise ValueError("Job options must be an object")
+    parsed = {}
+    for key, value in options.items():
+        if key not in JOB_OPTIONS:
+            continue
+        if key == "connections":
+            value = _parse_count(key, value)
+        elif key == "rate_limit":
+            value = _parse_limit(key, value)
+        elif key == "stream_audio":
+            if not isinstance(value, bool):
+                raise ValueError(f"Invalid stream_audio: {value!r}")
+        parsed[key] = value
+    return parsed
+
+
+class _Subscriber:
+    def __init__(self):
+        self.events = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.closed = False
+
+
+class DownloadService:
+    """The shared job queue and worker pools behind the HTTP API."""
+
+    def __init__(
+        self,
+        max_workers=2,
+        max_transcodes=None,
+        rate_limit=None,
+        journal_file=None,
+        archive_file=None,
+        cache_dir=CACHE_DIR,
+        metrics_file=None,
+    ):
+        self.board = ProgressBoard()
+        self.archive = DownloadArchive(archive_file) if archive_file else None
+        self.cache = MetadataCache(cache_dir=cache_dir)
+        # Shared by every client's jobs, so their connections stay warm
+        self.sessions = SessionPool()
+        self.prefetcher = InfoPrefetcher(self.cache, sessions=self.sessions)
+        self.bandwidth = BandwidthScheduler(rate_limit)
+        self.job_rate_limit = 0
+        self.metrics = MetricsRecorder(metrics_file, self.sessions)
+        self.journal = JobJournal(journal_file) if journal_file else None
+        self.transcoder = TranscodePool(
+            max_workers=max_transcodes or default_workers(),
+            on_update=lambda job: self.download_queue.notify(job),
+        )
+        self.download_queue = DownloadQueue(
+            self.run,
+            max_workers=max_workers,
+            on_update=self.board.publish,
+            journal=self.journal,
+        )
+        self.playlists = {}
+        self._playlist_ids = itertools.count(1)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Resume the journaled jobs and start sending events."""
+        # Jobs paused by a client stay paused
+        jobs = self.download_queue.restore(
+            paused=lambda entry: entry.get("state") == PAUSED
+        )
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} unfinished download(s)")
+        threading.Thread(target=self._send_progress, daemon=True).start()
+
+    def shutdown(self, timeout=10):
+        """Pause the running jobs so they continue from the journal next time."""
+        self._stopped.set()
+        for ingest in self.playlists.values():
+            ingest.stop()
+        running = [
+            job for job in self.download_queue.jobs if job.state in RUNNING_STATES
+        ]
+        for job in running:
+            self.download_queue.pause(job)
+        deadline = time.monotonic() + timeout
+        # Encoders report to the download queue, so they stop first. Jobs
+        # interrupted by the shutdown rather than a client resume next time.
+        self.transcoder.stop(timeout)
+        self.download_queue.stop(max(0, deadline - time.monotonic()), resume=running)
+        self.sessions.close()
+        logger.info(format_connection_stats(self.sessions.stats()))
+
+    def run(self, job):
+        """Run a single job, called on a download queue worker thread."""
+        run_job(
+            job,
+            on_progress=lambda job, d: self.board.publish(job),
+            cache=self.cache,
+            archive=self.archive,
+            transcoder=self.transcoder,
+            bandwidth=self.bandwidth,
+            prefetcher=self.prefetcher,
+            metrics=self.metrics,
+            sessions=self.sessions,
+        )
+
+    def job_dict(self, job):
+        return {
+            "id": job.id,
+            "url": job.url,
+            "title": job.title,
+            "download_path": job.download_path,
+            "file_format": job.file_format,
+            "quality": job.quality,
+            "options": job.options,
+            "state": job.state,
+            "progress": round(job.progress, 2),
+            "downloaded_bytes": job.downloaded_bytes,
+            "total_bytes": job.total_bytes,
+            "speed": job.speed,
+            "eta": job.eta,
+            "rate_limit": job.rate_limit,
+            "error": job.error,
+        }
+
+    def playlist_dict(self, playlist_id):
+        ingest = self.playlists[playlist_id]
+        return {
+            "id": playlist_id,
+            "url": ingest.url,
+            "title": ingest.title,
+            "submitted": ingest.submitted,
+            "done": ingest.is_done,
+            "error": ingest.error,
+        }
+
+    def jobs(self):
+        return [self.job_dict(job) for job in list(self.download_queue.jobs)]
+
+    def get_job(self, job_id):
+        job = self.download_queue.get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def submit(self, data):
+        """Queue the job or playlist described by a POST /jobs body.
+
+        Raises ValueError when the request is invalid.
+        """
+        url = str(data.get("url") or "").strip()
+        if not is_valid_youtube_url(url):
+            raise ValueError(f"Invalid YouTube URL: {url}")
+        download_path = data.get("download_path") or ""
+        if not os.path.isdir(download_path):
+            raise ValueError(f"Download path does not exist: {download_path}")
+        file_format = data.get("file_format", "mp3")
+        if file_format not in QUALITIES:
+            raise ValueError(f"Invalid format: {file_format}")
+        quality = data.get("quality") or QUALITIES[file_format][-1]
+        if quality not in QUALITIES[file_format]:
+            raise ValueError(f"Invalid quality {quality} for {file_format}")
+        options = parse_job_options(data.get("options") or {})
+        options.setdefault("rate_limit", self.job_rate_limit)
+
+        def make_job(job_url):
+            return DownloadJob(job_url, download_path, file_format, quality, **options)
+
+        if is_collection_url(url):
+            start, end = parse_items(str(data.get("items") or ""))
+            ingest = PlaylistIngest(url, self.download_queue, make_job, start, end)
+            with self._lock:
+                playlist_id = next(self._playlist_ids)
+                self.playlists[playlist_id] = ingest
+            ingest.start()
+            threading.Thread(
+                target=self._watch_playlist, args=(playlist_id,), daemon=True
+            ).start()
+            logger.info(f"Reading playlist: {url}")
+            return {"playlist": self.playlist_dict(playlist_id)}
+
+        job = make_job(url)
+        if data.get("title"):
+            job.title = data["title"]
+        self.download_queue.submit(job, paused=bool(data.get("paused")))
+        logger.info(f"Queued download #{job.id}: {url}")
+        return {"job": self.job_dict(job)}
+
+    def stop_playlist(self, playlist_id):
+        ingest = self.playlists.get(playlist_id)
+        if ingest is None:
+            raise KeyError(playlist_id)
+        ingest.stop()
+        return self.playlist_dict(playlist_id)
+
+    def job_action(self, job_id, action):
+        """Cancel, pause or resume a job, returns whether it applied."""
+        job = self.get_job(job_id)
+        if action == "cancel":
+            return not job.is_finished and self.download_queue.cancel(job)
+        if action == "pause":
+            return self.download_queue.pause(job)
+        if action == "resume":
+            return self.download_queue.resume(job)
+        raise KeyError(action)
+
+    def clear_finished(self):
+        removed = [job.id for job in self.download_queue.clear_finished()]
+        for job_id in removed:
+            self.board.remove(job_id)
+            self.broadcast({"type": "removed", "id": job_id})
+        return removed
+
+    def settings(self):
+        return {
+            "max_workers": self.download_queue.max_workers,
+            "max_transcodes": self.transcoder.max_workers,
+            "rate_limit": self.bandwidth.global_limit or 0,
+            "job_rate_limit": self.job_rate_limit,
+        }
+
+    def update_settings(self, data):
+        """Apply a POST /settings body, raises ValueError before changing anything."""
+        data = parse_settings(data)
+        if "max_workers" in data:
+            self.download_queue.set_max_workers(data["max_workers"])
+        if "max_transcodes" in data:
+            self.transcoder.set_max_workers(data["max_transcodes"])
+        if "rate_limit" in data:
+            self.bandwidth.set_global_limit(data["rate_limit"])
+        if "job_rate_limit" in data:
+            self.job_rate_limit = data["job_rate_limit"]
+            # The per-download limit also applies to queued and running jobs
+            for job in list(self.download_queue.jobs):
+                if not job.is_finished:
+                    job.options["rate_limit"] = self.job_rate_limit
+                    self.bandwidth.set_job_limit(job.id, self.job_rate_limit)
+        settings = self.settings()
+        self.broadcast({"type": "settings", "settings": settings})
+        return settings
+
+    def stats(self):
+        return {
+            "counts": self.download_queue.counts(),
+            "stages": [
+                self.download_queue.stats.summary(self.download_queue.max_workers),
+                self.transcoder.stats.summary(self.transcoder.max_workers),
+            ],
+            "cache": self.cache.stats(),
+            "metrics": self.metrics.summary(),
+        }
+
+    def subscribe(self):
+        subscriber = _Subscriber()
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def snapshot(self):
+        return {
+            "type": "snapshot",
+            "jobs": self.jobs(),
+            "playlists": [self.playlist_dict(pid) for pid in list(self.playlists)],
+            "settings": self.settings(),
+            "stats": self.stats(),
+        }
+
+    def broadcast(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.events.put_nowait(event)
+            except queue.Full:
+                subscriber.closed = True
+                self.unsubscribe(subscriber)
+
+    def _send_progress(self):
+        # Coalesce hook updates to at most EVENT_FPS events per job and second
+        while not self._stopped.wait(1 / EVENT_FPS):
+            finished = False
+            for job_id in self.board.collect():
+                job = self.download_queue.get_job(job_id)
+                if job is not None:
+                    self.broadcast({"type": "job", "job": self.job_dict(job)})
+                    finished = finished or job.is_finished
+            if finished:
+                # Clients show the session totals without polling /stats
+                self.broadcast({"type": "stats", "stats": self.stats()})
+
+    def _watch_playlist(self, playlist_id):
+        ingest = self.playlists[playlist_id]
+        submitted = -1
+        while True:
+            done = ingest.is_done
+            if ingest.submitted != submitted or done:
+                submitted = ingest.submitted
+                self.broadcast(
+                    {"type": "playlist", "playlist": self.playlist_dict(playlist_id)}
+                )
+            if done:
+                return
+            time.sleep(1)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "easy-yt-saver"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json({"error": message}, status)
+
+    def _allowed(self):
+        # Browsers add an Origin to cross-site requests, local tools don't
+        if self.headers.get("Origin") is not None:
+            self._send_error(403, "Browser requests are not allowed")
+            return False
+        return True
+
+    def _read_json(self):
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0]
+        if content_type.strip() != "application/json":
+            raise ValueError("Expected an application/json body")
+        length = int(self.headers.get("Content-Length") or 0)
+        data = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return data
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        service = self.service
+        try:
+            if parts == ["health"]:
+                self._send_json({"status": "ok"})
+            elif parts == ["jobs"]:
+                self._send_json({"jobs": service.jobs()})
+            elif len(parts) == 2 and parts[0] == "jobs":
+                self._send_json(
+                    {"job": service.job_dict(service.get_job(int(parts[1])))}
+                )
+            elif parts == ["settings"]:
+                self._send_json(service.settings())
+            elif parts == ["stats"]:
+                self._send_json(service.stats())
+            elif parts == ["metrics"]:
+                body = service.metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif parts == ["events"]:
+                self._stream_events()
+            else:
+                self._send_error(404, "Not found")
+        except (KeyError, ValueError):
+            self._send_error(404, "Not found")
+
+    def do_POST(self):
+        if not self._allowed():
+            return
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        service = self.service
+        try:
+            data = self._read_json()
+        except ValueError as e:
+            self._send_error(415, str(e))
+            return
+        try:
+            if parts == ["jobs"]:
+                self._send_json(service.submit(data), 201)
+            elif parts == ["jobs", "clear"]:
+                self._send_json({"removed": service.clear_finished()})
+            elif len(parts) == 3 and parts[0] == "jobs":
+                job_id = int(parts[1])
+                applied = service.job_action(job_id, parts[2])
+                job = service.get_job(job_id)
+                self._send_json({"applied": applied, "job": service.job_dict(job)})
+            elif len(parts) == 3 and parts[0] == "playlists" and parts[2] == "stop":
+                self._send_json({"playlist": service.stop_playlist(int(parts[1]))})
+            elif parts == ["settings"]:
+                self._send_json(service.update_settings(data))
+            else:
+                self._send_error(404, "Not found")
+        except KeyError:
+            self._send_error(404, "Not found")
+        except (TypeError, ValueError) as e:
+            self._send_error(400, str(e))
+
+    def _write_event(self, event):
+        self.wfile.write(
+            f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
+        )
+        self.wfile.flush()
+
+    def _stream_events(self):
+        subscriber = self.service.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self._write_event(self.service.snapshot())
+            last_write = time.monotonic()
+            while not subscriber.closed:
+                try:
+                    event = subscriber.events.get(timeout=1)
+                except queue.Empty:
+                    if time.monotonic() - last_write >= HEARTBEAT_SECONDS:
+                        self.wfile.write(b": keep-alive\n\n")
+                        self.wfile.flush()
+                        last_write = time.monotonic()
+                    continue
+                self._write_event(event)
+                last_write = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.service.unsubscribe(subscriber)
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.service = service
+        super().__init__((host, port), _Handler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the download queue as a local service with an HTTP API."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="default: 127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"default: {DEFAULT_PORT}"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=2, help="parallel downloads (default: 2)"
+    )
+    parser.add_argument(
+        "--transcodes",
+        type=int,
+        default=default_workers(),
+        help="parallel MP3 encodes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--limit-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="total bandwidth of all downloads together, e.g. 500K or 2M",
+    )
+    parser.add_argument(
+        "--journal",
+        default="service_jobs.json",
+        metavar="PATH",
+        help="unfinished jobs, resumed on the next start "
+        "(default: service_jobs.json)",
+    )
+    parser.add_argument(
+        "--archive",
+        default="archive.sqlite3",
+        metavar="PATH",
+        help="download archive, videos already in it are skipped "
+        "(default: archive.sqlite3)",
+    )
+    parser.add_argument(
+        "--no-archive", action="store_true", help="don't use the download archive"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't read or write the on-disk metadata cache",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="append the metrics of every finished job to PATH as JSON lines",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.transcodes < 1:
+        parser.error("--transcodes must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        stream=sys.stderr,
+    )
+
+    service = DownloadService(
+        max_workers=args.jobs,
+        max_transcodes=args.transcodes,
+        rate_limit=args.limit_rate,
+        journal_file=args.journal,
+        archive_file=None if args.no_archive else args.archive,
+        cache_dir=None if args.no_cache else CACHE_DIR,
+        metrics_file=args.metrics,
+    )
+    try:
+        server = ServiceServer(service, args.host, args.port)
+    except OSError as e:
+        logger.error(f"Can't listen on {args.host}:{args.port}: {str(e)}")
+        return 2
+    service.start()
+    logger.info(f"Download service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Stopping, running downloads are paused")
+        service.shutdown()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
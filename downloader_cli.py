@@ -0,0 +1,420 @@
+"""Headless batch downloader.
+
+Reads URLs from a file or stdin and downloads them in parallel without
+importing tkinter or PIL. Progress is written to stdout as JSON lines,
+human readable log messages go to stderr.
+
+Example:
+
+    python downloader_cli.py urls.txt --jobs 4 --format mp3 --quality 192kbps
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from download_core import (
+    COMPLETED,
+    FAILED,
+    SKIPPED,
+    AUDIO_QUALITIES,
+    MP3_QUALITIES,
+    MP4_QUALITIES,
+    QUALITIES,
+    DownloadJob,
+    DownloadQueue,
+    is_valid_youtube_url,
+    run_job,
+)
+from bandwidth import BandwidthScheduler, parse_rate
+from download_archive import DownloadArchive
+from job_journal import JobJournal
+from job_metrics import MetricsRecorder
+from metadata_cache import CACHE_DIR, MetadataCache
+from playlist import PlaylistIngest, is_collection_url, parse_items
+from session_pool import SessionPool, format_connection_stats
+from transcode_pool import TranscodePool, default_workers
+
+
+class JsonProgressWriter:
+    """Writes one JSON object per line for job events and progress updates."""
+
+    def __init__(self, stream, interval=1.0):
+        self.stream = stream
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_emit = {}
+
+    def emit(self, event, job=None, **fields):
+        record = {"event": event, "time": round(time.time(), 3)}
+        if job is not None:
+            record.update({"job": job.id, "url": job.url, "state": job.state})
+        record.update(fields)
+        with self._lock:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+    def progress(self, job, d):
+        # Throttle per job so fast downloads don't flood the output
+        now = time.monotonic()
+        if d["status"] == "downloading":
+            if now - self._last_emit.get(job.id, 0) < self.interval:
+                return
+            self._last_emit[job.id] = now
+        self.emit(
+            "progress",
+            job,
+            title=job.title,
+            percent=round(job.progress, 1),
+            downloaded_bytes=job.downloaded_bytes,
+            total_bytes=job.total_bytes,
+            speed=round(job.speed) if job.speed is not None else None,
+            eta=round(job.eta) if job.eta is not None else None,
+            rate_limit=round(job.rate_limit) if job.rate_limit is not None else None,
+        )
+
+
+def read_urls(source):
+    """Yield URLs from an iterable of lines, skipping blanks and # comments."""
+    for line in source:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download a list of YouTube URLs without the GUI."
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="file with one URL per line, '-' or omitted reads stdin",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=os.path.join(os.path.expanduser("~"), "Downloads"),
+        help="download directory (default: ~/Downloads)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sorted(QUALITIES),
+        default="mp3",
+        dest="file_format",
+        help="mp3, mp4, or audio for the native m4a/opus stream without "
+        "re-encoding (default: mp3)",
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        help="quality, one of %s for mp3, %s for mp4 or %s for audio "
+        "(default: highest)"
+        % (
+            ", ".join(MP3_QUALITIES),
+            ", ".join(MP4_QUALITIES),
+            ", ".join(AUDIO_QUALITIES),
+        ),
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=2, help="parallel downloads (default: 2)"
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        default=1,
+        help="connections per download, more than one downloads each stream "
+        "in parallel ranges or fragments (default: 1)",
+    )
+    parser.add_argument(
+        "--limit-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="total bandwidth of all downloads together, e.g. 500K or 2M",
+    )
+    parser.add_argument(
+        "--job-limit-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="bandwidth of each single download, e.g. 200K",
+    )
+    parser.add_argument(
+        "--stream-mp3",
+        action="store_true",
+        help="pipe the audio into ffmpeg while it downloads instead of encoding "
+        "a finished temporary file",
+    )
+    parser.add_argument(
+        "--transcodes",
+        type=int,
+        default=default_workers(),
+        help="parallel MP3 encodes, separate from --jobs (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't read or write the on-disk metadata cache",
+    )
+    parser.add_argument(
+        "--archive",
+        default="archive.sqlite3",
+        metavar="PATH",
+        help="download archive, videos already in it are skipped "
+        "(default: archive.sqlite3)",
+    )
+    parser.add_argument(
+        "--no-archive", action="store_true", help="don't use the download archive"
+    )
+    parser.add_argument(
+        "--archive-import",
+        metavar="DIR",
+        help="add the existing downloads in DIR to the archive and exit",
+    )
+    parser.add_argument(
+        "--archive-verify",
+        action="store_true",
+        help="check that archived files still exist and match their hash, then exit",
+    )
+    parser.add_argument(
+        "--archive-prune",
+        action="store_true",
+        help="with --archive-verify, drop the entries that failed the check",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="PATH",
+        help="record unfinished jobs in PATH and first resume the ones left "
+        "there by an interrupted run",
+    )
+    parser.add_argument(
+        "--items",
+        default="",
+        metavar="RANGE",
+        help="playlist and channel items to download, e.g. 100-500 or 100- "
+        "(default: all)",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="append the timings, bytes and retries of every finished job to "
+        "PATH as JSON lines",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="PATH",
+        help="write the session totals to PATH in the Prometheus text format "
+        "when done",
+    )
+    parser.add_argument(
+        "--progress",
+        choices=["jsonl", "none"],
+        default="jsonl",
+        help="progress output on stdout (default: jsonl)",
+    )
+    args = parser.parse_args(argv)
+
+    qualities = QUALITIES[args.file_format]
+    if args.quality is None:
+        args.quality = qualities[-1]
+    elif args.quality not in qualities:
+        parser.error(f"invalid quality {args.quality!r} for {args.file_format}")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.connections < 1:
+        parser.error("--connections must be at least 1")
+    if args.transcodes < 1:
+        parser.error("--transcodes must be at least 1")
+    try:
+        args.items = parse_items(args.items)
+    except ValueError:
+        parser.error(f"invalid --items range {args.items!r}")
+    return args
+
+
+def run_archive_command(args, archive):
+    """Import a directory into, or verify, the download archive."""
+    logger = logging.getLogger("YouTubeDownloader")
+
+    if args.archive_import:
+        if not os.path.isdir(args.archive_import):
+            logger.error(f"Directory does not exist: {args.archive_import}")
+            return 2
+        added = archive.import_directory(args.archive_import)
+        logger.info(f"Imported {added} file(s) from {args.archive_import}")
+
+    if args.archive_verify:
+        problems = archive.verify(remove_bad=args.archive_prune)
+        for entry, problem in problems:
+            print(json.dumps({"event": "archive_problem", "problem": problem, **entry}))
+        logger.info(
+            f"Archive check found {len(problems)} problem(s)"
+            + (", entries removed" if args.archive_prune and problems else "")
+        )
+        return 1 if problems else 0
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        stream=sys.stderr,
+    )
+    logger = logging.getLogger("YouTubeDownloader")
+
+    archive = None if args.no_archive else DownloadArchive(args.archive)
+    if args.archive_import or args.archive_verify:
+        if archive is None:
+            logger.error("--archive-import and --archive-verify need the archive")
+            return 2
+        return run_archive_command(args, archive)
+
+    if not os.path.isdir(args.output):
+        logger.error(f"Download path does not exist: {args.output}")
+        return 2
+
+    if args.progress == "jsonl":
+        writer = JsonProgressWriter(sys.stdout)
+    else:
+        writer = None
+
+    def on_update(job):
+        if writer and job.is_finished:
+            job_metrics = job.metrics.to_dict(job)
+            writer.emit(
+                job.state,
+                job,
+                title=job.title,
+                error=job.error,
+                timings={stage: round(t, 2) for stage, t in job.timings.items()},
+                spans=job_metrics["spans"],
+                bytes=job_metrics["bytes"],
+                throughput=job_metrics["throughput"],
+                retries=job_metrics["retries"],
+                playlist_index=job.options.get("playlist_index"),
+            )
+
+    cache = MetadataCache(cache_dir=None if args.no_cache else CACHE_DIR)
+    bandwidth = BandwidthScheduler(args.limit_rate)
+    # Jobs reuse the YoutubeDL instances and connections of finished ones
+    sessions = SessionPool()
+    metrics = MetricsRecorder(args.metrics, sessions)
+
+    def run(job):
+        run_job(
+            job,
+            on_progress=writer.progress if writer else None,
+            cache=cache,
+            archive=archive,
+            transcoder=transcoder,
+            bandwidth=bandwidth,
+            metrics=metrics,
+            sessions=sessions,
+        )
+
+    journal = JobJournal(args.journal) if args.journal else None
+    transcoder = TranscodePool(
+        max_workers=args.transcodes,
+        on_update=lambda job: download_queue.notify(job),
+    )
+    download_queue = DownloadQueue(
+        run, max_workers=args.jobs, on_update=on_update, journal=journal
+    )
+
+    # Interrupted jobs continue from their .part files
+    for job in download_queue.restore():
+        if writer:
+            writer.emit("resumed", job)
+
+    if args.input == "-":
+        urls = list(read_urls(sys.stdin))
+    else:
+        with open(args.input, "r") as f:
+            urls = list(read_urls(f))
+
+    def make_job(url):
+        return DownloadJob(
+            url,
+            args.output,
+            args.file_format,
+            args.quality,
+            stream_audio=args.stream_mp3,
+            connections=args.connections,
+            rate_limit=args.job_limit_rate,
+        )
+
+    invalid = 0
+    ingests = []
+    for url in urls:
+        if not is_valid_youtube_url(url):
+            logger.error(f"Invalid YouTube URL: {url}")
+            if writer:
+                writer.emit("invalid", url=url)
+            invalid += 1
+            continue
+        if is_collection_url(url):
+            # Entries are added page by page while the queue drains
+            ingest = PlaylistIngest(url, download_queue, make_job, *args.items)
+            ingest.start()
+            ingests.append(ingest)
+            continue
+        job = make_job(url)
+        download_queue.submit(job)
+        if writer:
+            writer.emit("queued", job)
+
+    started = time.monotonic()
+    for ingest in ingests:
+        ingest.join()
+        if ingest.error:
+            invalid += 1
+        if writer:
+            writer.emit(
+                "playlist",
+                url=ingest.url,
+                title=ingest.title,
+                queued=ingest.submitted,
+                error=ingest.error,
+            )
+    download_queue.join()
+    # Every MP3 has been handed over once the downloads are done
+    transcoder.join()
+    sessions.close()
+    logger.info(format_connection_stats(sessions.stats()))
+
+    counts = download_queue.counts()
+    if args.prometheus:
+        try:
+            metrics.write_prometheus(args.prometheus)
+        except OSError as e:
+            logger.error(f"Can't write {args.prometheus}: {str(e)}")
+    if writer:
+        writer.emit(
+            "summary",
+            completed=counts.get(COMPLETED, 0),
+            skipped=counts.get(SKIPPED, 0),
+            failed=counts.get(FAILED, 0),
+            invalid=invalid,
+            seconds=round(time.monotonic() - started, 2),
+            cache=cache.stats(),
+            metrics=metrics.summary(),
+            stages=[
+                download_queue.stats.summary(args.jobs),
+                transcoder.stats.summary(args.transcodes),
+            ],
+        )
+    return 1 if counts.get(FAILED, 0) or invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
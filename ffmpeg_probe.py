@@ -0,0 +1,108 @@
+"""FFmpeg capability probe.
+
+Running ``ffmpeg`` a couple of times costs from tens of milliseconds to
+seconds on a cold disk, so the result (version, encoders, whether
+ffprobe is there) is cached on disk, keyed by the path and modification
+time of both binaries. Upgrading or moving ffmpeg invalidates it.
+"""
+
+import os
+import re
+import json
+import shutil
+import subprocess
+
+from metadata_cache import CACHE_DIR
+
+CACHE_FILE = os.path.join(CACHE_DIR, "ffmpeg.json")
+PROBE_TIMEOUT = 15
+
+# " A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3)"
+_ENCODER_RE = re.compile(r"^\s*([VAS])[F.][S.][X.][B.][D.]\s+(\S+)")
+
+
+def _binary_key(name):
+    path = shutil.which(name)
+    if path is None:
+        return None, None
+    try:
+        return path, os.stat(path).st_mtime
+    except OSError:
+        return None, None
+
+
+def _run(args):
+    result = subprocess.run(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        timeout=PROBE_TIMEOUT,
+    )
+    return result.stdout.decode("utf-8", "replace")
+
+
+def _probe(ffmpeg_path):
+    version_output = _run([ffmpeg_path, "-hide_banner", "-version"])
+    first_line = version_output.splitlines()[0] if version_output else ""
+    match = re.match(r"ffmpeg version (\S+)", first_line)
+    encoders = []
+    for line in _run([ffmpeg_path, "-hide_banner", "-encoders"]).splitlines():
+        match_encoder = _ENCODER_RE.match(line)
+        if match_encoder and match_encoder.group(2) != "=":
+            encoders.append(match_encoder.group(2))
+    return {
+        "version": match.group(1) if match else first_line,
+        "encoders": encoders,
+    }
+
+
+def _missing(ffprobe_path):
+    return {
+        "ffmpeg": None,
+        "ffprobe": ffprobe_path,
+        "version": None,
+        "encoders": [],
+        "cached": False,
+    }
+
+
+def probe_ffmpeg(cache_file=CACHE_FILE):
+    """Return what the installed FFmpeg can do.
+
+    The dict has ``ffmpeg`` and ``ffprobe`` (paths or None), ``version``,
+    ``encoders`` and ``cached`` (whether it came from the cache). Blocks
+    while ffmpeg runs, call it off the UI thread.
+    """
+    ffmpeg_path, ffmpeg_mtime = _binary_key("ffmpeg")
+    ffprobe_path, ffprobe_mtime = _binary_key("ffprobe")
+    key = [ffmpeg_path, ffmpeg_mtime, ffprobe_path, ffprobe_mtime]
+    if ffmpeg_path is None:
+        return _missing(ffprobe_path)
+
+    if cache_file:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("key") == key:
+                return dict(data["result"], cached=True)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    try:
+        result = _probe(ffmpeg_path)
+    except (OSError, subprocess.SubprocessError):
+        # Found but doesn't run, treat it like a missing ffmpeg
+        return _missing(ffprobe_path)
+    result.update({"ffmpeg": ffmpeg_path, "ffprobe": ffprobe_path})
+
+    if cache_file:
+        tmp_path = f"{cache_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "result": result}, f)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            pass
+    return dict(result, cached=False)
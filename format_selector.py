@@ -0,0 +1,202 @@
+"""Pick the cheapest download format that still meets the requested quality.
+
+Fixed yt-dlp format strings can't tell a stream that only needs copying
+from one that has to be re-encoded, and their ``/best`` fallback can pull
+a far bigger format than the requested height. Here the format list of
+an info dict is ranked by post-processing cost (copy, remux, re-encode)
+and estimated download size instead, and every choice carries a short
+explanation for the log.
+"""
+
+import math
+
+# What it takes to turn the downloaded streams into the result, cheapest first
+COPY = "copy"
+REMUX = "remux"
+ENCODE = "encode"
+COSTS = {COPY: 0, REMUX: 1, ENCODE: 2}
+
+# A stream counts as meeting a bitrate this close below it, YouTube's
+# "128k" AAC stream reports about 129 and its opus ones vary
+ABR_TOLERANCE = 0.95
+
+# Audio codecs kept as they are by the native audio profile
+NATIVE_AUDIO_CODECS = ("mp4a", "opus")
+
+
+def _is_audio_only(fmt):
+    return fmt.get("vcodec") == "none" and fmt.get("acodec") not in (None, "none")
+
+
+def _is_video_only(fmt):
+    return fmt.get("vcodec") not in (None, "none") and fmt.get("acodec") == "none"
+
+
+def _is_progressive(fmt):
+    return fmt.get("vcodec") not in (None, "none") and fmt.get("acodec") not in (
+        None,
+        "none",
+    )
+
+
+def _abr(fmt):
+    return fmt.get("abr") or fmt.get("tbr") or 0
+
+
+def estimated_size(fmt, duration):
+    """Return the expected size of a format in bytes, or None if unknown."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return size
+    tbr = fmt.get("tbr") or (fmt.get("abr") or 0) + (fmt.get("vbr") or 0)
+    if tbr and duration:
+        return tbr * 1000 / 8 * duration
+    return None
+
+
+def _format_mb(size):
+    return f"~{size / 1024 / 1024:.1f} MB" if size else "size unknown"
+
+
+class FormatChoice:
+    """The format(s) to download, video first, and their post-processing cost."""
+
+    def __init__(self, formats, cost, duration):
+        self.formats = formats
+        self.cost = cost
+        sizes = [estimated_size(fmt, duration) for fmt in formats]
+        self.size = None if None in sizes else sum(sizes)
+        self.reason = ""
+
+    @property
+    def format_spec(self):
+        return "+".join(fmt["format_id"] for fmt in self.formats)
+
+    def rank(self):
+        # Unknown sizes sort after every known one of the same cost
+        return (COSTS[self.cost], self.size if self.size else math.inf)
+
+    def describe(self):
+        parts = []
+        for fmt in self.formats:
+            if fmt.get("vcodec") not in (None, "none"):
+                parts.append(f"{fmt.get('height')}p {fmt.get('ext')}")
+            else:
+                parts.append(f"{fmt.get('ext')} {_abr(fmt):.0f}kbps")
+        return (
+            f"{' + '.join(parts)}, {_format_mb(self.size)}, {self.cost}: {self.reason}"
+        )
+
+
+def _pick_audio(choices, target_abr):
+    """The cheapest choice with at least ``target_abr``, else the best one."""
+    meets = [
+        choice
+        for choice in choices
+        if _abr(choice.formats[0]) >= target_abr * ABR_TOLERANCE
+    ]
+    if meets:
+        best = min(meets, key=FormatChoice.rank)
+        best.reason = (
+            f"cheapest of {len(meets)} stream(s) at or above {target_abr:.0f}kbps"
+        )
+        return best
+    best = max(
+        choices, key=lambda choice: (_abr(choice.formats[0]), -COSTS[choice.cost])
+    )
+    best.reason = "highest bitrate available"
+    return best
+
+
+def _select_mp3(formats, quality, duration):
+    target = int(quality.replace("kbps", ""))
+    sources = [fmt for fmt in formats if _is_audio_only(fmt)]
+    choices = [
+        FormatChoice([fmt], COPY if fmt.get("acodec") == "mp3" else ENCODE, duration)
+        for fmt in sources
+    ]
+    if not choices:
+        return None
+    return _pick_audio(choices, target)
+
+
+def _select_native_audio(formats, quality, duration):
+    target = math.inf if quality == "Best" else int(quality.replace("kbps", ""))
+    choices = []
+    for fmt in formats:
+        if not _is_audio_only(fmt):
+            continue
+        if not fmt.get("acodec", "").startswith(NATIVE_AUDIO_CODECS):
+            continue
+        # .m4a is kept as downloaded, opus is copied out of its .webm
+        cost = COPY if fmt.get("ext") in ("m4a", "opus") else REMUX
+        choices.append(FormatChoice([fmt], cost, duration))
+    if not choices:
+        return None
+    return _pick_audio(choices, target)
+
+
+def _select_mp4(formats, quality, duration):
+    target = None if quality == "Best" else int(quality.replace("p", ""))
+
+    # Only streams that go into an MP4 without re-encoding
+    audio = [fmt for fmt in formats if _is_audio_only(fmt) and fmt.get("ext") == "m4a"]
+    best_audio = max(audio, key=_abr) if audio else None
+    choices = [
+        FormatChoice([fmt], COPY, duration)
+        for fmt in formats
+        if _is_progressive(fmt) and fmt.get("ext") == "mp4" and fmt.get("height")
+    ]
+    if best_audio is not None:
+        choices += [
+            FormatChoice([fmt, best_audio], REMUX, duration)
+            for fmt in formats
+            if _is_video_only(fmt) and fmt.get("ext") == "mp4" and fmt.get("height")
+        ]
+    if not choices:
+        return None
+
+    def height(choice):
+        return choice.formats[0]["height"]
+
+    fitting = [
+        choice for choice in choices if target is None or height(choice) <= target
+    ]
+    if fitting:
+        chosen_height = max(height(choice) for choice in fitting)
+        why = (
+            f"highest resolution at or below {target}p"
+            if target
+            else "highest resolution"
+        )
+    else:
+        # Nothing small enough, take the smallest instead of whatever is best
+        chosen_height = min(height(choice) for choice in choices)
+        why = f"nothing at or below {target}p, smallest available"
+
+    candidates = [choice for choice in choices if height(choice) == chosen_height]
+    best = min(candidates, key=FormatChoice.rank)
+    best.reason = f"{why}, cheapest of {len(candidates)} candidate(s)"
+    return best
+
+
+_SELECTORS = {
+    "mp3": _select_mp3,
+    "audio": _select_native_audio,
+    "mp4": _select_mp4,
+}
+
+
+def select_format(info, file_format, quality):
+    """Return the ``FormatChoice`` for a job, or None without usable formats.
+
+    On None the caller falls back to a plain yt-dlp format string.
+    """
+    formats = [
+        fmt
+        for fmt in info.get("formats") or []
+        if fmt.get("format_id") and fmt.get("protocol") != "mhtml"
+    ]
+    if not formats:
+        return None
+    return _SELECTORS[file_format](formats, quality, info.get("duration"))
@@ -0,0 +1,52 @@
+"""On-disk journal of unfinished download jobs.
+
+The download queue records every job that is not done yet, so queued,
+paused or interrupted downloads can be restored after a restart and
+continue from their ``.part`` files instead of starting over.
+"""
+
+import os
+import json
+import threading
+
+
+class JobJournal:
+    """JSON file with one entry per unfinished job, rewritten atomically."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the job entries left over from the previous run."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):
+            return []
+        return [
+            entry for entry in entries if isinstance(entry, dict) and entry.get("url")
+        ]
+
+    def record(self, job_id, entry):
+        with self._lock:
+            self._entries[job_id] = entry
+            self._save()
+
+    def forget(self, job_id):
+        with self._lock:
+            if self._entries.pop(job_id, None) is not None:
+                self._save()
+
+    def _save(self):
+        # Called with the lock held
+        tmp_path = f"{self.path}.tmp"
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._entries.values()), f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,320 @@
+"""Structured per-job metrics and their export.
+
+Every run of a job collects timing spans (extract, first byte, transfer,
+merge, postprocess, total), the bytes it downloaded, retries and whether
+the info dict came from the cache. ``MetricsRecorder`` keeps session
+totals, appends one JSON line per finished job and renders a Prometheus
+text snapshot of the totals, with the connection counters of a
+``SessionPool`` if there is one.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+SPANS = ("extract", "first_byte", "transfer", "merge", "postprocess", "total")
+# Finished jobs are reported with these states
+STATES = ("completed", "skipped", "failed", "cancelled", "paused")
+
+PROMETHEUS_PREFIX = "easy_yt_saver"
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+class _YdlLogger:
+    """yt-dlp ``logger`` that counts retries and keeps yt-dlp's output quiet."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def _count(self, message):
+        # "[download] Got error: ... Retrying (1/10)..."
+        if "Retrying" in message:
+            with self.metrics._lock:
+                self.metrics.retries += 1
+
+    def debug(self, message):
+        self._count(message)
+
+    def warning(self, message):
+        self._count(message)
+
+    def error(self, message):
+        # The job's own error is logged when it finishes
+        logger.debug(message)
+
+
+class JobMetrics:
+    """Spans and counters of one run of a job, filled in by ``run_job``.
+
+    ``recorder`` is the ``MetricsRecorder`` the job is reported to once it
+    finishes, may be None.
+    """
+
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.spans = {}
+        self.retries = 0
+        # True or False once the info dict was looked up in the cache
+        self.cache_hit = None
+        # Whether an extraction started before the job was reused
+        self.prefetched = False
+        self.transfer_started = None
+        self.transfer_ended = None
+        self._started = {}
+        self._file_bytes = {}
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def start(self, span):
+        with self._lock:
+            self._started[span] = time.monotonic()
+
+    def stop(self, span):
+        """End a span, spans run more than once (e.g. two merges) add up."""
+        with self._lock:
+            started = self._started.pop(span, None)
+            if started is not None:
+                self._add(span, time.monotonic() - started)
+
+    def add(self, span, seconds):
+        with self._lock:
+            self._add(span, seconds)
+
+    def _add(self, span, seconds):
+        # Called with the lock held
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def start_transfer(self):
+        with self._lock:
+            self.transfer_started = time.monotonic()
+
+    def end_transfer(self):
+        """Close the transfer span at the last finished file, or now."""
+        with self._lock:
+            if self.transfer_started is None or "transfer" in self.spans:
+                return
+            end = self.transfer_ended or time.monotonic()
+            self.spans["transfer"] = end - self.transfer_started
+
+    def progress(self, d):
+        """Account for a yt-dlp progress hook dict."""
+        now = time.monotonic()
+        with self._lock:
+            # "finished" only has the final name, downloading both
+            key = d.get("filename") or d.get("tmpfilename")
+            downloaded = d.get("downloaded_bytes") or 0
+            if downloaded and key:
+                self._file_bytes[key] = max(self._file_bytes.get(key, 0), downloaded)
+            started = self.transfer_started
+            if started is None:
+                return
+            if d["status"] == "downloading" and downloaded:
+                self.spans.setdefault("first_byte", now - started)
+            elif d["status"] == "finished":
+                self.transfer_ended = now
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook, the Merger is a span of its own."""
+        span = "merge" if d.get("postprocessor") == "Merger" else "postprocess"
+        if d["status"] == "started":
+            self.start(span)
+        elif d["status"] == "finished":
+            self.stop(span)
+
+    def ydl_logger(self):
+        return _YdlLogger(self)
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return sum(self._file_bytes.values())
+
+    def throughput(self):
+        """Bytes per second while transferring, None before the transfer ended."""
+        transfer = self.spans.get("transfer")
+        return self.bytes / transfer if transfer else None
+
+    def finish(self, job):
+        """Close the total span and report the job, once per run."""
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+            started = self._started.pop("total", None)
+            if started is not None:
+                self._add("total", time.monotonic() - started)
+        self.end_transfer()
+        if self.recorder is not None:
+            self.recorder.record(job)
+
+    def to_dict(self, job):
+        throughput = self.throughput()
+        return {
+            "time": round(time.time(), 3),
+            "job": job.id,
+            "url": job.url,
+            "title": job.title,
+            "format": job.file_format,
+            "quality": job.quality,
+            "state": job.state,
+            "spans": {
+                span: round(self.spans[span], 3) for span in SPANS if span in self.spans
+            },
+            "bytes": self.bytes,
+            "throughput": round(throughput) if throughput else None,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "prefetched": self.prefetched,
+            "playlist": job.options.get("playlist"),
+        }
+
+
+class MetricsRecorder:
+    """Session totals of finished jobs, exported as JSON lines and Prometheus text.
+
+    With ``jsonl_path`` every finished job is appended to that file. With
+    ``sessions`` (a ``SessionPool``) the totals include its connection reuse.
+    """
+
+    def __init__(self, jsonl_path=None, sessions=None):
+        self.jsonl_path = jsonl_path
+        self.sessions = sessions
+        self.started = time.monotonic()
+        self.jobs = {state: 0 for state in STATES}
+        self.bytes = 0
+        self.retries = 0
+        self.cache = {"hit": 0, "miss": 0, "prefetched": 0}
+        self.span_sums = {span: 0.0 for span in SPANS}
+        self.span_counts = {span: 0 for span in SPANS}
+        # (start, end) of every transfer, their union is the busy time
+        self._transfers = []
+        self._lock = threading.Lock()
+
+    def record(self, job):
+        metrics = job.metrics
+        data = metrics.to_dict(job)
+        with self._lock:
+            self.jobs[job.state] = self.jobs.get(job.state, 0) + 1
+            self.bytes += data["bytes"]
+            self.retries += data["retries"]
+            if data["prefetched"]:
+                self.cache["prefetched"] += 1
+            elif data["cache_hit"] is not None:
+                self.cache["hit" if data["cache_hit"] else "miss"] += 1
+            for span, seconds in metrics.spans.items():
+                self.span_sums[span] += seconds
+                self.span_counts[span] += 1
+            if metrics.transfer_started is not None and "transfer" in metrics.spans:
+                start = metrics.transfer_started
+                self._transfers.append((start, start + metrics.spans["transfer"]))
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(data) + "\n")
+                except OSError as e:
+                    logger.warning(f"Can't write job metrics: {str(e)}")
+
+    def _busy_seconds(self):
+        # Called with the lock held
+        busy = 0.0
+        end = None
+        for start, stop in sorted(self._transfers):
+            if end is None or start > end:
+                busy += stop - start
+                end = stop
+            elif stop > end:
+                busy += stop - end
+                end = stop
+        return busy
+
+    def summary(self):
+        with self._lock:
+            busy = self._busy_seconds()
+            summary = {
+                "jobs": dict(self.jobs),
+                "bytes": self.bytes,
+                "retries": self.retries,
+                "cache": dict(self.cache),
+                "busy_seconds": round(busy, 2),
+                # While at least one download was transferring
+                "throughput": self.bytes / busy if busy else None,
+                "avg_spans": {
+                    span: round(self.span_sums[span] / self.span_counts[span], 3)
+                    for span in SPANS
+                    if self.span_counts[span]
+                },
+            }
+        if self.sessions is not None:
+            summary["connections"] = self.sessions.stats()
+        return summary
+
+    def prometheus(self):
+        """Render the session totals in the Prometheus text format."""
+        summary = self.summary()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_jobs_total Finished jobs by final state.",
+            f"# TYPE {prefix}_jobs_total counter",
+        ]
+        for state, count in summary["jobs"].items():
+            lines.append(f'{prefix}_jobs_total{{state="{state}"}} {count}')
+        lines += [
+            f"# HELP {prefix}_downloaded_bytes_total Bytes downloaded by finished jobs.",
+            f"# TYPE {prefix}_downloaded_bytes_total counter",
+            f"{prefix}_downloaded_bytes_total {summary['bytes']}",
+            f"# HELP {prefix}_retries_total Retried requests and fragments.",
+            f"# TYPE {prefix}_retries_total counter",
+            f"{prefix}_retries_total {summary['retries']}",
+            f"# HELP {prefix}_info_lookups_total Info dict lookups by result.",
+            f"# TYPE {prefix}_info_lookups_total counter",
+        ]
+        for result, count in summary["cache"].items():
+            lines.append(f'{prefix}_info_lookups_total{{result="{result}"}} {count}')
+        lines += [
+            f"# HELP {prefix}_span_seconds Time spent in each stage of a job.",
+            f"# TYPE {prefix}_span_seconds summary",
+        ]
+        with self._lock:
+            for span in SPANS:
+                lines.append(
+                    f'{prefix}_span_seconds_sum{{span="{span}"}} '
+                    f"{self.span_sums[span]:.3f}"
+                )
+                lines.append(
+                    f'{prefix}_span_seconds_count{{span="{span}"}} '
+                    f"{self.span_counts[span]}"
+                )
+        lines += [
+            f"# HELP {prefix}_throughput_bytes_per_second Session throughput "
+            "while downloading.",
+            f"# TYPE {prefix}_throughput_bytes_per_second gauge",
+            f"{prefix}_throughput_bytes_per_second {summary['throughput'] or 0:.0f}",
+        ]
+        connections = summary.get("connections")
+        if connections is not None:
+            lines += [
+                f"# HELP {prefix}_http_requests_total HTTP requests sent.",
+                f"# TYPE {prefix}_http_requests_total counter",
+                f"{prefix}_http_requests_total {connections['requests']}",
+                f"# HELP {prefix}_http_connections_total Connections opened, "
+                "the rest of the requests reused one.",
+                f"# TYPE {prefix}_http_connections_total counter",
+                f"{prefix}_http_connections_total {connections['connections']}",
+                f"# HELP {prefix}_tls_handshakes_total TLS handshakes.",
+                f"# TYPE {prefix}_tls_handshakes_total counter",
+                f"{prefix}_tls_handshakes_total {connections['tls_handshakes']}",
+                f"# HELP {prefix}_ydl_sessions_total YoutubeDL sessions created.",
+                f"# TYPE {prefix}_ydl_sessions_total counter",
+                f"{prefix}_ydl_sessions_total {connections['sessions']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the snapshot for a node exporter textfile collector."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
@@ -0,0 +1,208 @@
+"""Cache of yt-dlp info dicts so a video is only extracted once.
+
+Entries live in an in-memory LRU and in JSON files on disk, keyed by the
+canonical video ID. An entry expires shortly before the earliest stream
+URL in it does, after that the stream URLs would no longer be usable.
+Expired files are deleted when they are read or once they have not been
+used for ``MAX_FILE_AGE``, and the least recently used ones once there are
+more than ``max_files``.
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "easy-yt-saver")
+
+# Used when no stream URL carries an expiry timestamp
+DEFAULT_TTL = 60 * 60
+# Drop entries this long before their stream URLs expire, a download that
+# starts right before the deadline still needs time to finish
+EXPIRY_MARGIN = 30 * 60
+MAX_CACHED_FILES = 1000
+# Far past the expiry of any YouTube stream URL
+MAX_FILE_AGE = 24 * 60 * 60
+
+_EXPIRE_PATH_RE = re.compile(r"/expire/(\d+)")
+
+
+def _url_expiry(url):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    if "expire" in query:
+        try:
+            return int(query["expire"][0])
+        except ValueError:
+            return None
+    # HLS and DASH manifests keep their parameters in the path
+    match = _EXPIRE_PATH_RE.search(url)
+    return int(match.group(1)) if match else None
+
+
+def prune_cache_dir(cache_dir, suffix, max_files, max_age=None):
+    """Remove cache files ending in ``suffix`` that are old or over the limit.
+
+    Files are aged by their mtime, which the caches touch on every read, so
+    what goes first is whatever was used longest ago: anything unused for
+    ``max_age`` seconds, then the oldest ones above ``max_files``.
+    """
+    cutoff = time.time() - max_age if max_age is not None else None
+    entries = []
+    expired = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                # Removed by another process since the scan
+                continue
+            if cutoff is not None and mtime < cutoff:
+                expired.append(entry.path)
+            else:
+                entries.append((mtime, entry.path))
+    if len(entries) > max_files:
+        entries.sort()
+        expired.extend(path for _, path in entries[: len(entries) - max_files])
+    for path in expired:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def info_expiry(info, now=None):
+    """Return the unix time at which a cached info dict should be dropped."""
+    now = time.time() if now is None else now
+    expiries = [
+        expiry
+        for expiry in (
+            _url_expiry(fmt["url"])
+            for fmt in info.get("formats") or []
+            if fmt.get("url")
+        )
+        if expiry
+    ]
+    if not expiries:
+        return now + DEFAULT_TTL
+    return min(expiries) - EXPIRY_MARGIN
+
+
+class MetadataCache:
+    """Two level (memory and disk) cache of info dicts with hit/miss counters."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=64, max_files=MAX_CACHED_FILES):
+        self.cache_dir = os.path.join(cache_dir, "info") if cache_dir else None
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes evictions, kept apart from the memory lookups
+        self._disk_lock = threading.Lock()
+
+    def get(self, video_id):
+        """Return the cached info for a video ID, or None if missing or expired.
+
+        The info is a copy, yt-dlp changes the info dicts it downloads.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                expires, info = entry
+                if expires > now:
+                    self._entries.move_to_end(video_id)
+                    self.memory_hits += 1
+                    return copy.deepcopy(info)
+                del self._entries[video_id]
+
+        entry = self._read(video_id)
+        if entry is not None and entry[0] <= now:
+            self._remove(video_id)
+            entry = None
+        with self._lock:
+            if entry is not None:
+                self._remember(video_id, entry)
+                self.disk_hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        return None
+
+    def put(self, video_id, info):
+        entry = (info_expiry(info), copy.deepcopy(info))
+        with self._lock:
+            self._remember(video_id, entry)
+        self._write(video_id, entry)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, video_id, entry):
+        # Called with the lock held
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, video_id):
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def _read(self, video_id):
+        if not self.cache_dir:
+            return None
+        path = self._path(video_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # Mark as recently used for the LRU eviction
+            os.utime(path)
+            return data["expires"], data["info"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            # Corrupt entry, behave as a miss and let the next put replace it
+            return None
+
+    def _write(self, video_id, entry):
+        if not self.cache_dir:
+            return
+        path = self._path(video_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires": entry[0], "info": entry[1]}, f)
+            os.replace(tmp_path, path)
+            self._evict()
+        except (OSError, TypeError, ValueError):
+            # Not cached on disk, the next lookup extracts the video again
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _remove(self, video_id):
+        try:
+            os.remove(self._path(video_id))
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._disk_lock:
+            prune_cache_dir(self.cache_dir, ".json", self.max_files, MAX_FILE_AGE)
@@ -0,0 +1,199 @@
+"""Playlist and channel ingestion.
+
+A full ``extract_info`` on a playlist resolves every entry before the
+first download starts. Collections are extracted flat instead, video IDs
+and titles only, and fed to the download queue a page at a time while
+it drains. Each entry is resolved in full by its own job, right before
+it downloads.
+"""
+
+import logging
+import threading
+
+from download_core import QUEUED, extract_video_id
+
+PAGE_SIZE = 50
+# Ingestion waits while this many entries are still queued
+MAX_QUEUED = 2 * PAGE_SIZE
+
+FLAT_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
+}
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+def is_collection_url(url):
+    """Playlist, channel and other URLs that don't point at a single video.
+
+    A watch URL with a ``&list=`` parameter is the single video, jobs are
+    extracted with ``noplaylist``.
+    """
+    return extract_video_id(url) is None
+
+
+def parse_items(text):
+    """Parse an item range like "100-500", "100-" or "7" into ``(start, end)``.
+
+    Items are numbered from 1, ``end`` is inclusive and None means the
+    end of the playlist. Raises ValueError on anything else.
+    """
+    text = text.strip()
+    if not text:
+        return 1, None
+    first, dash, last = text.partition("-")
+    start = int(first) if first.strip() else 1
+    end = int(last) if last.strip() else None
+    if not dash:
+        end = start
+    if start < 1 or (end is not None and end < start):
+        raise ValueError(f"Invalid item range: {text}")
+    return start, end
+
+
+def open_collection(ydl, url):
+    """Extract a playlist or channel without resolving its entries.
+
+    Returns the info dict, its ``entries`` are read lazily while iterated,
+    so ``ydl`` has to stay open until then.
+    """
+    info = ydl.extract_info(url, download=False, process=False)
+    # Channel URLs redirect to one of their tabs
+    for _ in range(5):
+        if info.get("_type") not in ("url", "url_transparent"):
+            break
+        info = ydl.extract_info(
+            info["url"], download=False, process=False, ie_key=info.get("ie_key")
+        )
+    return info
+
+
+def fetch_collection(url):
+    """Return the title and size of a collection without reading its entries."""
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(FLAT_OPTS) as ydl:
+        info = open_collection(ydl, url)
+    return {key: value for key, value in info.items() if key != "entries"}
+
+
+def iter_entries(info, start=1, end=None):
+    """Yield ``(index, entry)`` for the items ``start`` to ``end`` of a collection."""
+    entries = info.get("entries") or []
+    if hasattr(entries, "getslice"):
+        # yt-dlp's PagedList, read it a page at a time
+        paged = entries
+
+        def pages():
+            offset = start - 1
+            while end is None or offset < end:
+                stop = (
+                    offset + PAGE_SIZE if end is None else min(offset + PAGE_SIZE, end)
+                )
+                page = paged.getslice(offset, stop)
+                if not page:
+                    return
+                yield from page
+                offset = stop
+
+        entries = pages()
+        index = start
+    else:
+        index = 1
+
+    for entry in entries:
+        if index > (end or index):
+            return
+        if index >= start and entry:
+            yield index, entry
+        index += 1
+
+
+def entry_url(entry):
+    url = entry.get("url") or ""
+    if extract_video_id(url):
+        return url
+    if entry.get("id") and entry.get("ie_key") in (None, "Youtube"):
+        return f"https://www.youtube.com/watch?v={entry['id']}"
+    return url or entry.get("webpage_url")
+
+
+class PlaylistIngest:
+    """Feeds the entries of a playlist or channel to a ``DownloadQueue``.
+
+    ``make_job(url)`` creates the job for an entry, it is submitted with
+    the entry's title and position. Runs on its own thread after ``start``.
+    """
+
+    def __init__(self, url, download_queue, make_job, start=1, end=None):
+        self.url = url
+        self.download_queue = download_queue
+        self.make_job = make_job
+        self.start_index = start
+        self.end_index = end
+        self.title = url
+        self.submitted = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        """Stop adding entries, the ones already queued are left alone."""
+        self._stop.set()
+
+    @property
+    def is_done(self):
+        return self._done.is_set()
+
+    def join(self):
+        self._done.wait()
+
+    def run(self):
+        import yt_dlp
+
+        try:
+            with yt_dlp.YoutubeDL(FLAT_OPTS) as ydl:
+                info = open_collection(ydl, self.url)
+                self.title = info.get("title") or self.url
+                count = info.get("playlist_count")
+                logger.info(
+                    f"Adding playlist {self.title}"
+                    + (f" ({count} videos)" if count else "")
+                )
+                for index, entry in iter_entries(
+                    info, self.start_index, self.end_index
+                ):
+                    if not self._wait_for_room():
+                        break
+                    self._submit(index, entry)
+            logger.info(f"Added {self.submitted} video(s) from playlist {self.title}")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Error reading playlist {self.url}: {self.error}")
+        finally:
+            self._done.set()
+
+    def _wait_for_room(self):
+        # Only keep a couple of pages queued ahead of the workers
+        while not self._stop.is_set():
+            if self.download_queue.counts().get(QUEUED, 0) < MAX_QUEUED:
+                return True
+            self._stop.wait(0.5)
+        return False
+
+    def _submit(self, index, entry):
+        url = entry_url(entry)
+        if not url:
+            return
+        job = self.make_job(url)
+        job.title = entry.get("title") or url
+        job.options["playlist"] = self.title
+        job.options["playlist_index"] = index
+        self.download_queue.submit(job)
+        self.submitted += 1
@@ -0,0 +1,148 @@
+"""Speculative extraction of info dicts.
+
+The GUI starts extracting a video as soon as a URL is pasted, before
+Fetch or Download is clicked. There is at most one request per video ID,
+a later ``fetch`` of the same video waits for the request in flight
+instead of extracting again, and finished results land in the
+``MetadataCache``. yt-dlp can't abort an extraction half way, so
+cancelling only drops requests that haven't started yet, running ones
+finish and are cached.
+"""
+
+import copy
+import logging
+import threading
+from collections import deque
+
+from download_core import extract_video_id, fetch_info
+
+# Speculative extractions running at the same time, more are queued
+MAX_SPECULATIVE = 2
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+class _Request:
+    def __init__(self, video_id, url):
+        self.video_id = video_id
+        self.url = url
+        self.info = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InfoPrefetcher:
+    """Shares one extraction per video between speculative and real fetches."""
+
+    def __init__(self, cache=None, max_running=MAX_SPECULATIVE, sessions=None):
+        self.cache = cache
+        # Extractions run in YoutubeDL sessions of this SessionPool, if any
+        self.sessions = sessions
+        self.max_running = max_running
+        self.started = 0
+        self.attached = 0
+        self.cancelled = 0
+        self._requests = {}
+        self._pending = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def prefetch(self, url):
+        """Start extracting a video URL in the background, if not already."""
+        video_id = extract_video_id(url)
+        if video_id is None:
+            return
+        with self._lock:
+            if video_id in self._requests:
+                return
+            request = _Request(video_id, url)
+            self._requests[video_id] = request
+            self._pending.append(request)
+            self._start_pending()
+
+    def cancel(self, keep=None):
+        """Drop the queued requests, except the one for video ID ``keep``."""
+        with self._lock:
+            for request in list(self._pending):
+                if request.video_id != keep:
+                    self._pending.remove(request)
+                    del self._requests[request.video_id]
+                    self.cancelled += 1
+
+    def fetch(self, url, metrics=None):
+        """Return the info dict of a URL like ``fetch_info``.
+
+        Waits for an extraction of the same video that is already running,
+        a queued one is taken over and run on the calling thread. Waiting
+        for a running extraction is noted on ``metrics`` (a ``JobMetrics``).
+        """
+        video_id = extract_video_id(url)
+        if video_id is None:
+            return fetch_info(url, self.cache, metrics=metrics, sessions=self.sessions)
+
+        with self._lock:
+            request = self._requests.get(video_id)
+            if request is None:
+                request = _Request(video_id, url)
+                self._requests[video_id] = request
+                run_here = True
+            elif request in self._pending:
+                self._pending.remove(request)
+                run_here = True
+                self.attached += 1
+            else:
+                run_here = False
+                self.attached += 1
+
+        if run_here:
+            self._run(request, metrics)
+        else:
+            if metrics is not None:
+                metrics.prefetched = True
+            logger.debug(f"Waiting for the extraction of {video_id} in flight")
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        # Every job downloads from, and so changes, its own copy
+        return copy.deepcopy(request.info)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "attached": self.attached,
+                "cancelled": self.cancelled,
+            }
+
+    def _start_pending(self):
+        # Called with the lock held
+        while self._pending and self._running < self.max_running:
+            request = self._pending.popleft()
+            self._running += 1
+            self.started += 1
+            threading.Thread(
+                target=self._run_speculative, args=(request,), daemon=True
+            ).start()
+
+    def _run_speculative(self, request):
+        try:
+            self._run(request)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._start_pending()
+
+    def _run(self, request, metrics=None):
+        try:
+            request.info = fetch_info(
+                request.url, self.cache, metrics=metrics, sessions=self.sessions
+            )
+        except Exception as e:
+            logger.debug(f"Can't extract {request.url}: {str(e)}")
+            request.error = e
+        finally:
+            with self._lock:
+                # Later fetches read the cache, or retry after an error
+                if self._requests.get(request.video_id) is request:
+                    del self._requests[request.video_id]
+            request.done.set()
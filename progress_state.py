@@ -0,0 +1,161 @@
+"""Shared download progress state.
+
+Worker threads publish job progress into a ``ProgressBoard`` as often as
+yt-dlp reports it, which only costs a lock and a dict update. The UI
+samples the board at a fixed frame rate and only redraws jobs that
+changed since the last sample, so the number of UI updates per second
+does not depend on how fast the downloads are.
+"""
+
+import time
+import threading
+
+
+class SpeedMeter:
+    """Download speed as an exponential moving average of measured rates."""
+
+    def __init__(self, alpha=0.3, min_interval=0.5):
+        self.alpha = alpha
+        self.min_interval = min_interval
+        self.speed = None
+        self._last_time = None
+        self._last_bytes = None
+
+    def update(self, downloaded_bytes, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last_bytes is None or downloaded_bytes < self._last_bytes:
+            # First sample, or yt-dlp started on the next format of a merge
+            self._last_time = now
+            self._last_bytes = downloaded_bytes
+            return self.speed
+
+        elapsed = now - self._last_time
+        if elapsed < self.min_interval:
+            return self.speed
+
+        rate = (downloaded_bytes - self._last_bytes) / elapsed
+        if self.speed is None:
+            self.speed = rate
+        else:
+            self.speed = self.alpha * rate + (1 - self.alpha) * self.speed
+        self._last_time = now
+        self._last_bytes = downloaded_bytes
+        return self.speed
+
+    def eta(self, downloaded_bytes, total_bytes):
+        """Seconds left at the smoothed speed, or None if unknown."""
+        if not total_bytes or not self.speed:
+            return None
+        return max(0.0, (total_bytes - downloaded_bytes) / self.speed)
+
+
+class ProgressBoard:
+    """Thread-safe latest-progress snapshot per job, sampled by the UI."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._dirty = set()
+
+    def publish(self, job):
+        """Record the job's current progress, safe to call from any thread."""
+        snapshot = {
+            "title": job.title,
+            "state": job.state,
+            "progress": job.progress,
+            "downloaded_bytes": job.downloaded_bytes,
+            "total_bytes": job.total_bytes,
+            "speed": job.speed,
+            "eta": job.eta,
+            "rate_limit": job.rate_limit,
+        }
+        with self._lock:
+            self._snapshots[job.id] = snapshot
+            self._dirty.add(job.id)
+
+    def remove(self, job_id):
+        with self._lock:
+            self._snapshots.pop(job_id, None)
+            self._dirty.discard(job_id)
+
+    def collect(self):
+        """Return ``{job_id: snapshot}`` for jobs changed since the last call."""
+        with self._lock:
+            changed = {job_id: self._snapshots[job_id] for job_id in self._dirty}
+            self._dirty.clear()
+        return changed
+
+    def totals(self, states):
+        """Aggregate progress over the jobs whose state is in ``states``.
+
+        Returns a dict with the job count, summed bytes and speed, the
+        overall percentage and an ETA for all of them together.
+        """
+        with self._lock:
+            active = [s for s in self._snapshots.values() if s["state"] in states]
+
+        # Jobs with an unknown size can't contribute to the percentage
+        sized = [s for s in active if s["total_bytes"]]
+        downloaded = sum(s["downloaded_bytes"] for s in sized)
+        total = sum(s["total_bytes"] for s in sized)
+        speed = sum(s["speed"] or 0 for s in active)
+        percent = min(100.0, downloaded / total * 100) if total else 0.0
+        eta = (total - downloaded) / speed if speed and total > downloaded else None
+        return {
+            "jobs": len(active),
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "speed": speed,
+            "percent": percent,
+            "eta": eta,
+        }
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class StageStats:
+    """Timing totals for one pipeline stage (download or transcode).
+
+    ``wait`` is the time jobs spent queued in front of the stage, ``busy``
+    the time a worker of the stage spent on them. A stage with long waits
+    and workers that are always busy is the bottleneck.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.jobs = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, busy, wait=0.0):
+        with self._lock:
+            self.jobs += 1
+            self.busy_seconds += busy
+            self.wait_seconds += wait
+
+    def summary(self, workers=1):
+        with self._lock:
+            elapsed = time.monotonic() - self._started
+            return {
+                "stage": self.name,
+                "jobs": self.jobs,
+                "busy_seconds": round(self.busy_seconds, 2),
+                "wait_seconds": round(self.wait_seconds, 2),
+                "avg_busy": round(self.busy_seconds / self.jobs, 2) if self.jobs else 0,
+                "avg_wait": round(self.wait_seconds / self.jobs, 2) if self.jobs else 0,
+                # Share of the available worker time that was spent working
+                "utilization": round(
+                    min(1.0, self.busy_seconds / (elapsed * max(1, workers))), 3
+                ),
+            }
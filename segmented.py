@@ -0,0 +1,364 @@
+"""Multi-connection downloads of single media streams.
+
+One throttled connection only gets a fraction of the available bandwidth.
+``SegmentedHttpFD`` splits a plain HTTP(S) stream into ranged requests
+spread over several connections and writes every range to its offset in
+the ``.part`` file. Each connection sizes its next range from its own
+measured throughput, so fast connections take big ranges and slow ones
+small ones, and the end of the file isn't held up by a single straggler.
+Fragmented formats (DASH, HLS) use yt-dlp's concurrent fragment
+downloads instead, see ``build_ydl_opts``.
+
+Finished ranges are recorded next to the ``.part`` file, a paused or
+interrupted download continues where it stopped. The record is written
+before the ``.part`` file is pre-sized, so a zero-filled ``.part`` is
+never mistaken for downloaded data. A ``throttle(count)``
+callable in the options is called with every block a connection reads.
+"""
+
+import os
+import json
+import time
+import threading
+
+import yt_dlp
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.utils import DownloadError
+
+# Range sizes, the first one per connection is INITIAL_CHUNK, later ones
+# are the throughput of the connection times CHUNK_SECONDS
+INITIAL_CHUNK = 1024 * 1024
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 16 * 1024 * 1024
+CHUNK_SECONDS = 2.0
+BLOCK_SIZE = 64 * 1024
+# Smaller streams aren't worth the extra requests
+MIN_SEGMENTED_SIZE = 2 * INITIAL_CHUNK
+PROGRESS_INTERVAL = 0.25
+STATE_SAVE_INTERVAL = 2.0
+
+
+class RangeSet:
+    """The byte ranges of a file still to be downloaded, thread-safe."""
+
+    def __init__(self, total, done=()):
+        self.total = total
+        self._lock = threading.Lock()
+        self._gaps = [[0, total]]
+        for start, end in done:
+            self._remove(start, end)
+
+    def _remove(self, start, end):
+        gaps = []
+        for gap_start, gap_end in self._gaps:
+            if end <= gap_start or start >= gap_end:
+                gaps.append([gap_start, gap_end])
+                continue
+            if gap_start < start:
+                gaps.append([gap_start, start])
+            if end < gap_end:
+                gaps.append([end, gap_end])
+        self._gaps = gaps
+
+    def take(self, size):
+        """Claim up to ``size`` bytes from the first gap, None when nothing's left."""
+        with self._lock:
+            if not self._gaps:
+                return None
+            gap = self._gaps[0]
+            start = gap[0]
+            end = min(gap[1], start + size)
+            if end == gap[1]:
+                self._gaps.pop(0)
+            else:
+                gap[0] = end
+            return start, end
+
+    def give_back(self, start, end):
+        """Return the unfinished part of a claimed range."""
+        if start >= end:
+            return
+        with self._lock:
+            self._gaps.append([start, end])
+            self._gaps.sort()
+
+    def remaining(self):
+        with self._lock:
+            return sum(end - start for start, end in self._gaps)
+
+
+class _Counter:
+    """Bytes downloaded by all connections together."""
+
+    def __init__(self, value=0):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.value += count
+
+
+class _Connection:
+    """Adaptive range size of one connection."""
+
+    def __init__(self):
+        self.chunk = INITIAL_CHUNK
+
+    def measured(self, size, seconds):
+        if seconds > 0:
+            throughput = size / seconds
+            self.chunk = int(min(MAX_CHUNK, max(MIN_CHUNK, throughput * CHUNK_SECONDS)))
+
+
+class SegmentedHttpFD(HttpFD):
+    """HttpFD that downloads over ``segmented_connections`` ranged connections.
+
+    Falls back to the single-connection download when the server doesn't
+    support ranges or doesn't report a size.
+    """
+
+    FD_NAME = "segmented"
+
+    def real_download(self, filename, info_dict):
+        connections = self.params.get("segmented_connections") or 1
+        tmpfilename = self.temp_name(filename)
+        state_path = tmpfilename + ".segments"
+        total = self._probe(info_dict)
+        if connections < 2 or not total or total < MIN_SEGMENTED_SIZE:
+            self._to_single_connection(tmpfilename, state_path)
+            return super().real_download(filename, info_dict)
+
+        done = self._load_state(tmpfilename, state_path, total)
+        # From here on the .part file has holes, only the state says which
+        self._write_state(state_path, total, done)
+        with open(tmpfilename, "r+b" if done else "wb") as f:
+            f.truncate(total)
+
+        ranges = RangeSet(total, done)
+        finished = []
+        finished_lock = threading.Lock()
+        counter = _Counter(total - ranges.remaining())
+        stop = threading.Event()
+        errors = []
+        self.report_destination(filename)
+
+        def save_state():
+            with finished_lock:
+                ranges_done = list(done) + finished
+            self._write_state(state_path, total, ranges_done)
+
+        def worker():
+            connection = _Connection()
+            retries = self.params.get("retries") or 0
+            with open(tmpfilename, "r+b") as out:
+                while not stop.is_set():
+                    claimed = ranges.take(
+                        min(
+                            connection.chunk,
+                            max(MIN_CHUNK, ranges.remaining() // connections),
+                        )
+                    )
+                    if claimed is None:
+                        return
+                    start, end = claimed
+                    # Position reached so far, kept across retries
+                    cursor = [start]
+                    attempt = 0
+                    began = time.monotonic()
+                    while cursor[0] < end and not stop.is_set():
+                        try:
+                            self._fetch_range(
+                                info_dict, out, cursor, end, counter, stop
+                            )
+                        except Exception as e:
+                            attempt += 1
+                            if attempt > retries:
+                                ranges.give_back(cursor[0], end)
+                                errors.append(e)
+                                stop.set()
+                                return
+                            self.report_retry(e, attempt, retries)
+                    if cursor[0] < end:
+                        ranges.give_back(cursor[0], end)
+                        return
+                    connection.measured(end - start, time.monotonic() - began)
+                    with finished_lock:
+                        finished.append([start, end])
+
+        threads = [
+            threading.Thread(target=worker, daemon=True) for _ in range(connections)
+        ]
+        for thread in threads:
+            thread.start()
+
+        started = time.monotonic()
+        start_bytes = counter.value
+        last_save = started
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(PROGRESS_INTERVAL)
+                now = time.monotonic()
+                downloaded = counter.value
+                speed = self.calc_speed(started, now, downloaded - start_bytes)
+                # Raising here (cancel, pause) stops the connections below
+                self._hook_progress(
+                    {
+                        "status": "downloading",
+                        "downloaded_bytes": downloaded,
+                        "total_bytes": total,
+                        "tmpfilename": tmpfilename,
+                        "filename": filename,
+                        "speed": speed,
+                        "eta": self.calc_eta(speed, total - downloaded),
+                        "elapsed": now - started,
+                        "ctx_id": info_dict.get("ctx_id"),
+                        # Connections went through the "throttle" option already
+                        "throttled": True,
+                    },
+                    info_dict,
+                )
+                if now - last_save >= STATE_SAVE_INTERVAL:
+                    save_state()
+                    last_save = now
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if ranges.remaining():
+                save_state()
+
+        if errors:
+            raise DownloadError(f"Segmented download failed: {errors[0]}")
+
+        self.try_rename(tmpfilename, filename)
+        self.try_remove(state_path)
+        self._hook_progress(
+            {
+                "downloaded_bytes": total,
+                "total_bytes": total,
+                "filename": filename,
+                "status": "finished",
+                "elapsed": time.monotonic() - started,
+                "ctx_id": info_dict.get("ctx_id"),
+            },
+            info_dict,
+        )
+        return True
+
+    def _request(self, info_dict, start, end):
+        headers = dict(info_dict.get("http_headers") or {})
+        headers["Range"] = f"bytes={start}-{end - 1}"
+        return self.ydl.urlopen(Request(info_dict["url"], headers=headers))
+
+    def _probe(self, info_dict):
+        """Return the size of the stream if the server serves ranges, else None."""
+        try:
+            response = self._request(info_dict, 0, 1)
+        except Exception:
+            return None
+        try:
+            content_range = response.headers.get("Content-Range") or ""
+            if response.status != 206 or "/" not in content_range:
+                return None
+            size = content_range.rpartition("/")[2]
+            return int(size) if size.isdigit() else None
+        finally:
+            response.close()
+
+    def _fetch_range(self, info_dict, out, cursor, end, counter, stop):
+        """Download ``cursor[0]`` to ``end`` into ``out``, advancing ``cursor``."""
+        throttle = self.params.get("throttle")
+        response = self._request(info_dict, cursor[0], end)
+        try:
+            if response.status != 206:
+                raise DownloadError(f"Server ignored the range request ({cursor[0]}-)")
+            while cursor[0] < end and not stop.is_set():
+                block = response.read(min(BLOCK_SIZE, end - cursor[0]))
+                if not block:
+                    raise DownloadError(f"Connection closed at byte {cursor[0]}")
+                out.seek(cursor[0])
+                out.write(block)
+                cursor[0] += len(block)
+                counter.add(len(block))
+                if throttle is not None:
+                    throttle(len(block))
+        finally:
+            response.close()
+
+    def _write_state(self, state_path, total, done):
+        tmp_state = state_path + ".tmp"
+        with open(tmp_state, "w") as f:
+            json.dump({"total": total, "done": [list(r) for r in done]}, f)
+        os.replace(tmp_state, state_path)
+
+    def _read_state(self, state_path):
+        """Return the recorded total and finished ranges, None if unreadable."""
+        try:
+            with open(state_path, "r") as f:
+                data = json.load(f)
+            return data.get("total"), [tuple(r) for r in data.get("done", [])]
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None
+
+    def _load_state(self, tmpfilename, state_path, total):
+        """Return the ranges already on disk from an earlier attempt."""
+        if not os.path.isfile(tmpfilename):
+            return []
+        if not os.path.exists(state_path):
+            # Without a state the .part was written by a single-connection
+            # download and is one range from 0
+            size = os.path.getsize(tmpfilename)
+            return [(0, size)] if 0 < size <= total else []
+        state = self._read_state(state_path)
+        if state is None or state[0] != total:
+            return []
+        return state[1]
+
+    def _to_single_connection(self, tmpfilename, state_path):
+        """Cut a segmented .part back to the prefix HttpFD can continue from.
+
+        A segmented .part has the full size with holes in it, HttpFD would
+        take it as (almost) finished.
+        """
+        if not os.path.exists(state_path):
+            return
+        prefix = 0
+        state = self._read_state(state_path)
+        if state is not None:
+            for start, end in sorted(state[1]):
+                if start > prefix:
+                    break
+                prefix = max(prefix, end)
+        if os.path.isfile(tmpfilename):
+            with open(tmpfilename, "r+b") as f:
+                f.truncate(min(prefix, os.path.getsize(tmpfilename)))
+        self.try_remove(state_path)
+
+
+class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that downloads plain HTTP(S) formats with ``SegmentedHttpFD``.
+
+    Enabled with the ``segmented_connections`` option, everything else
+    (fragments, merging, subtitles) goes through yt-dlp's own downloaders.
+    """
+
+    def dl(self, name, info, subtitle=False, test=False):
+        connections = self.params.get("segmented_connections") or 1
+        if (
+            connections < 2
+            or test
+            or subtitle
+            or name == "-"
+            or info.get("http_headers") is None
+            or yt_dlp.utils.determine_protocol(info) not in ("http", "https")
+            or info.get("section_start")
+            or info.get("section_end")
+        ):
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        fd = SegmentedHttpFD(self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        return fd.download(name, dict(info), subtitle)
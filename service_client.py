@@ -0,0 +1,320 @@
+"""Client of the download service's HTTP API.
+
+``RemoteQueue`` has the same interface as ``DownloadQueue``, so the GUI
+can hand its jobs to a running ``download_service`` instead of its own
+worker threads. The jobs it lists are mirrors of the service's jobs,
+kept up to date from the service's event stream.
+"""
+
+import json
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+
+from download_core import DownloadJob
+from download_service import DEFAULT_HOST, DEFAULT_PORT, JOB_OPTIONS
+
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+REQUEST_TIMEOUT = 5
+# Seconds between attempts to reconnect to the event stream
+RECONNECT_DELAY = 2
+
+# Job fields the service reports, copied onto the mirrored jobs
+_JOB_FIELDS = (
+    "title",
+    "state",
+    "progress",
+    "downloaded_bytes",
+    "total_bytes",
+    "speed",
+    "eta",
+    "rate_limit",
+    "error",
+    "options",
+)
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+class ServiceError(Exception):
+    """The service couldn't be reached or rejected a request."""
+
+
+class ServiceClient:
+    """JSON requests and the event stream of a download service."""
+
+    def __init__(self, url=DEFAULT_URL):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, data=None, timeout=REQUEST_TIMEOUT):
+        body = json.dumps(data if data is not None else {}).encode("utf-8")
+        request = urllib.request.Request(
+            self.url + path,
+            data=body if method == "POST" else None,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error") or e.reason
+            except ValueError:
+                message = e.reason
+            raise ServiceError(message) from None
+        except (OSError, ValueError) as e:
+            raise ServiceError(f"Can't reach the download service: {str(e)}") from None
+
+    def get(self, path):
+        return self.request("GET", path)
+
+    def post(self, path, data=None):
+        return self.request("POST", path, data)
+
+    def available(self, timeout=1):
+        try:
+            return self.request("GET", "/health", timeout=timeout).get("status") == "ok"
+        except ServiceError:
+            return False
+
+    def events(self):
+        """Yield the events of the service's event stream until it closes."""
+        try:
+            response = urllib.request.urlopen(self.url + "/events")
+        except OSError as e:
+            raise ServiceError(f"Can't reach the download service: {str(e)}") from None
+        with response:
+            for line in response:
+                # Only the data lines matter, the event type is repeated in them
+                if line.startswith(b"data: "):
+                    yield json.loads(line[len(b"data: ") :])
+
+
+class RemotePlaylist:
+    """A playlist the service is adding, like ``PlaylistIngest``."""
+
+    def __init__(self, client, data):
+        self.client = client
+        self.id = data["id"]
+        self.url = data["url"]
+        self.update(data)
+
+    def update(self, data):
+        self.title = data["title"]
+        self.submitted = data["submitted"]
+        self.error = data["error"]
+        self._done = data["done"]
+
+    @property
+    def is_done(self):
+        return self._done
+
+    def stop(self):
+        try:
+            self.update(self.client.post(f"/playlists/{self.id}/stop")["playlist"])
+        except ServiceError as e:
+            logger.error(f"Can't stop playlist {self.title}: {str(e)}")
+
+
+class RemoteQueue:
+    """A ``DownloadQueue`` whose jobs run in the download service.
+
+    ``on_update(job)`` is called from the event thread whenever a mirrored
+    job changes, ``on_remove(job_id)`` when the service forgot a job and
+    ``on_settings(settings)`` when the service's settings changed.
+    """
+
+    def __init__(self, client, on_update=None, on_remove=None, on_settings=None):
+        self.client = client
+        self.on_update = on_update
+        self.on_remove = on_remove
+        self.on_settings = on_settings
+        self.settings = {}
+        # The latest /stats of the service, refreshed when jobs finish
+        self.service_stats = {}
+        self._jobs = {}
+        self._playlists = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start following the service's event stream."""
+        threading.Thread(target=self._follow_events, daemon=True).start()
+
+    @property
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    @property
+    def max_workers(self):
+        return self.settings.get("max_workers", 1)
+
+    def set_max_workers(self, count):
+        return self.update_settings({"max_workers": max(1, int(count))})
+
+    def update_settings(self, settings):
+        """Change the service's settings, returns False if that failed."""
+        try:
+            self.settings = self.client.post("/settings", settings)
+        except ServiceError as e:
+            logger.error(f"Can't change the service settings: {str(e)}")
+            return False
+        return True
+
+    def submit(self, job, paused=False):
+        """Hand a job to the service, the job takes over the service's ID.
+
+        Raises ServiceError if the service refused it.
+        """
+        data = self.client.post("/jobs", self._job_request(job, paused=paused))
+        with self._lock:
+            # The event stream may have reported the job first
+            job.id = data["job"]["id"]
+            job = self._jobs.setdefault(job.id, job)
+        self._update_job(job, data["job"])
+
+    def add_playlist(self, url, job, items=""):
+        """Let the service add a playlist's videos with ``job``'s settings.
+
+        Raises ServiceError if the service refused it.
+        """
+        request = dict(self._job_request(job), url=url, items=items)
+        data = self.client.post("/jobs", request)["playlist"]
+        with self._lock:
+            playlist = self._playlists.setdefault(
+                data["id"], RemotePlaylist(self.client, data)
+            )
+        return playlist
+
+    def cancel(self, job):
+        return self._action(job, "cancel")
+
+    def pause(self, job):
+        return self._action(job, "pause")
+
+    def resume(self, job):
+        return self._action(job, "resume")
+
+    def clear_finished(self):
+        try:
+            removed = self.client.post("/jobs/clear")["removed"]
+        except ServiceError as e:
+            logger.error(f"Can't clear finished jobs: {str(e)}")
+            return []
+        with self._lock:
+            return [
+                job
+                for job in (self._jobs.pop(job_id, None) for job_id in removed)
+                if job
+            ]
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return counts
+
+    def _job_request(self, job, paused=False):
+        return {
+            "url": job.url,
+            "title": job.title if job.title != job.url else None,
+            "download_path": job.download_path,
+            "file_format": job.file_format,
+            "quality": job.quality,
+            "options": {
+                key: value for key, value in job.options.items() if key in JOB_OPTIONS
+            },
+            "paused": paused,
+        }
+
+    def _action(self, job, action):
+        try:
+            data = self.client.post(f"/jobs/{job.id}/{action}")
+        except ServiceError as e:
+            logger.error(f"Can't {action} download #{job.id}: {str(e)}")
+            return False
+        self._update_job(job, data["job"])
+        return data["applied"]
+
+    def _update_job(self, job, data):
+        for field in _JOB_FIELDS:
+            setattr(job, field, data[field])
+        if self.on_update:
+            self.on_update(job)
+
+    def _mirror(self, data):
+        with self._lock:
+            job = self._jobs.get(data["id"])
+            if job is None:
+                job = DownloadJob(
+                    data["url"],
+                    data["download_path"],
+                    data["file_format"],
+                    data["quality"],
+                )
+                job.id = data["id"]
+                self._jobs[job.id] = job
+        self._update_job(job, data)
+
+    def _forget(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None and self.on_remove:
+            self.on_remove(job_id)
+
+    def _follow_events(self):
+        while True:
+            try:
+                for event in self.client.events():
+                    self._handle(event)
+                logger.warning("The download service closed the event stream")
+            except ServiceError as e:
+                logger.debug(str(e))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Lost the download service: {str(e)}")
+            time.sleep(RECONNECT_DELAY)
+
+    def _handle(self, event):
+        kind = event["type"]
+        if kind == "job":
+            self._mirror(event["job"])
+        elif kind == "removed":
+            self._forget(event["id"])
+        elif kind == "playlist":
+            data = event["playlist"]
+            with self._lock:
+                playlist = self._playlists.get(data["id"])
+            if playlist is not None:
+                playlist.update(data)
+        elif kind == "stats":
+            self.service_stats = event["stats"]
+        elif kind == "settings":
+            self._set_settings(event["settings"])
+        elif kind == "snapshot":
+            # Sent on every (re)connect, jobs missing from it are gone
+            known = {data["id"] for data in event["jobs"]}
+            for job in self.jobs:
+                if job.id not in known:
+                    self._forget(job.id)
+            for data in event["jobs"]:
+                self._mirror(data)
+            for data in event["playlists"]:
+                with self._lock:
+                    playlist = self._playlists.get(data["id"])
+                if playlist is not None:
+                    playlist.update(data)
+            self.service_stats = event["stats"]
+            self._set_settings(event["settings"])
+
+    def _set_settings(self, settings):
+        self.settings = settings
+        if self.on_settings:
+            self.on_settings(settings)
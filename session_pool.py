@@ -0,0 +1,285 @@
+"""Long-lived YoutubeDL sessions shared by consecutive jobs.
+
+Creating a YoutubeDL sets up its extractors and request handlers, and
+closing it drops their connection pools, so every job used to start with
+fresh TCP and TLS handshakes to hosts the previous job just talked to.
+``SessionPool`` keeps the instances of finished jobs open and hands them
+to the next job with that job's options (output template, format,
+postprocessors, hooks) applied, the HTTP connections stay alive in
+between. yt-dlp only keeps connections alive with its requests handler,
+installed with ``yt-dlp[default]``.
+
+``ConnectionStats`` counts the HTTP requests, new connections and TLS
+handshakes of a pool's sessions, so the reuse can be checked.
+
+Reconfiguring a session touches private YoutubeDL attributes. A yt-dlp
+version without them is detected when the first session is created, the
+pool then gives every job a fresh YoutubeDL instead.
+"""
+
+import ssl
+import weakref
+import logging
+import threading
+import contextlib
+
+# Idle sessions kept open, about one per download worker
+MAX_IDLE_SESSIONS = 8
+# Sessions are replaced after this many jobs so their caches don't grow forever
+MAX_SESSION_JOBS = 100
+# Options every session is created with, jobs add their own on top
+SESSION_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+    "noplaylist": True,
+}
+# Options that YoutubeDL turns into objects when it's created
+_HOOK_OPTS = ("progress_hooks", "postprocessor_hooks", "post_hooks")
+# Private YoutubeDL attributes that _reset and _configure rewrite
+_PRIVATE_ATTRS = (
+    "_pps",
+    "_progress_hooks",
+    "_postprocessor_hooks",
+    "_post_hooks",
+    "_download_retcode",
+    "_parse_outtmpl",
+)
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+class ConnectionStats:
+    """Counts of HTTP requests, connections and TLS handshakes.
+
+    Requests are counted as they are sent through ``YoutubeDL.urlopen``, a
+    request on a socket that wasn't seen before counts as a new
+    connection. Responses that don't expose their socket (yt-dlp's urllib
+    handler, which doesn't keep connections alive) always count as one.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self._sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        sock = _response_socket(response)
+        with self._lock:
+            self.requests += 1
+            if sock is not None and sock in self._sockets:
+                return
+            self.connections += 1
+            if sock is not None:
+                self._sockets.add(sock)
+                if isinstance(sock, ssl.SSLSocket):
+                    self.tls_handshakes += 1
+            elif str(getattr(response, "url", "")).startswith("https:"):
+                self.tls_handshakes += 1
+
+    def instrument(self, ydl):
+        """Count the requests ``ydl`` sends from now on."""
+        urlopen = ydl.urlopen
+
+        def counted_urlopen(req):
+            response = urlopen(req)
+            self.record(response)
+            return response
+
+        ydl.urlopen = counted_urlopen
+        return ydl
+
+    def snapshot(self):
+        with self._lock:
+            requests, connections = self.requests, self.connections
+            return {
+                "requests": requests,
+                "connections": connections,
+                "tls_handshakes": self.tls_handshakes,
+                # Share of requests sent on an already open connection
+                "reuse": max(0.0, 1 - connections / requests) if requests else None,
+            }
+
+
+def _response_socket(response):
+    """The socket a yt-dlp response arrived on, None if it can't be told.
+
+    Only the requests handler's responses have one, their ``fp`` is the
+    urllib3 response holding the pooled connection.
+    """
+    connection = getattr(getattr(response, "fp", None), "connection", None)
+    return getattr(connection, "sock", None)
+
+
+def _can_reconfigure(ydl):
+    return (
+        all(hasattr(ydl, name) for name in _PRIVATE_ATTRS)
+        and isinstance(ydl._pps, dict)
+        and callable(ydl._parse_outtmpl)
+    )
+
+
+class _Session:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        # The options as YoutubeDL normalized them, restored after every job
+        self.params = dict(ydl.params)
+        self.jobs = 0
+
+
+class SessionPool:
+    """Reuses YoutubeDL instances, and their open connections, across jobs.
+
+    Every ``session`` is used by one job at a time, so there are at most
+    as many as jobs run in parallel.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_SESSIONS, max_jobs=MAX_SESSION_JOBS):
+        self.max_idle = max_idle
+        self.max_jobs = max_jobs
+        self.created = 0
+        self.reused = 0
+        # False once this yt-dlp turned out not to support reconfiguring
+        self.reuse = True
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections = ConnectionStats()
+
+    @contextlib.contextmanager
+    def session(self, opts=None):
+        """Context manager yielding a YoutubeDL configured with ``opts``.
+
+        A session whose job raised is closed instead of reused, it may
+        have been left with half-read responses.
+        """
+        session = self._acquire()
+        if session is None:
+            # Created with the job's options, closed after the job
+            with self._create({**SESSION_OPTS, **(opts or {})}) as ydl:
+                yield ydl
+            return
+        try:
+            if opts:
+                _configure(session, opts)
+            yield session.ydl
+        except BaseException:
+            self._close(session)
+            raise
+        else:
+            self._release(session)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "sessions": self.created,
+                "sessions_reused": self.reused,
+                "idle": len(self._idle),
+            }
+        stats.update(self.connections.snapshot())
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._close(session)
+
+    def _acquire(self):
+        """Return an idle or new session, None if sessions can't be reused."""
+        with self._lock:
+            if not self.reuse:
+                return None
+            if self._idle:
+                self.reused += 1
+                # The most recently used one has the warmest connections
+                return self._idle.pop()
+        session = _Session(self._create(dict(SESSION_OPTS)))
+        if not _can_reconfigure(session.ydl):
+            logger.warning(
+                "This yt-dlp version can't reuse sessions, "
+                "every download opens its own connections"
+            )
+            with self._lock:
+                self.reuse = False
+            self._close(session)
+            return None
+        return session
+
+    def _create(self, opts):
+        from segmented import SegmentedYoutubeDL
+
+        with self._lock:
+            self.created += 1
+        return self.connections.instrument(SegmentedYoutubeDL(opts))
+
+    def _release(self, session):
+        session.jobs += 1
+        _reset(session)
+        with self._lock:
+            if session.jobs < self.max_jobs and len(self._idle) < self.max_idle:
+                self._idle.append(session)
+                return
+        self._close(session)
+
+    def _close(self, session):
+        try:
+            session.ydl.close()
+        except Exception as e:
+            logger.debug(f"Error closing a yt-dlp session: {str(e)}")
+
+
+def _reset(session):
+    ydl = session.ydl
+    ydl.params = dict(session.params)
+    ydl.params["outtmpl"] = dict(session.params["outtmpl"])
+    ydl.format_selector = None
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    ydl._post_hooks = []
+    ydl._pps = {when: [] for when in ydl._pps}
+    ydl._download_retcode = 0
+
+
+def _configure(session, opts):
+    """Apply a job's options the way ``YoutubeDL.__init__`` does."""
+    from yt_dlp.postprocessor import get_postprocessor
+
+    ydl = session.ydl
+    _reset(session)
+    ydl.params.update(
+        {key: value for key, value in opts.items() if key not in _HOOK_OPTS}
+    )
+    if "outtmpl" in opts:
+        ydl._parse_outtmpl()
+    format_spec = ydl.params.get("format")
+    if format_spec not in (None, "-"):
+        ydl.format_selector = (
+            format_spec
+            if callable(format_spec)
+            else ydl.build_format_selector(format_spec)
+        )
+    for hook in opts.get("progress_hooks", []):
+        ydl.add_progress_hook(hook)
+    for hook in opts.get("postprocessor_hooks", []):
+        ydl.add_postprocessor_hook(hook)
+    for hook in opts.get("post_hooks", []):
+        ydl.add_post_hook(hook)
+    for pp_def in opts.get("postprocessors", []):
+        pp_def = dict(pp_def)
+        when = pp_def.pop("when", "post_process")
+        ydl.add_post_processor(
+            get_postprocessor(pp_def.pop("key"))(ydl, **pp_def), when
+        )
+
+
+def format_connection_stats(stats):
+    """One line summary of ``SessionPool.stats`` for the logs."""
+    line = f"{stats['requests']} HTTP requests over {stats['connections']} connections"
+    if stats["reuse"] is not None:
+        line += f" ({stats['reuse']:.0%} reused)"
+    return (
+        f"{line}, {stats['tls_handshakes']} TLS handshakes, "
+        f"{stats['sessions']} yt-dlp sessions"
+    )
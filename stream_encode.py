@@ -0,0 +1,177 @@
+"""Encode MP3s while the audio stream is still downloading.
+
+Instead of writing the whole audio stream to disk and running ffmpeg
+afterwards, the stream is read over HTTP and piped straight into
+ffmpeg's stdin. A reader thread and a bounded chunk queue keep the
+network and the encoder running side by side without buffering more
+than a few megabytes. Only single-file HTTP(S) audio formats can be
+piped, anything fragmented (DASH, HLS) is left to the regular path.
+"""
+
+import os
+import queue
+import threading
+import subprocess
+
+CHUNK_SIZE = 64 * 1024
+# Chunks buffered between the network reader and ffmpeg (2 MiB)
+MAX_BUFFERED_CHUNKS = 32
+READ_TIMEOUT = 30
+
+_END = object()
+
+
+def mp3_command(source, target, bitrate):
+    """The ffmpeg arguments yt-dlp's FFmpegExtractAudio uses for MP3."""
+    return [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        source,
+        "-vn",
+        "-acodec",
+        "libmp3lame",
+        "-b:a",
+        f"{bitrate}k",
+        "-f",
+        "mp3",
+        target,
+    ]
+
+
+def is_pipeable(fmt):
+    """Whether a format is a single audio-only file that can be read over HTTP."""
+    return bool(
+        fmt.get("url")
+        and fmt.get("protocol", "https") in ("http", "https")
+        and not fmt.get("fragments")
+        and fmt.get("vcodec") == "none"
+        and fmt.get("acodec") not in (None, "none")
+    )
+
+
+def pick_stream_format(info):
+    """Return the best audio-only format that can be piped, or None."""
+    candidates = [fmt for fmt in info.get("formats") or [] if is_pipeable(fmt)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda fmt: fmt.get("abr") or fmt.get("tbr") or 0)
+
+
+def _put(chunks, item, stop):
+    # Blocks while ffmpeg is behind, that's the backpressure
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_stream(response, chunks, stop):
+    """Network side: read the response into the bounded chunk queue."""
+    try:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                _put(chunks, _END, stop)
+                return
+            if not _put(chunks, chunk, stop):
+                return
+    except Exception as e:
+        _put(chunks, e, stop)
+    finally:
+        response.close()
+
+
+def stream_mp3(job, info, fmt, target, progress_hook, ydl=None):
+    """Download ``fmt`` of ``info`` and encode it to ``target`` in one pass.
+
+    ``progress_hook`` receives yt-dlp style progress dicts, raising from
+    it stops the stream. With ``ydl`` the stream is requested through that
+    YoutubeDL, reusing its open connections, otherwise with urllib.
+    Raises on network or encoder errors, a partly written MP3 is removed.
+    """
+    bitrate = job.quality.replace("kbps", "")
+    temp_target = os.path.splitext(target)[0] + ".temp.mp3"
+    headers = fmt.get("http_headers") or {}
+    if ydl is not None:
+        from yt_dlp.networking import Request
+
+        response = ydl.urlopen(
+            Request(fmt["url"], headers=headers, extensions={"timeout": READ_TIMEOUT})
+        )
+    else:
+        import urllib.request
+
+        request = urllib.request.Request(fmt["url"], headers=headers)
+        response = urllib.request.urlopen(request, timeout=READ_TIMEOUT)
+    total_bytes = (
+        int(response.headers.get("Content-Length") or 0)
+        or fmt.get("filesize")
+        or fmt.get("filesize_approx")
+    )
+
+    command = mp3_command("pipe:0", temp_target, bitrate)
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    job.add_process(process)
+
+    # Drain stderr on its own thread so a chatty ffmpeg can't block the pipe
+    stderr_lines = []
+    stderr_thread = threading.Thread(
+        target=lambda: stderr_lines.extend(process.stderr), daemon=True
+    )
+    stderr_thread.start()
+
+    chunks = queue.Queue(maxsize=MAX_BUFFERED_CHUNKS)
+    stop = threading.Event()
+    threading.Thread(
+        target=_read_stream, args=(response, chunks, stop), daemon=True
+    ).start()
+
+    status = {
+        "status": "downloading",
+        "downloaded_bytes": 0,
+        "total_bytes": total_bytes,
+        "tmpfilename": temp_target,
+        "filename": target,
+        "info_dict": info,
+    }
+    try:
+        progress_hook(dict(status))
+        while True:
+            chunk = chunks.get()
+            if chunk is _END:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            process.stdin.write(chunk)
+            status["downloaded_bytes"] += len(chunk)
+            progress_hook(dict(status))
+
+        process.stdin.close()
+        progress_hook(dict(status, status="finished"))
+        process.wait()
+        stderr_thread.join(timeout=5)
+        if process.returncode != 0:
+            message = b"".join(stderr_lines).decode("utf-8", "replace").strip()
+            raise RuntimeError(message or f"ffmpeg exited with {process.returncode}")
+        os.replace(temp_target, target)
+    except BaseException:
+        stop.set()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        try:
+            os.remove(temp_target)
+        except OSError:
+            pass
+        raise
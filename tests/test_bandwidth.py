@@ -0,0 +1,89 @@
+"""Bandwidth shares of the running jobs and rate parsing."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandwidth import BandwidthScheduler, parse_rate  # noqa: E402
+
+
+class AllocateTest(unittest.TestCase):
+    def rates(self, global_limit, caps):
+        scheduler = BandwidthScheduler(global_limit)
+        for job_id, cap in enumerate(caps):
+            scheduler.register(job_id, cap)
+        return [scheduler.rate(job_id) for job_id in range(len(caps))]
+
+    def test_shares(self):
+        cases = [
+            # global limit, per-job caps, expected rates
+            (300, [None, None, None], [100, 100, 100]),
+            # A cap below the equal share is kept, the rest is split
+            (300, [50, None, None], [50, 125, 125]),
+            (300, [50, 70, None], [50, 70, 180]),
+            # A cap above the equal share gets the equal share
+            (300, [200, None, None], [100, 100, 100]),
+            (300, [500, 500], [150, 150]),
+            # Everyone capped below their share leaves bandwidth unused
+            (300, [10, 20], [10, 20]),
+            # Without a global limit only the caps apply
+            (None, [None, 50], [None, 50]),
+            (None, [], []),
+        ]
+        for global_limit, caps, expected in cases:
+            with self.subTest(global_limit=global_limit, caps=caps):
+                self.assertEqual(self.rates(global_limit, caps), expected)
+
+    def test_limits_change(self):
+        scheduler = BandwidthScheduler(300)
+        scheduler.register("big")
+        scheduler.register("small", 50)
+        self.assertEqual(scheduler.rate("big"), 250)
+
+        scheduler.set_job_limit("small", 200)
+        self.assertEqual(scheduler.rate("big"), 150)
+        self.assertEqual(scheduler.rate("small"), 150)
+
+        scheduler.unregister("small")
+        self.assertEqual(scheduler.rate("big"), 300)
+        self.assertIsNone(scheduler.rate("small"))
+
+        scheduler.set_global_limit(0)
+        self.assertIsNone(scheduler.global_limit)
+        self.assertIsNone(scheduler.rate("big"))
+
+    def test_unknown_job_is_not_throttled(self):
+        scheduler = BandwidthScheduler(1)
+        scheduler.set_job_limit("missing", 10)
+        # Returns right away instead of sleeping for a job it doesn't know
+        scheduler.consume("missing", 1024 * 1024)
+        self.assertIsNone(scheduler.rate("missing"))
+
+
+class ParseRateTest(unittest.TestCase):
+    def test_valid(self):
+        cases = [
+            ("1024", 1024),
+            ("500K", 500 * 1024),
+            ("500k", 500 * 1024),
+            ("2.5M", 2.5 * 1024**2),
+            (" 1.5 MB/s ", 1.5 * 1024**2),
+            ("1GiB", 1024**3),
+            ("0", None),
+            ("0K", None),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(parse_rate(text), expected)
+
+    def test_invalid(self):
+        for text in ["", "fast", "-5", "-1M", "5T", "1.M", "M", "1 2"]:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_rate(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+"""Format choices for each output format and quality."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from format_selector import COPY, ENCODE, REMUX  # noqa: E402
+from format_selector import estimated_size, select_format  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def audio(format_id, ext, acodec, abr=None, tbr=None, filesize=None):
+    return {
+        "format_id": format_id,
+        "ext": ext,
+        "vcodec": "none",
+        "acodec": acodec,
+        "abr": abr,
+        "tbr": tbr,
+        "filesize": filesize,
+    }
+
+
+def video(format_id, ext, height, acodec="none", filesize=None, tbr=None):
+    return {
+        "format_id": format_id,
+        "ext": ext,
+        "vcodec": "avc1.4d401f" if ext == "mp4" else "vp9",
+        "acodec": acodec,
+        "height": height,
+        "filesize": filesize,
+        "tbr": tbr,
+    }
+
+
+# Roughly what YouTube lists for a video of 200 seconds
+YOUTUBE_FORMATS = [
+    {"format_id": "sb0", "protocol": "mhtml", "ext": "mhtml", "vcodec": "none"},
+    audio("139", "m4a", "mp4a.40.5", abr=48.8, filesize=1 * MB),
+    audio("140", "m4a", "mp4a.40.2", abr=129.5, filesize=3 * MB),
+    audio("250", "webm", "opus", abr=70.1),
+    # No filesize, estimated from the bitrate at about 3.2 MB
+    audio("251", "webm", "opus", abr=135.0),
+    video("18", "mp4", 360, acodec="mp4a.40.2", filesize=6 * MB),
+    video("134", "mp4", 360, filesize=4 * MB),
+    video("136", "mp4", 720, filesize=12 * MB),
+    video("137", "mp4", 1080, filesize=30 * MB),
+    video("248", "webm", 1080, filesize=20 * MB),
+]
+
+
+class SelectFormatTest(unittest.TestCase):
+    def check(self, cases, formats, duration=200):
+        info = {"formats": formats, "duration": duration}
+        for file_format, quality, spec, cost in cases:
+            with self.subTest(file_format=file_format, quality=quality):
+                choice = select_format(info, file_format, quality)
+                if spec is None:
+                    self.assertIsNone(choice)
+                    continue
+                self.assertIsNotNone(choice)
+                self.assertEqual(choice.format_spec, spec)
+                self.assertEqual(choice.cost, cost)
+                self.assertTrue(choice.reason)
+
+    def test_youtube_formats(self):
+        self.check(
+            [
+                # Both 128k streams qualify, the m4a one is smaller
+                ("mp3", "128kbps", "140", ENCODE),
+                ("mp3", "64kbps", "250", ENCODE),
+                # Nothing reaches 320k, the highest bitrate is taken
+                ("mp3", "320kbps", "251", ENCODE),
+                # m4a is kept as is, opus needs remuxing out of .webm
+                ("audio", "128kbps", "140", COPY),
+                ("audio", "160kbps", "251", REMUX),
+                ("audio", "Best", "251", REMUX),
+                ("mp4", "Best", "137+140", REMUX),
+                ("mp4", "1080p", "137+140", REMUX),
+                ("mp4", "720p", "136+140", REMUX),
+                # The progressive stream needs no merging
+                ("mp4", "360p", "18", COPY),
+                ("mp4", "480p", "18", COPY),
+                # Nothing that small, the smallest resolution instead of the best
+                ("mp4", "144p", "18", COPY),
+            ],
+            YOUTUBE_FORMATS,
+        )
+
+    def test_mp3_stream_is_copied(self):
+        formats = YOUTUBE_FORMATS + [audio("mp3-128", "mp3", "mp3", abr=128)]
+        self.check([("mp3", "128kbps", "mp3-128", COPY)], formats)
+
+    def test_missing_bitrates(self):
+        formats = [
+            # Only the total bitrate is known
+            audio("tbr-only", "m4a", "mp4a.40.2", tbr=130),
+            # Neither, and no size either
+            audio("unknown", "m4a", "mp4a.40.2"),
+        ]
+        self.check(
+            [
+                ("mp3", "128kbps", "tbr-only", ENCODE),
+                ("audio", "Best", "tbr-only", COPY),
+            ],
+            formats,
+        )
+        self.check([("mp3", "128kbps", "unknown", ENCODE)], formats[1:], duration=None)
+
+    def test_no_match(self):
+        video_only = [video("137", "mp4", 1080), video("248", "webm", 1080)]
+        cases = [
+            (formats, file_format)
+            for formats in ([], YOUTUBE_FORMATS[:1], video_only)
+            for file_format in ("mp3", "audio", "mp4")
+        ]
+        # Video only: no audio at all and no m4a to merge for mp4
+        for formats, file_format in cases:
+            quality = "Best" if file_format != "mp3" else "128kbps"
+            self.check([(file_format, quality, None, None)], formats)
+        # Audio only: nothing to build an mp4 from
+        self.check([("mp4", "720p", None, None)], [audio("251", "webm", "opus", 135)])
+
+    def test_estimated_size(self):
+        cases = [
+            ({"filesize": 100}, 10, 100),
+            ({"filesize_approx": 200}, 10, 200),
+            ({"tbr": 8}, 10, 10000),
+            ({"abr": 4, "vbr": 4}, 10, 10000),
+            ({"tbr": 8}, None, None),
+            ({}, 10, None),
+        ]
+        for fmt, duration, expected in cases:
+            with self.subTest(fmt=fmt, duration=duration):
+                self.assertEqual(estimated_size(fmt, duration), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""The metadata cache: copies of the cached info dicts and disk pruning."""
+
+import os
+import sys
+import copy
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.media_server import MediaFile, MediaServer  # noqa: E402
+from download_core import COMPLETED, DownloadJob, run_job  # noqa: E402
+from metadata_cache import MetadataCache, prune_cache_dir  # noqa: E402
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+class CachedInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MediaServer().start()
+        media = MediaFile("audio.m4a", size=256 * 1024)
+        self.server.files[media.name] = media
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = MetadataCache(cache_dir=os.path.join(self.tmpdir, "cache"))
+        self.info = {
+            "id": VIDEO_ID,
+            "title": "Cached video",
+            "extractor": "youtube",
+            "extractor_key": "Youtube",
+            "webpage_url": f"https://www.youtube.com/watch?v={VIDEO_ID}",
+            "formats": [
+                {
+                    "format_id": "140",
+                    "url": self.server.media_url(media.name),
+                    "ext": "m4a",
+                    "vcodec": "none",
+                    "acodec": "mp4a.40.2",
+                    "abr": 128,
+                    "filesize": media.size,
+                }
+            ],
+        }
+        self.cache.put(VIDEO_ID, self.info)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def run_audio_job(self):
+        job = DownloadJob(
+            f"https://www.youtube.com/watch?v={VIDEO_ID}",
+            self.tmpdir,
+            "audio",
+            "Best",
+        )
+        run_job(job, cache=self.cache)
+        return job
+
+    def test_cached_info_unchanged_after_run(self):
+        expected = copy.deepcopy(self.info)
+        for _ in range(2):
+            job = self.run_audio_job()
+            self.assertEqual(job.state, COMPLETED, job.error)
+            self.assertEqual(self.cache.get(VIDEO_ID), expected)
+        self.assertEqual(self.cache.stats()["misses"], 0)
+
+    def test_get_returns_copies(self):
+        first = self.cache.get(VIDEO_ID)
+        first["formats"].clear()
+        self.assertEqual(len(self.cache.get(VIDEO_ID)["formats"]), 1)
+
+
+class PruneCacheDirTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, name, age):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w"):
+            pass
+        used = time.time() - age
+        os.utime(path, (used, used))
+
+    def test_prune(self):
+        cases = [
+            # max files, max age, files left
+            (10, None, ["a.json", "b.json", "c.json", "d.json", "other.txt"]),
+            (2, None, ["a.json", "b.json", "other.txt"]),
+            (0, None, ["other.txt"]),
+            (10, 150, ["a.json", "b.json", "other.txt"]),
+            (1, 150, ["a.json", "other.txt"]),
+        ]
+        for max_files, max_age, expected in cases:
+            with self.subTest(max_files=max_files, max_age=max_age):
+                for age, name in enumerate(["a.json", "b.json", "c.json", "d.json"]):
+                    self.touch(name, age * 100)
+                self.touch("other.txt", 1000)
+                prune_cache_dir(self.tmpdir, ".json", max_files, max_age)
+                self.assertEqual(sorted(os.listdir(self.tmpdir)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
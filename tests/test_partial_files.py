@@ -0,0 +1,53 @@
+"""Cancelling a job removes its temporary files and nothing else."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_core import DownloadJob  # noqa: E402
+
+TEMPORARY = [
+    "video.f137.mp4.part",
+    "video.f137.mp4.part-Frag1",
+    "video.f137.mp4.part.segments",
+    "video.f137.mp4.ytdl",
+    "video.f137.temp.mp4",
+]
+# Outputs of this or an earlier run with the same names
+FINISHED = ["video.f137.mp4", "video.mp4", "video.mp3"]
+
+
+class RemovePartialFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in TEMPORARY + FINISHED:
+            with open(os.path.join(self.tmpdir, name), "w"):
+                pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def job(self, partial_files):
+        job = DownloadJob("https://youtu.be/dQw4w9WgXcQ", self.tmpdir, "mp4", "Best")
+        data = job.to_dict()
+        data["partial_files"] = [self.path(name) for name in partial_files]
+        return DownloadJob.from_dict(data)
+
+    def test_keeps_finished_files(self):
+        # Journals written before only .part files were tracked list outputs too
+        job = self.job(["video.f137.mp4.part", "video.mp4", "video.mp3"])
+        self.assertEqual(job.partial_files, {self.path("video.f137.mp4.part")})
+        job.remove_partial_files()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted(FINISHED))
+        self.assertEqual(job.partial_files, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
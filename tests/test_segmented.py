@@ -0,0 +1,116 @@
+"""Interrupted segmented downloads must continue without corrupting the file."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.media_server import MediaFile, MediaServer  # noqa: E402
+from segmented import SegmentedHttpFD, SegmentedYoutubeDL  # noqa: E402
+
+SIZE = 8 * 1024 * 1024
+# Four connections take about two seconds, the state is saved every two
+RATE = 1024 * 1024
+
+# Runs in a child process that the test kills mid-download
+KILLED_DOWNLOAD = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from segmented import SegmentedHttpFD, SegmentedYoutubeDL
+ydl = SegmentedYoutubeDL({"quiet": True, "segmented_connections": 4})
+SegmentedHttpFD(ydl, ydl.params).download(sys.argv[3], {"url": sys.argv[2]})
+"""
+
+
+class _Paused(Exception):
+    pass
+
+
+class SegmentedResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MediaServer().start()
+        self.media = MediaFile("stream.bin", size=SIZE, rate=RATE)
+        self.server.files[self.media.name] = self.media
+        self.url = self.server.media_url(self.media.name)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "stream.bin")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, connections, hook=None):
+        ydl = SegmentedYoutubeDL(
+            {"quiet": True, "retries": 0, "segmented_connections": connections}
+        )
+        fd = SegmentedHttpFD(ydl, ydl.params)
+        if hook is not None:
+            fd.add_progress_hook(hook)
+        return fd.download(self.filename, {"url": self.url})
+
+    def assertDownloaded(self):
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        self.assertEqual(len(data), SIZE)
+        self.assertEqual(data, b"".join(self.media.blocks(0, SIZE)))
+        self.assertFalse(os.path.exists(self.filename + ".part.segments"))
+
+    def pause_after(self, count):
+        def hook(d):
+            if d["status"] == "downloading" and d["downloaded_bytes"] >= count:
+                raise _Paused()
+
+        return hook
+
+    def test_resume_after_kill(self):
+        child = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                KILLED_DOWNLOAD,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                self.url,
+                self.filename,
+            ]
+        )
+        part = self.filename + ".part"
+        deadline = time.monotonic() + 10
+        while not os.path.exists(part) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # Killed before the first periodic state save
+        time.sleep(1.0)
+        child.kill()
+        child.wait()
+        self.assertTrue(os.path.exists(part))
+
+        self.media.rate = None
+        self.download(4)
+        self.assertDownloaded()
+
+    def test_pause_then_single_connection(self):
+        with self.assertRaises(_Paused):
+            self.download(4, self.pause_after(SIZE // 3))
+        self.assertTrue(os.path.exists(self.filename + ".part.segments"))
+
+        self.media.rate = None
+        self.download(1)
+        self.assertDownloaded()
+
+    def test_pause_then_probe_fails(self):
+        with self.assertRaises(_Paused):
+            self.download(4, self.pause_after(SIZE // 3))
+
+        # The server stops serving ranges, the probe can't size the stream
+        self.media.rate = None
+        self.media.ranges = False
+        self.download(4)
+        self.assertDownloaded()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+"""Thumbnail loading for the Tk application.
+
+Thumbnails are downloaded with a timeout, decoded at reduced size (JPEG
+draft mode lets the decoder skip most of the full-resolution work),
+resized once and kept as small JPEGs in an on-disk LRU keyed by video
+ID, so showing a video again costs one small file read. Loading runs on
+a few background threads, turning the image into a ``PhotoImage`` is
+left to the Tk thread. Pillow is imported on the first load. With a
+``SessionPool`` thumbnails are requested through its yt-dlp sessions,
+which keep their connections open between thumbnails.
+"""
+
+import io
+import os
+import queue
+import hashlib
+import logging
+import threading
+
+from metadata_cache import CACHE_DIR, prune_cache_dir
+
+THUMBNAIL_SIZE = (200, 120)
+REQUEST_TIMEOUT = 10
+MAX_CACHED_FILES = 500
+PREFETCH_WORKERS = 2
+
+logger = logging.getLogger("YouTubeDownloader")
+
+
+def youtube_thumbnail_url(video_id):
+    # 320x180 JPEG, plenty for the preview and a fraction of maxresdefault
+    return f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+
+
+def pick_thumbnail_url(info, size=THUMBNAIL_SIZE):
+    """Return the smallest thumbnail of an info dict that still covers ``size``."""
+    sized = [
+        thumb
+        for thumb in info.get("thumbnails") or []
+        if thumb.get("url") and (thumb.get("width") or 0) >= size[0]
+    ]
+    if sized:
+        return min(sized, key=lambda thumb: thumb["width"])["url"]
+    if info.get("extractor_key", "Youtube") == "Youtube" and info.get("id"):
+        return youtube_thumbnail_url(info["id"])
+    return info.get("thumbnail")
+
+
+class ThumbnailService:
+    """Fetches, shrinks and caches thumbnails, safe to use from any thread."""
+
+    def __init__(
+        self,
+        cache_dir=CACHE_DIR,
+        size=THUMBNAIL_SIZE,
+        max_files=MAX_CACHED_FILES,
+        timeout=REQUEST_TIMEOUT,
+        sessions=None,
+    ):
+        self.cache_dir = os.path.join(cache_dir, "thumbnails") if cache_dir else None
+        self.size = size
+        self.max_files = max_files
+        self.timeout = timeout
+        self.sessions = sessions
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._queued = set()
+        self._workers = 0
+
+    def load(self, key, url=None):
+        """Return the resized thumbnail as a PIL image, from the cache if possible.
+
+        ``key`` is the video ID, without ``url`` the YouTube thumbnail of
+        that ID is used. Raises on network and decode errors.
+        """
+        from PIL import Image
+
+        path = self._path(key)
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                # Mark as recently used for the LRU eviction
+                os.utime(path)
+                image = Image.open(io.BytesIO(data))
+                # Decode here rather than on the Tk thread
+                image.load()
+                return image
+            except OSError:
+                pass
+
+        image = self._fetch(url or youtube_thumbnail_url(key))
+        if path is not None:
+            self._store(path, image)
+        return image
+
+    def load_async(self, key, url, on_loaded):
+        """Load on a background thread, then call ``on_loaded(image, error)``."""
+
+        def run():
+            try:
+                image = self.load(key, url)
+            except Exception as e:
+                on_loaded(None, str(e))
+                return
+            on_loaded(image, None)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def prefetch(self, items):
+        """Warm the cache for ``(key, url)`` pairs on the prefetch threads."""
+        with self._lock:
+            for key, url in items:
+                if key in self._queued or self._is_cached(key):
+                    continue
+                self._queued.add(key)
+                self._pending.put((key, url))
+            while self._workers < PREFETCH_WORKERS and not self._pending.empty():
+                self._workers += 1
+                threading.Thread(target=self._prefetch_worker, daemon=True).start()
+
+    def _prefetch_worker(self):
+        while True:
+            try:
+                key, url = self._pending.get(timeout=5)
+            except queue.Empty:
+                with self._lock:
+                    if self._pending.empty():
+                        self._workers -= 1
+                        return
+                continue
+            try:
+                self.load(key, url)
+            except Exception as e:
+                logger.debug(f"Can't prefetch thumbnail {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._queued.discard(key)
+
+    def _fetch(self, url):
+        from PIL import Image
+
+        if self.sessions is not None:
+            from yt_dlp.networking import Request
+
+            request = Request(url, extensions={"timeout": self.timeout})
+            with self.sessions.session() as ydl, ydl.urlopen(request) as response:
+                data = response.read()
+        else:
+            import urllib.request
+
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                data = response.read()
+        image = Image.open(io.BytesIO(data))
+        # JPEGs are decoded at the smallest scale that still covers the size
+        image.draft("RGB", self.size)
+        image = image.convert("RGB")
+        return image.resize(self.size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+        if not key.replace("-", "").replace("_", "").isalnum():
+            key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        width, height = self.size
+        return os.path.join(self.cache_dir, f"{key}_{width}x{height}.jpg")
+
+    def _is_cached(self, key):
+        path = self._path(key)
+        return path is not None and os.path.isfile(path)
+
+    def _store(self, path, image):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            image.save(tmp_path, "JPEG", quality=85)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            # The disk cache is an optimisation only
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        with self._lock:
+            prune_cache_dir(self.cache_dir, ".jpg", self.max_files)
@@ -0,0 +1,149 @@
+"""CPU-bound transcode stage of the download pipeline.
+
+MP3 jobs don't run ffmpeg on their download worker. The worker downloads
+the best audio stream, hands the file to a ``TranscodePool`` and moves on
+to the next download while the pool encodes it. The hand-off queue is
+bounded, so when encoding falls behind the download workers block
+instead of piling up source files on disk.
+"""
+
+import os
+import time
+import queue
+import subprocess
+
+from download_core import (
+    TRANSCODING,
+    WAITING_TRANSCODE,
+    WorkerPool,
+    finish_interrupted,
+)
+from progress_state import StageStats
+from stream_encode import mp3_command
+
+
+def default_workers():
+    return os.cpu_count() or 2
+
+
+class TranscodeTask:
+    def __init__(self, job, source, on_done):
+        self.job = job
+        self.source = source
+        self.on_done = on_done
+        self.queued_at = time.monotonic()
+
+
+class TranscodePool:
+    """Runs ffmpeg encodes on their own bounded pool of worker threads.
+
+    ``on_done(path)`` of a task is called on the pool's thread once the
+    MP3 is written, ``on_update(job)`` after every state change.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, on_update=None):
+        max_workers = max(1, int(max_workers or default_workers()))
+        # Backpressure: at most this many sources wait for an encoder
+        self._pending = queue.Queue(maxsize=max_pending or max_workers * 2)
+        self.on_update = on_update
+        self.stats = StageStats("transcode")
+        self._workers = WorkerPool(self._work, self._pending, max_workers)
+
+    @property
+    def max_workers(self):
+        return self._workers.max_workers
+
+    def set_max_workers(self, count):
+        self._workers.set_max_workers(count)
+
+    def submit(self, job, source, on_done):
+        """Queue a downloaded file for encoding, blocking while the queue is full.
+
+        Returns the seconds spent blocked, or None if the job was stopped
+        while waiting for room.
+        """
+        task = TranscodeTask(job, source, on_done)
+        job.state = WAITING_TRANSCODE
+        self.notify(job)
+        with self._workers.lock:
+            self._workers.spawn()
+
+        started = time.monotonic()
+        while True:
+            if job.stop_request is not None:
+                return None
+            try:
+                self._pending.put(task, timeout=0.5)
+                return time.monotonic() - started
+            except queue.Full:
+                continue
+
+    def join(self):
+        """Block until every submitted file has been encoded."""
+        self._pending.join()
+
+    def stop(self, timeout=None):
+        """Stop the workers once their current encode is done, see ``WorkerPool.stop``."""
+        return self._workers.stop(timeout)
+
+    def notify(self, job):
+        if self.on_update:
+            self.on_update(job)
+
+    def _work(self, task):
+        try:
+            self._run(task)
+        finally:
+            self.notify(task.job)
+
+    def _run(self, task):
+        job = task.job
+        wait = time.monotonic() - task.queued_at
+        job.timings["transcode_wait"] = wait
+        if job.stop_request is not None:
+            finish_interrupted(job, None)
+            return
+
+        bitrate = job.quality.replace("kbps", "")
+        target = os.path.splitext(task.source)[0] + ".mp3"
+        temp_target = os.path.splitext(task.source)[0] + ".temp.mp3"
+        job.state = TRANSCODING
+        self.notify(job)
+
+        started = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                mp3_command(task.source, temp_target, bitrate),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            # Registered so cancel and pause can terminate it
+            job.add_process(process)
+            _, stderr = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(
+                    stderr.decode("utf-8", "replace").strip()
+                    or f"ffmpeg exited with code {process.returncode}"
+                )
+            os.replace(temp_target, target)
+        except Exception as e:
+            busy = time.monotonic() - started
+            job.timings["transcode"] = busy
+            self.stats.record(busy, wait)
+            try:
+                os.remove(temp_target)
+            except OSError:
+                pass
+            finish_interrupted(job, f"Transcoding failed: {str(e)}")
+            return
+
+        busy = time.monotonic() - started
+        job.timings["transcode"] = busy
+        self.stats.record(busy, wait)
+        if task.source != target:
+            try:
+                os.remove(task.source)
+            except OSError:
+                pass
+        task.on_done(target)
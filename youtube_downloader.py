@@ -1,523 +1,1356 @@
-import os
-import re
-import threading
-import tkinter as tk
-from tkinter import ttk, filedialog, StringVar, BooleanVar
-import logging
-import json
-import yt_dlp
-from PIL import Image, ImageTk
-import urllib.request
-import urllib.parse
-import io
-import subprocess
-
-
-class YouTubeDownloaderApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("YouTube Downloader")
-        self.root.geometry("600x600")
-        self.root.resizable(True, True)
-        self.root.configure(padx=10, pady=10)
-
-        # Set application icon
-        try:
-            if os.path.exists("youtube_icon.ico"):
-                self.root.iconbitmap("youtube_icon.ico")
-        except Exception:
-            # Icon not found or not supported, continue without icon
-            pass
-
-        # Variables
-        self.url_var = StringVar()
-        self.download_path_var = StringVar()
-        self.format_var = StringVar(value="mp3")
-        self.progress_var = StringVar(value="0%")
-        self.progress_value = tk.DoubleVar(value=0.0)
-        self.download_thread = None
-        self.is_downloading = BooleanVar(value=False)
-        self.current_task = None
-        self.video_title = StringVar()
-        self.quality_var = StringVar()
-
-        # Load saved settings
-        self.settings_file = "settings.json"
-
-        # Configure logging
-        self.setup_logging()
-
-        # Now load settings after logging is set up
-        self.load_settings()
-
-        # Create UI
-        self.create_widgets()
-
-        # Quality options for MP3 and MP4
-        self.mp3_qualities = ["128kbps", "192kbps", "256kbps", "320kbps"]
-        self.mp4_qualities = ["360p", "480p", "720p", "1080p", "Best"]
-        self.update_quality_options()
-
-        # Check for FFmpeg
-        self.root.after(1000, self.check_ffmpeg)
-
-    def setup_logging(self):
-        self.log_handler = None
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-        self.logger = logging.getLogger("YouTubeDownloader")
-
-    def create_widgets(self):
-        # Main frame
-        main_frame = ttk.Frame(self.root)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-
-        # URL section
-        url_frame = ttk.LabelFrame(main_frame, text="YouTube URL")
-        url_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        ttk.Label(url_frame, text="URL:").grid(
-            row=0, column=0, padx=5, pady=5, sticky=tk.W
-        )
-        ttk.Entry(url_frame, textvariable=self.url_var, width=50).grid(
-            row=0, column=1, padx=5, pady=5, sticky=tk.W + tk.E
-        )
-        ttk.Button(url_frame, text="Fetch", command=self.fetch_video_info).grid(
-            row=0, column=2, padx=5, pady=5
-        )
-
-        # Video title display
-        ttk.Label(url_frame, text="Title:").grid(
-            row=1, column=0, padx=5, pady=5, sticky=tk.W
-        )
-        ttk.Label(url_frame, textvariable=self.video_title, wraplength=400).grid(
-            row=1, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W
-        )
-
-        # Thumbnail frame (will be populated when URL is fetched)
-        self.thumbnail_frame = ttk.LabelFrame(main_frame, text="Thumbnail")
-        self.thumbnail_frame.pack(fill=tk.X, padx=5, pady=5)
-        self.thumbnail_label = ttk.Label(self.thumbnail_frame)
-        self.thumbnail_label.pack(padx=5, pady=5)
-
-        # Download location section
-        path_frame = ttk.LabelFrame(main_frame, text="Download Location")
-        path_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        ttk.Label(path_frame, text="Save to:").grid(
-            row=0, column=0, padx=5, pady=5, sticky=tk.W
-        )
-        ttk.Entry(path_frame, textvariable=self.download_path_var, width=50).grid(
-            row=0, column=1, padx=5, pady=5, sticky=tk.W + tk.E
-        )
-        ttk.Button(path_frame, text="Browse", command=self.browse_directory).grid(
-            row=0, column=2, padx=5, pady=5
-        )
-
-        # Format section
-        format_frame = ttk.LabelFrame(main_frame, text="Format Options")
-        format_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        ttk.Radiobutton(
-            format_frame,
-            text="Audio (MP3)",
-            variable=self.format_var,
-            value="mp3",
-            command=self.update_quality_options,
-        ).grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
-        ttk.Radiobutton(
-            format_frame,
-            text="Video (MP4)",
-            variable=self.format_var,
-            value="mp4",
-            command=self.update_quality_options,
-        ).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
-
-        ttk.Label(format_frame, text="Quality:").grid(
-            row=1, column=0, padx=5, pady=5, sticky=tk.W
-        )
-        self.quality_combobox = ttk.Combobox(
-            format_frame, textvariable=self.quality_var, state="readonly", width=10
-        )
-        self.quality_combobox.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
-
-        # Progress section
-        progress_frame = ttk.LabelFrame(main_frame, text="Download Progress")
-        progress_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        self.progress_bar = ttk.Progressbar(
-            progress_frame, variable=self.progress_value, length=100, mode="determinate"
-        )
-        self.progress_bar.pack(fill=tk.X, padx=5, pady=5)
-        ttk.Label(progress_frame, textvariable=self.progress_var).pack(padx=5, pady=2)
-
-        # Action buttons
-        buttons_frame = ttk.Frame(main_frame)
-        buttons_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        self.download_button = ttk.Button(
-            buttons_frame, text="Download", command=self.start_download
-        )
-        self.download_button.pack(side=tk.LEFT, padx=5, pady=5)
-
-        self.cancel_button = ttk.Button(
-            buttons_frame,
-            text="Cancel",
-            command=self.cancel_download,
-            state=tk.DISABLED,
-        )
-        self.cancel_button.pack(side=tk.LEFT, padx=5, pady=5)
-
-        # Log section
-        log_frame = ttk.LabelFrame(main_frame, text="Log")
-        log_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-
-        scrollbar = ttk.Scrollbar(log_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-        self.log_text = tk.Text(
-            log_frame, wrap=tk.WORD, height=10, yscrollcommand=scrollbar.set
-        )
-        self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        scrollbar.config(command=self.log_text.yview)
-
-        # Configure log handler
-        self.log_handler = logging.StreamHandler(io.StringIO())
-        self.log_handler.setLevel(logging.INFO)
-        self.log_handler.setFormatter(
-            logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        )
-        self.logger.addHandler(self.log_handler)
-
-        # Start log update timer
-        self.root.after(100, self.update_log)
-
-    def update_quality_options(self):
-        if self.format_var.get() == "mp3":
-            self.quality_combobox["values"] = self.mp3_qualities
-            self.quality_var.set(self.mp3_qualities[-1])  # Default to highest quality
-        else:
-            self.quality_combobox["values"] = self.mp4_qualities
-            self.quality_var.set(self.mp4_qualities[-1])  # Default to highest quality
-
-    def browse_directory(self):
-        directory = filedialog.askdirectory()
-        if directory:
-            self.download_path_var.set(directory)
-            self.save_settings()
-
-    def fetch_video_info(self):
-        url = self.url_var.get().strip()
-        if not url:
-            self.logger.error("Please enter a YouTube URL")
-            return
-
-        if not self.is_valid_youtube_url(url):
-            self.logger.error("Invalid YouTube URL")
-            return
-
-        self.logger.info(f"Fetching video information for: {url}")
-
-        def fetch_thread():
-            try:
-                with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    title = info.get("title", "Unknown Title")
-
-                    # Update UI elements in the main thread
-                    self.root.after(0, lambda: self.video_title.set(title))
-                    self.root.after(
-                        0, lambda: self.logger.info(f"Video title: {title}")
-                    )
-
-                    # Fetch thumbnail
-                    thumbnail_url = info.get("thumbnail")
-                    if thumbnail_url:
-                        try:
-                            response = urllib.request.urlopen(thumbnail_url)
-                            data = response.read()
-                            image = Image.open(io.BytesIO(data))
-
-                            # Resize thumbnail to fit in the UI
-                            image = image.resize((200, 120), Image.Resampling.LANCZOS)
-                            photo = ImageTk.PhotoImage(image)
-
-                            # Update thumbnail in the main thread
-                            self.root.after(0, lambda: self.update_thumbnail(photo))
-                        except Exception as e:
-                            self.root.after(
-                                0,
-                                lambda: self.logger.error(
-                                    f"Error loading thumbnail: {str(e)}"
-                                ),
-                            )
-            except Exception as e:
-                self.root.after(
-                    0, lambda: self.logger.error(f"Error fetching video info: {str(e)}")
-                )
-
-        threading.Thread(target=fetch_thread, daemon=True).start()
-
-    def update_thumbnail(self, photo):
-        self.thumbnail_photo = photo  # Keep a reference to prevent garbage collection
-        self.thumbnail_label.config(image=photo)
-
-    def is_valid_youtube_url(self, url):
-        youtube_regex = r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$"
-        return bool(re.match(youtube_regex, url))
-
-    def sanitize_filename(self, filename):
-        # Remove invalid characters for filenames
-        invalid_chars = r'[\\/*?:"<>|]'
-        return re.sub(invalid_chars, "_", filename)
-
-    def start_download(self):
-        url = self.url_var.get().strip()
-        download_path = self.download_path_var.get()
-
-        if not url:
-            self.logger.error("Please enter a YouTube URL")
-            return
-
-        if not download_path:
-            self.logger.error("Please select a download location")
-            return
-
-        if not os.path.exists(download_path):
-            self.logger.error(f"Download path does not exist: {download_path}")
-            return
-
-        if not self.is_valid_youtube_url(url):
-            self.logger.error("Invalid YouTube URL")
-            return
-
-        # Update UI for download state
-        self.is_downloading.set(True)
-        self.download_button.config(state=tk.DISABLED)
-        self.cancel_button.config(state=tk.NORMAL)
-        self.progress_value.set(0)
-        self.progress_var.set("0%")
-
-        # Save settings
-        self.save_settings()
-
-        # Start download in a separate thread
-        self.download_thread = threading.Thread(target=self.download_video, daemon=True)
-        self.download_thread.start()
-
-    def download_video(self):
-        url = self.url_var.get().strip()
-        download_path = self.download_path_var.get()
-        file_format = self.format_var.get()
-        quality = self.quality_var.get()
-
-        self.logger.info(f"Starting download: {url}")
-        self.logger.info(f"Format: {file_format.upper()}, Quality: {quality}")
-
-        try:
-            output_template = os.path.join(download_path, "%(title)s.%(ext)s")
-
-            ydl_opts = {
-                "outtmpl": output_template,
-                "progress_hooks": [self.progress_hook],
-                "quiet": True,
-                "no_warnings": True,
-            }
-
-            if file_format == "mp3":
-                # Audio download options
-                bitrate = quality.replace("kbps", "")
-                ydl_opts.update(
-                    {
-                        "format": "bestaudio/best",
-                        "postprocessors": [
-                            {
-                                "key": "FFmpegExtractAudio",
-                                "preferredcodec": "mp3",
-                                "preferredquality": bitrate,
-                            }
-                        ],
-                    }
-                )
-            else:
-                # Video download options
-                if quality == "Best":
-                    format_code = (
-                        "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
-                    )
-                else:
-                    height = quality.replace("p", "")
-                    format_code = f"bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}][ext=mp4]/best"
-
-                ydl_opts.update(
-                    {
-                        "format": format_code,
-                        "merge_output_format": "mp4",
-                    }
-                )
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                self.current_task = ydl
-                ydl.download([url])
-
-            self.root.after(
-                0, lambda: self.logger.info("Download completed successfully")
-            )
-        except Exception as e:
-            error_message = str(e)
-            self.root.after(
-                0,
-                lambda error=error_message: self.logger.error(
-                    f"Download error: {error}"
-                ),
-            )
-        finally:
-            self.current_task = None
-            self.root.after(0, self.reset_download_state)
-
-    def progress_hook(self, d):
-        if d["status"] == "downloading":
-            # Calculate progress
-            if "total_bytes" in d and d["total_bytes"] > 0:
-                percentage = (d["downloaded_bytes"] / d["total_bytes"]) * 100
-            elif "total_bytes_estimate" in d and d["total_bytes_estimate"] > 0:
-                percentage = (d["downloaded_bytes"] / d["total_bytes_estimate"]) * 100
-            else:
-                # Can't calculate percentage, show indeterminate progress
-                percentage = -1
-
-            # Format download speed
-            if "speed" in d and d["speed"] is not None:
-                speed = d["speed"] / 1024 / 1024  # Convert to MB/s
-                speed_str = f"{speed:.2f} MB/s"
-            else:
-                speed_str = "N/A"
-
-            # Update UI in main thread
-            if percentage >= 0:
-                self.root.after(0, lambda: self.progress_value.set(percentage))
-                self.root.after(
-                    0, lambda: self.progress_var.set(f"{percentage:.1f}% ({speed_str})")
-                )
-            else:
-                self.root.after(
-                    0, lambda: self.progress_var.set(f"Downloading... ({speed_str})")
-                )
-
-            # Log progress occasionally (every 10%)
-            if "downloaded_bytes" in d and "total_bytes" in d:
-                if (
-                    int(percentage) % 10 == 0
-                    and hasattr(self, "last_logged_percent")
-                    and self.last_logged_percent != int(percentage)
-                ):
-                    self.last_logged_percent = int(percentage)
-                    mb_down = d["downloaded_bytes"] / 1024 / 1024
-                    mb_total = d["total_bytes"] / 1024 / 1024
-                    self.root.after(
-                        0,
-                        lambda: self.logger.info(
-                            f"Downloaded {mb_down:.1f}MB of {mb_total:.1f}MB ({percentage:.1f}%)"
-                        ),
-                    )
-
-            if not hasattr(self, "last_logged_percent"):
-                self.last_logged_percent = 0
-
-        elif d["status"] == "finished":
-            self.root.after(
-                0, lambda: self.logger.info("Download finished, now processing...")
-            )
-            self.root.after(0, lambda: self.progress_var.set("Processing..."))
-
-    def cancel_download(self):
-        if self.current_task:
-            self.logger.info("Cancelling download...")
-            # yt-dlp doesn't support direct cancellation, but we can reset the UI state
-            self.reset_download_state()
-
-    def reset_download_state(self):
-        self.is_downloading.set(False)
-        self.download_button.config(state=tk.NORMAL)
-        self.cancel_button.config(state=tk.DISABLED)
-        self.current_task = None
-
-    def update_log(self):
-        # Get log content from handler
-        if self.log_handler and hasattr(self.log_handler, "stream"):
-            log_stream = self.log_handler.stream
-            log_content = log_stream.getvalue()
-            if log_content:
-                self.log_text.config(state=tk.NORMAL)
-                self.log_text.delete(1.0, tk.END)
-                self.log_text.insert(tk.END, log_content)
-                self.log_text.config(state=tk.DISABLED)
-                self.log_text.see(tk.END)
-                # Clear the stream
-                log_stream.truncate(0)
-                log_stream.seek(0)
-
-        # Schedule next update
-        self.root.after(100, self.update_log)
-
-    def load_settings(self):
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, "r") as f:
-                    settings = json.load(f)
-                    download_path = settings.get("download_path", "")
-                    if download_path and os.path.exists(download_path):
-                        self.download_path_var.set(download_path)
-                    self.logger.info(f"Loaded settings from {self.settings_file}")
-            else:
-                # Set default download path to user's Downloads folder
-                default_download_path = os.path.join(
-                    os.path.expanduser("~"), "Downloads"
-                )
-                self.download_path_var.set(default_download_path)
-        except Exception as e:
-            self.logger.error(f"Error loading settings: {str(e)}")
-            # Set default download path to user's Downloads folder as fallback
-            default_download_path = os.path.join(os.path.expanduser("~"), "Downloads")
-            self.download_path_var.set(default_download_path)
-
-    def save_settings(self):
-        try:
-            settings = {"download_path": self.download_path_var.get()}
-            with open(self.settings_file, "w") as f:
-                json.dump(settings, f)
-        except Exception as e:
-            self.logger.error(f"Error saving settings: {str(e)}")
-
-    def check_ffmpeg(self):
-        """Check if FFmpeg is installed and available in PATH"""
-        try:
-            with open(os.devnull, "w") as devnull:
-                subprocess_result = subprocess.call(
-                    ["ffmpeg", "-version"], stdout=devnull, stderr=devnull
-                )
-                if subprocess_result != 0:
-                    self.logger.warning(
-                        "FFmpeg not found! MP3 conversion and some video formats will not work."
-                    )
-                    self.logger.warning(
-                        "Please install FFmpeg: https://ffmpeg.org/download.html"
-                    )
-                else:
-                    self.logger.info("FFmpeg detected. Full functionality available.")
-        except Exception:
-            self.logger.warning(
-                "FFmpeg not found! MP3 conversion and some video formats will not work."
-            )
-            self.logger.warning(
-                "Please install FFmpeg: https://ffmpeg.org/download.html"
-            )
-
-
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = YouTubeDownloaderApp(root)
-    root.mainloop()
+import time
+
+# Taken before the other imports so --profile-startup can time them
+_IMPORT_STARTED = time.perf_counter()
+
+import os
+import sys
+import argparse
+import threading
+import tkinter as tk
+from tkinter import ttk, filedialog, StringVar
+import logging
+import logging.handlers
+import json
+import queue
+from collections import deque
+
+_TK_IMPORTED = time.perf_counter()
+
+from download_core import (
+    COMPLETED,
+    DOWNLOADING,
+    FAILED,
+    AUDIO_QUALITIES,
+    MP3_QUALITIES,
+    MP4_QUALITIES,
+    PAUSED,
+    PROCESSING,
+    QUEUED,
+    RUNNING_STATES,
+    SKIPPED,
+    TRANSCODING,
+    WAITING_TRANSCODE,
+    DownloadJob,
+    DownloadQueue,
+    extract_video_id,
+    is_valid_youtube_url,
+    run_job,
+)
+from bandwidth import BandwidthScheduler, format_rate
+from download_archive import DownloadArchive
+from job_journal import JobJournal
+from job_metrics import MetricsRecorder
+from metadata_cache import MetadataCache
+from prefetch import InfoPrefetcher
+from playlist import PlaylistIngest, fetch_collection, is_collection_url, parse_items
+from progress_state import ProgressBoard, format_eta
+from session_pool import SessionPool, format_connection_stats
+from thumbnails import ThumbnailService, pick_thumbnail_url
+from transcode_pool import TranscodePool
+from transcode_pool import default_workers as default_transcode_workers
+from ffmpeg_probe import probe_ffmpeg
+
+_APP_IMPORTED = time.perf_counter()
+
+# How often per second the queue view and progress bar are redrawn
+UI_FPS = 10
+# A pasted URL is extracted once the text stopped changing for this long
+PREFETCH_DELAY_MS = 400
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Defaults for the log pane size and the optional rotating log file
+LOG_MAX_LINES = 1000
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class QueueLogHandler(logging.Handler):
+    """Logging handler that hands formatted records to the Tk thread.
+
+    ``emit`` only puts the record on an unbounded queue, so logging from
+    worker threads never waits for the GUI.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.queue = queue.SimpleQueue()
+
+    def emit(self, record):
+        try:
+            self.queue.put((record.levelno, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+    def drain(self, limit):
+        """Return the pending records, at most the newest ``limit`` of them."""
+        records = deque(maxlen=limit)
+        while True:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                return records
+
+
+class StartupProfile:
+    """Time spent in each startup phase, printed with ``--profile-startup``.
+
+    ``mark`` closes a phase of the Tk thread, ``record`` adds one that ran
+    on a background thread and didn't hold up the window.
+    """
+
+    def __init__(self, started, checkpoints=()):
+        self.started = started
+        self.phases = []
+        self._last = started
+        self._lock = threading.Lock()
+        for phase, at in checkpoints:
+            self.mark(phase, at)
+
+    def mark(self, phase, at=None):
+        at = time.perf_counter() if at is None else at
+        with self._lock:
+            self.phases.append((phase, at - self._last, False))
+            self._last = at
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self.phases.append((phase, seconds, True))
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        with self._lock:
+            phases = list(self.phases)
+            total = self._last - self.started
+        stream.write("Startup profile:\n")
+        for phase, seconds, background in phases:
+            suffix = " (background)" if background else ""
+            stream.write(f"  {seconds * 1000:8.1f} ms  {phase}{suffix}\n")
+        stream.write(f"  {total * 1000:8.1f} ms  until the first frame\n")
+        stream.flush()
+
+
+class YouTubeDownloaderApp:
+    def __init__(self, root, profile=None, service_url=None):
+        self.root = root
+        self.profile = profile
+        self.root.title("YouTube Downloader")
+        self.root.geometry("600x800")
+        self.root.resizable(True, True)
+        self.root.configure(padx=10, pady=10)
+
+        # Set application icon
+        try:
+            if os.path.exists("youtube_icon.ico"):
+                self.root.iconbitmap("youtube_icon.ico")
+        except Exception:
+            # Icon not found or not supported, continue without icon
+            pass
+
+        # Variables
+        self.url_var = StringVar()
+        self.download_path_var = StringVar()
+        self.format_var = StringVar(value="mp3")
+        self.progress_var = StringVar(value="0%")
+        self.progress_value = tk.DoubleVar(value=0.0)
+        self.video_title = StringVar()
+        self.quality_var = StringVar()
+        self.max_workers_var = tk.IntVar(value=2)
+        self.max_transcodes_var = tk.IntVar(value=default_transcode_workers())
+        self.stream_audio_var = tk.BooleanVar(value=False)
+        self.connections_var = tk.IntVar(value=1)
+        # Bandwidth limits in KB/s, 0 is unlimited
+        self.rate_limit_var = tk.IntVar(value=0)
+        self.job_rate_limit_var = tk.IntVar(value=0)
+        self.playlist_items_var = StringVar()
+        self.stats_var = StringVar(value="No downloads finished yet")
+        self.fetched_url = None
+        # Playlists whose entries are still being added to the queue
+        self.ingests = []
+        self.queue_busy = False
+
+        # Load saved settings
+        self.settings_file = "settings.json"
+        self.journal_file = "jobs.json"
+        self.archive_file = "archive.sqlite3"
+        # Optional JSON lines and Prometheus exports of the job metrics
+        self.metrics_file = ""
+        self.prometheus_file = ""
+        # Download service to hand the jobs to, empty to run them in the app
+        self.service_url = ""
+
+        # Configure logging
+        self.setup_logging()
+
+        # Now load settings after logging is set up
+        self.load_settings()
+        self.setup_log_file()
+        self.mark_startup("logging and settings")
+
+        # Workers publish progress here, the UI samples it at UI_FPS
+        self.progress_board = ProgressBoard()
+
+        self.applied_job_rate_limit = self.job_rate_limit_var.get() * 1024
+
+        # yt-dlp instances kept open between jobs, with their connections
+        self.sessions = SessionPool()
+
+        # Resized thumbnails are cached on disk by video ID
+        self.thumbnails = ThumbnailService(sessions=self.sessions)
+        # The video whose thumbnail should be shown, older loads are dropped
+        self.thumbnail_key = None
+
+        # Timings and byte counts of finished jobs, optionally exported
+        self.metrics = MetricsRecorder(self.metrics_file or None, self.sessions)
+
+        # Info dicts from Fetch are reused by Download instead of re-extracting
+        self.metadata_cache = MetadataCache()
+        # Pasted URLs are extracted before Fetch or Download is clicked
+        self.prefetcher = InfoPrefetcher(self.metadata_cache, sessions=self.sessions)
+        self.prefetch_after_id = None
+
+        # With a running download service the jobs run there, sharing its
+        # workers and bandwidth with its other clients. Requests to it are
+        # sent in order from one background thread, see remote_call.
+        self.remote_calls = None
+        self.download_queue = self.connect_service(service_url or self.service_url)
+        self.remote = self.download_queue is not None
+        if self.remote:
+            self.archive = self.bandwidth = self.journal = self.transcoder = None
+        else:
+            # Index of finished downloads, matching jobs are skipped
+            self.archive = DownloadArchive(self.archive_file)
+
+            # Shared by all running downloads, limits apply live
+            self.bandwidth = BandwidthScheduler(self.rate_limit_var.get() * 1024)
+
+            # Download queue, jobs run on a bounded pool of worker threads.
+            # Unfinished jobs are journaled so they survive a restart.
+            self.journal = JobJournal(self.journal_file)
+            # MP3 encoding runs in its own stage so downloads don't wait on ffmpeg
+            self.transcoder = TranscodePool(
+                max_workers=self.max_transcodes_var.get(),
+                on_update=lambda job: self.download_queue.notify(job),
+            )
+            self.download_queue = DownloadQueue(
+                self.download_video,
+                max_workers=self.max_workers_var.get(),
+                on_update=self.progress_board.publish,
+                journal=self.journal,
+            )
+        # Filled in by the background FFmpeg probe
+        self.ffmpeg_info = None
+        self.mark_startup("archive, caches and queues")
+
+        # Create UI
+        self.create_widgets()
+
+        # Quality options for MP3 and MP4
+        self.mp3_qualities = MP3_QUALITIES
+        self.mp4_qualities = MP4_QUALITIES
+        self.audio_qualities = AUDIO_QUALITIES
+        self.update_quality_options()
+        self.mark_startup("widgets")
+
+        # Bring back the jobs that were unfinished when the app was closed,
+        # the service lists its own jobs once connected
+        if self.remote:
+            self.download_queue.start()
+        else:
+            self.restore_jobs()
+        self.mark_startup("restore jobs")
+
+        # Start sampling download progress
+        self.root.after(1000 // UI_FPS, self.sample_progress)
+
+        self.url_var.trace_add("write", self.on_url_changed)
+
+        # Slow imports and the FFmpeg check run once the window is up
+        self.background_tasks = []
+        self.first_frame_shown = False
+        self.root.bind("<Map>", self.on_first_frame, add="+")
+        # In case the window starts minimized and is never mapped
+        self.root.after(1000, self.start_background_tasks)
+
+    def connect_service(self, url):
+        """Return a queue backed by the download service at ``url``, or None."""
+        if not url:
+            return None
+        # Only loaded with a service configured, it pulls in the HTTP stack
+        from service_client import RemoteQueue, ServiceClient
+
+        client = ServiceClient(url)
+        if not client.available():
+            self.logger.warning(
+                f"No download service running at {url}, downloading in this window"
+            )
+            return None
+        self.logger.info(f"Downloads run in the service at {url}")
+        return RemoteQueue(
+            client,
+            on_update=self.progress_board.publish,
+            # Called on the event thread, Tk is only touched on the main thread
+            on_remove=lambda job_id: self.root.after(0, self.remove_job_row, job_id),
+            on_settings=lambda settings: self.root.after(
+                0, self.apply_service_settings, settings
+            ),
+        )
+
+    def remote_call(
+        self, request, on_done=None, error="Download service request failed"
+    ):
+        """Run ``request()`` against the download service off the Tk thread.
+
+        ``on_done(result)`` is then called on the Tk thread, if the request
+        raises the error is logged after ``error`` instead.
+        """
+        if self.remote_calls is None:
+            self.remote_calls = queue.SimpleQueue()
+            threading.Thread(target=self.run_remote_calls, daemon=True).start()
+        self.remote_calls.put((request, on_done, error))
+
+    def run_remote_calls(self):
+        while True:
+            request, on_done, error = self.remote_calls.get()
+            try:
+                result = request()
+            except Exception as e:
+                # ServiceError when the service is unreachable or refused it
+                self.logger.error(f"{error}: {str(e)}")
+                continue
+            if on_done is not None:
+                self.root.after(0, on_done, result)
+
+    def apply_service_settings(self, settings):
+        """Show the settings the service runs with, they may come from elsewhere."""
+        self.max_workers_var.set(settings["max_workers"])
+        self.max_transcodes_var.set(settings["max_transcodes"])
+        self.rate_limit_var.set(round(settings["rate_limit"] / 1024))
+        self.job_rate_limit_var.set(round(settings["job_rate_limit"] / 1024))
+        self.applied_job_rate_limit = settings["job_rate_limit"]
+
+    def mark_startup(self, phase):
+        if self.profile is not None:
+            self.profile.mark(phase)
+
+    def on_first_frame(self, event=None):
+        if self.first_frame_shown:
+            return
+        self.first_frame_shown = True
+        self.mark_startup("first frame")
+        self.root.after_idle(self.start_background_tasks)
+
+    def start_background_tasks(self):
+        if self.background_tasks:
+            return
+        for task in (self.warm_imports, self.check_ffmpeg):
+            thread = threading.Thread(target=task, daemon=True)
+            self.background_tasks.append(thread)
+            thread.start()
+
+    @property
+    def background_tasks_done(self):
+        return bool(self.background_tasks) and not any(
+            thread.is_alive() for thread in self.background_tasks
+        )
+
+    def warm_imports(self):
+        """Import what the first Fetch and Download need before they're clicked."""
+        for name, load in (
+            ("import yt-dlp", lambda: __import__("segmented")),
+            ("import Pillow", lambda: __import__("PIL.ImageTk")),
+        ):
+            started = time.perf_counter()
+            try:
+                load()
+            except Exception as e:
+                self.logger.debug(f"Can't preload module: {str(e)}")
+            if self.profile is not None:
+                self.profile.record(name, time.perf_counter() - started)
+
+    def setup_logging(self):
+        logging.basicConfig(
+            level=logging.INFO,
+            format=LOG_FORMAT,
+            datefmt=LOG_DATE_FORMAT,
+        )
+        self.logger = logging.getLogger("YouTubeDownloader")
+        self.log_max_lines = LOG_MAX_LINES
+        self.log_file = ""
+
+        # Records are queued from the start and shown once the pane exists
+        self.log_handler = QueueLogHandler()
+        self.log_handler.setLevel(logging.INFO)
+        self.log_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        self.logger.addHandler(self.log_handler)
+
+    def setup_log_file(self):
+        """Keep the full history in a rotating log file, if one is configured."""
+        if not self.log_file:
+            return
+        try:
+            file_handler = logging.handlers.RotatingFileHandler(
+                self.log_file,
+                maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUPS,
+                encoding="utf-8",
+            )
+        except OSError as e:
+            self.logger.error(f"Can't open log file {self.log_file}: {str(e)}")
+            return
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        self.logger.addHandler(file_handler)
+
+    def create_widgets(self):
+        # Main frame
+        main_frame = ttk.Frame(self.root)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        # URL section
+        url_frame = ttk.LabelFrame(main_frame, text="YouTube URL")
+        url_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(url_frame, text="URL:").grid(
+            row=0, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        ttk.Entry(url_frame, textvariable=self.url_var, width=50).grid(
+            row=0, column=1, padx=5, pady=5, sticky=tk.W + tk.E
+        )
+        ttk.Button(url_frame, text="Fetch", command=self.fetch_video_info).grid(
+            row=0, column=2, padx=5, pady=5
+        )
+
+        # Video title display
+        ttk.Label(url_frame, text="Title:").grid(
+            row=1, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        ttk.Label(url_frame, textvariable=self.video_title, wraplength=400).grid(
+            row=1, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W
+        )
+
+        # Only used for playlist and channel URLs, e.g. "100-500"
+        ttk.Label(url_frame, text="Playlist items:").grid(
+            row=2, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        ttk.Entry(url_frame, textvariable=self.playlist_items_var, width=12).grid(
+            row=2, column=1, padx=5, pady=5, sticky=tk.W
+        )
+
+        # Thumbnail frame (will be populated when URL is fetched)
+        self.thumbnail_frame = ttk.LabelFrame(main_frame, text="Thumbnail")
+        self.thumbnail_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.thumbnail_label = ttk.Label(self.thumbnail_frame)
+        self.thumbnail_label.pack(padx=5, pady=5)
+
+        # Download location section
+        path_frame = ttk.LabelFrame(main_frame, text="Download Location")
+        path_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(path_frame, text="Save to:").grid(
+            row=0, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        ttk.Entry(path_frame, textvariable=self.download_path_var, width=50).grid(
+            row=0, column=1, padx=5, pady=5, sticky=tk.W + tk.E
+        )
+        ttk.Button(path_frame, text="Browse", command=self.browse_directory).grid(
+            row=0, column=2, padx=5, pady=5
+        )
+
+        # Format section
+        format_frame = ttk.LabelFrame(main_frame, text="Format Options")
+        format_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Radiobutton(
+            format_frame,
+            text="Audio (MP3)",
+            variable=self.format_var,
+            value="mp3",
+            command=self.update_quality_options,
+        ).grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+        ttk.Radiobutton(
+            format_frame,
+            text="Video (MP4)",
+            variable=self.format_var,
+            value="mp4",
+            command=self.update_quality_options,
+        ).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+        ttk.Radiobutton(
+            format_frame,
+            text="Audio (native, no re-encode)",
+            variable=self.format_var,
+            value="audio",
+            command=self.update_quality_options,
+        ).grid(row=0, column=2, padx=5, pady=5, sticky=tk.W)
+
+        ttk.Label(format_frame, text="Quality:").grid(
+            row=1, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        self.quality_combobox = ttk.Combobox(
+            format_frame, textvariable=self.quality_var, state="readonly", width=10
+        )
+        self.quality_combobox.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+
+        ttk.Checkbutton(
+            format_frame,
+            text="Encode MP3 while downloading (no temporary file)",
+            variable=self.stream_audio_var,
+            command=self.save_settings,
+        ).grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky=tk.W)
+
+        # More than one splits each stream into parallel ranged requests
+        ttk.Label(format_frame, text="Connections per download:").grid(
+            row=3, column=0, padx=5, pady=5, sticky=tk.W
+        )
+        ttk.Spinbox(
+            format_frame,
+            from_=1,
+            to=16,
+            width=3,
+            textvariable=self.connections_var,
+            state="readonly",
+            command=self.save_settings,
+        ).grid(row=3, column=1, padx=5, pady=5, sticky=tk.W)
+
+        # Queue section
+        queue_frame = ttk.LabelFrame(main_frame, text="Download Queue")
+        queue_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        queue_scrollbar = ttk.Scrollbar(queue_frame)
+        queue_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.queue_tree = ttk.Treeview(
+            queue_frame,
+            columns=("title", "format", "state", "progress"),
+            show="headings",
+            height=6,
+            yscrollcommand=queue_scrollbar.set,
+        )
+        self.queue_tree.heading("title", text="Title")
+        self.queue_tree.heading("format", text="Format")
+        self.queue_tree.heading("state", text="State")
+        self.queue_tree.heading("progress", text="Progress")
+        self.queue_tree.column("title", width=260)
+        self.queue_tree.column("format", width=90, anchor=tk.CENTER)
+        self.queue_tree.column("state", width=90, anchor=tk.CENTER)
+        self.queue_tree.column("progress", width=130, anchor=tk.CENTER)
+        self.queue_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.queue_tree.bind("<<TreeviewSelect>>", self.show_selected_thumbnail)
+        queue_scrollbar.config(command=self.queue_tree.yview)
+
+        # Progress section
+        progress_frame = ttk.LabelFrame(main_frame, text="Overall Progress")
+        progress_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        self.progress_bar = ttk.Progressbar(
+            progress_frame, variable=self.progress_value, length=100, mode="determinate"
+        )
+        self.progress_bar.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(progress_frame, textvariable=self.progress_var).pack(padx=5, pady=2)
+
+        # Session totals of the finished jobs
+        stats_frame = ttk.LabelFrame(main_frame, text="Session Stats")
+        stats_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(
+            stats_frame, textvariable=self.stats_var, justify=tk.LEFT, wraplength=550
+        ).pack(anchor=tk.W, padx=5, pady=2)
+
+        # Action buttons
+        buttons_frame = ttk.Frame(main_frame)
+        buttons_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        self.download_button = ttk.Button(
+            buttons_frame, text="Download", command=self.start_download
+        )
+        self.download_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        ttk.Button(buttons_frame, text="Pause", command=self.pause_download).pack(
+            side=tk.LEFT, padx=5, pady=5
+        )
+        ttk.Button(buttons_frame, text="Resume", command=self.resume_download).pack(
+            side=tk.LEFT, padx=5, pady=5
+        )
+
+        self.cancel_button = ttk.Button(
+            buttons_frame, text="Cancel", command=self.cancel_download
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        ttk.Button(
+            buttons_frame, text="Clear Finished", command=self.clear_finished
+        ).pack(side=tk.LEFT, padx=5, pady=5)
+
+        ttk.Button(
+            buttons_frame, text="Stop Playlist", command=self.stop_playlists
+        ).pack(side=tk.LEFT, padx=5, pady=5)
+
+        # Concurrency of the download and transcode stages
+        workers_frame = ttk.Frame(main_frame)
+        workers_frame.pack(fill=tk.X, padx=5)
+
+        ttk.Label(workers_frame, text="Parallel downloads:").pack(
+            side=tk.LEFT, padx=5, pady=2
+        )
+        ttk.Spinbox(
+            workers_frame,
+            from_=1,
+            to=8,
+            width=3,
+            textvariable=self.max_workers_var,
+            state="readonly",
+            command=self.update_max_workers,
+        ).pack(side=tk.LEFT, padx=5, pady=2)
+
+        ttk.Label(workers_frame, text="Parallel MP3 encodes:").pack(
+            side=tk.LEFT, padx=5, pady=2
+        )
+        ttk.Spinbox(
+            workers_frame,
+            from_=1,
+            to=max(8, default_transcode_workers()),
+            width=3,
+            textvariable=self.max_transcodes_var,
+            state="readonly",
+            command=self.update_max_transcodes,
+        ).pack(side=tk.LEFT, padx=5, pady=2)
+
+        # Bandwidth limits, changes apply to running downloads too
+        limits_frame = ttk.Frame(main_frame)
+        limits_frame.pack(fill=tk.X, padx=5)
+
+        ttk.Label(limits_frame, text="Total limit (KB/s, 0 = none):").pack(
+            side=tk.LEFT, padx=5, pady=2
+        )
+        total_limit = ttk.Spinbox(
+            limits_frame,
+            from_=0,
+            to=1000000,
+            increment=100,
+            width=7,
+            textvariable=self.rate_limit_var,
+            command=self.update_rate_limits,
+        )
+        total_limit.pack(side=tk.LEFT, padx=5, pady=2)
+
+        ttk.Label(limits_frame, text="Per download:").pack(side=tk.LEFT, padx=5, pady=2)
+        job_limit = ttk.Spinbox(
+            limits_frame,
+            from_=0,
+            to=1000000,
+            increment=100,
+            width=7,
+            textvariable=self.job_rate_limit_var,
+            command=self.update_rate_limits,
+        )
+        job_limit.pack(side=tk.LEFT, padx=5, pady=2)
+        for spinbox in (total_limit, job_limit):
+            spinbox.bind("<Return>", lambda event: self.update_rate_limits())
+            spinbox.bind("<FocusOut>", lambda event: self.update_rate_limits())
+
+        # Log section
+        log_frame = ttk.LabelFrame(main_frame, text="Log")
+        log_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        scrollbar = ttk.Scrollbar(log_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.log_text = tk.Text(
+            log_frame, wrap=tk.WORD, height=8, yscrollcommand=scrollbar.set
+        )
+        self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.log_text.tag_configure("warning", foreground="#b36b00")
+        self.log_text.tag_configure("error", foreground="#c62828")
+        self.log_text.config(state=tk.DISABLED)
+        scrollbar.config(command=self.log_text.yview)
+
+        # Start log update timer
+        self.root.after(100, self.update_log)
+
+    def update_quality_options(self):
+        if self.format_var.get() == "mp3":
+            self.quality_combobox["values"] = self.mp3_qualities
+            self.quality_var.set(self.mp3_qualities[-1])  # Default to highest quality
+        elif self.format_var.get() == "audio":
+            self.quality_combobox["values"] = self.audio_qualities
+            self.quality_var.set(self.audio_qualities[-1])
+        else:
+            self.quality_combobox["values"] = self.mp4_qualities
+            self.quality_var.set(self.mp4_qualities[-1])  # Default to highest quality
+
+    def browse_directory(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.download_path_var.set(directory)
+            self.save_settings()
+
+    def fetch_video_info(self):
+        url = self.url_var.get().strip()
+        if not url:
+            self.logger.error("Please enter a YouTube URL")
+            return
+
+        if not is_valid_youtube_url(url):
+            self.logger.error("Invalid YouTube URL")
+            return
+
+        self.logger.info(f"Fetching video information for: {url}")
+        self.fetched_url = url
+        self.video_title.set("")
+
+        # The thumbnail only needs the video ID, load it alongside the info
+        video_id = extract_video_id(url)
+        if video_id:
+            self.show_thumbnail(video_id)
+
+        if is_collection_url(url):
+            threading.Thread(
+                target=self.fetch_playlist_info, args=(url,), daemon=True
+            ).start()
+            return
+
+        def fetch_thread():
+            try:
+                info = self.prefetcher.fetch(url)
+                title = info.get("title", "Unknown Title")
+
+                # Update UI elements in the main thread
+                self.root.after(0, lambda: self.video_title.set(title))
+                self.root.after(0, lambda: self.logger.info(f"Video title: {title}"))
+                self.log_cache_stats()
+
+                thumbnail_url = pick_thumbnail_url(info)
+                if not video_id and thumbnail_url:
+                    self.root.after(0, lambda: self.show_thumbnail(url, thumbnail_url))
+            except Exception as e:
+                self.root.after(
+                    0,
+                    lambda error=str(e): self.logger.error(
+                        f"Error fetching video info: {error}"
+                    ),
+                )
+
+        threading.Thread(target=fetch_thread, daemon=True).start()
+
+    def on_url_changed(self, *args):
+        # Wait for typing or pasting to settle before extracting anything
+        if self.prefetch_after_id is not None:
+            self.root.after_cancel(self.prefetch_after_id)
+        self.prefetch_after_id = self.root.after(PREFETCH_DELAY_MS, self.prefetch_url)
+
+    def prefetch_url(self):
+        """Start extracting the pasted video and loading its thumbnail."""
+        self.prefetch_after_id = None
+        url = self.url_var.get().strip()
+        video_id = extract_video_id(url) if is_valid_youtube_url(url) else None
+        # Requests for earlier text that haven't started are dropped
+        self.prefetcher.cancel(keep=video_id)
+        if video_id is None:
+            return
+        self.prefetcher.prefetch(url)
+        self.thumbnails.prefetch([(video_id, None)])
+
+    def fetch_playlist_info(self, url):
+        """Show a playlist's title and size without resolving its entries."""
+        try:
+            info = fetch_collection(url)
+            title = info.get("title", "Unknown Playlist")
+            count = info.get("playlist_count")
+            if count:
+                title = f"{title} ({count} videos)"
+            self.root.after(0, lambda: self.video_title.set(title))
+            self.root.after(0, lambda: self.logger.info(f"Playlist: {title}"))
+        except Exception as e:
+            self.root.after(
+                0,
+                lambda error=str(e): self.logger.error(
+                    f"Error fetching playlist info: {error}"
+                ),
+            )
+
+    def log_cache_stats(self):
+        stats = self.metadata_cache.stats()
+        self.logger.info(
+            f"Metadata cache: {stats['memory_hits']} memory hits, "
+            f"{stats['disk_hits']} disk hits, {stats['misses']} misses, "
+            f"{self.prefetcher.stats()['attached']} prefetched"
+        )
+
+    def show_thumbnail(self, key, url=None):
+        """Load a thumbnail in the background and show it, main thread only."""
+        self.thumbnail_key = key
+
+        def loaded(image, error):
+            self.root.after(0, lambda: self.update_thumbnail(key, image, error))
+
+        self.thumbnails.load_async(key, url, loaded)
+
+    def update_thumbnail(self, key, image, error):
+        if key != self.thumbnail_key:
+            # Another video was fetched or selected in the meantime
+            return
+        if error:
+            self.logger.error(f"Error loading thumbnail: {error}")
+            return
+        from PIL import ImageTk
+
+        # PhotoImage must be created on the Tk thread
+        photo = ImageTk.PhotoImage(image)
+        self.thumbnail_photo = photo  # Keep a reference to prevent garbage collection
+        self.thumbnail_label.config(image=photo)
+
+    def show_selected_thumbnail(self, event=None):
+        selected = self.queue_tree.selection()
+        job = self.download_queue.get_job(int(selected[0])) if selected else None
+        video_id = extract_video_id(job.url) if job else None
+        if video_id:
+            self.show_thumbnail(video_id)
+
+    def start_download(self):
+        url = self.url_var.get().strip()
+        download_path = self.download_path_var.get()
+
+        if not url:
+            self.logger.error("Please enter a YouTube URL")
+            return
+
+        if not download_path:
+            self.logger.error("Please select a download location")
+            return
+
+        if not os.path.exists(download_path):
+            self.logger.error(f"Download path does not exist: {download_path}")
+            return
+
+        if not is_valid_youtube_url(url):
+            self.logger.error("Invalid YouTube URL")
+            return
+
+        # Snapshot the current options so later UI changes don't affect this job
+        file_format = self.format_var.get()
+        quality = self.quality_var.get()
+        stream_audio = self.stream_audio_var.get()
+        connections = self.connections_var.get()
+        rate_limit = self.job_rate_limit_var.get() * 1024
+
+        def make_job(job_url):
+            return DownloadJob(
+                job_url,
+                download_path,
+                file_format,
+                quality,
+                stream_audio=stream_audio,
+                connections=connections,
+                rate_limit=rate_limit,
+            )
+
+        # Save settings
+        self.save_settings()
+
+        if is_collection_url(url):
+            try:
+                start, end = parse_items(self.playlist_items_var.get())
+            except ValueError:
+                self.logger.error(
+                    f"Invalid playlist items: {self.playlist_items_var.get()}"
+                )
+                return
+            if self.remote:
+                items = self.playlist_items_var.get()
+                job = make_job(url)
+                self.remote_call(
+                    lambda: self.download_queue.add_playlist(url, job, items),
+                    lambda ingest: self.playlist_added(ingest, url),
+                    f"Can't add playlist {url}",
+                )
+            else:
+                ingest = PlaylistIngest(url, self.download_queue, make_job, start, end)
+                ingest.start()
+                self.playlist_added(ingest, url)
+            return
+
+        job = make_job(url)
+        if url == self.fetched_url and self.video_title.get():
+            job.title = self.video_title.get()
+
+        if self.remote:
+            self.remote_call(
+                lambda: self.download_queue.submit(job),
+                lambda _: self.logger.info(f"Queued download #{job.id}: {url}"),
+                f"Can't queue {url}",
+            )
+            return
+        self.download_queue.submit(job)
+        self.logger.info(f"Queued download #{job.id}: {url}")
+
+    def playlist_added(self, ingest, url):
+        self.ingests = [i for i in self.ingests if not i.is_done] + [ingest]
+        self.logger.info(f"Reading playlist: {url}")
+
+    def download_video(self, job):
+        """Run a single job, called on a download queue worker thread."""
+        run_job(
+            job,
+            on_progress=self.progress_hook,
+            cache=self.metadata_cache,
+            archive=self.archive,
+            transcoder=self.transcoder,
+            bandwidth=self.bandwidth,
+            prefetcher=self.prefetcher,
+            metrics=self.metrics,
+            sessions=self.sessions,
+        )
+        self.log_cache_stats()
+
+    def progress_hook(self, job, d):
+        # Only record the progress, sample_progress redraws at a fixed rate
+        self.progress_board.publish(job)
+
+    def sample_progress(self):
+        """Redraw the jobs that changed since the last frame."""
+        changed = self.progress_board.collect()
+        for job_id, snapshot in changed.items():
+            job = self.download_queue.get_job(job_id)
+            if job is not None:
+                self.refresh_job(job, snapshot)
+        if changed:
+            self.refresh_overall_progress()
+
+        self.root.after(1000 // UI_FPS, self.sample_progress)
+
+    def format_job_progress(self, snapshot):
+        state = snapshot["state"]
+        if state == DOWNLOADING:
+            # Format download speed
+            if snapshot["speed"] is not None:
+                speed_str = f"{snapshot['speed'] / 1024 / 1024:.2f} MB/s"
+            else:
+                speed_str = "N/A"
+            if snapshot["rate_limit"] is not None:
+                speed_str += f" of {format_rate(snapshot['rate_limit'])}"
+            return (
+                f"{snapshot['progress']:.1f}% ({speed_str}, "
+                f"ETA {format_eta(snapshot['eta'])})"
+            )
+        if state == PROCESSING:
+            return "Processing..."
+        if state == WAITING_TRANSCODE:
+            return "Waiting for encoder"
+        if state == TRANSCODING:
+            return "Encoding MP3..."
+        if state == PAUSED:
+            return f"{snapshot['progress']:.1f}%"
+        if state == COMPLETED:
+            return "100%"
+        if state == SKIPPED:
+            return "Already downloaded"
+        return ""
+
+    def refresh_job(self, job, snapshot):
+        """Update the queue row for a job, main thread only."""
+        iid = str(job.id)
+        title = snapshot["title"]
+        if job.options.get("playlist_index"):
+            title = f"{job.options['playlist_index']}. {title}"
+        values = (
+            title,
+            f"{job.file_format.upper()} {job.quality}",
+            snapshot["state"].capitalize(),
+            self.format_job_progress(snapshot),
+        )
+        if self.queue_tree.exists(iid):
+            self.queue_tree.item(iid, values=values)
+        else:
+            self.queue_tree.insert("", tk.END, iid=iid, values=values)
+            # Selecting the row later shows the thumbnail right away
+            video_id = extract_video_id(job.url)
+            if video_id:
+                self.thumbnails.prefetch([(video_id, None)])
+
+    def refresh_overall_progress(self):
+        totals = self.progress_board.totals(RUNNING_STATES)
+        counts = self.download_queue.counts()
+        self.progress_value.set(totals["percent"])
+
+        status = (
+            f"{totals['jobs']} active, {counts.get(QUEUED, 0)} queued, "
+            f"{counts.get(COMPLETED, 0)} completed, {counts.get(SKIPPED, 0)} skipped, "
+            f"{counts.get(FAILED, 0)} failed"
+        )
+        if totals["speed"]:
+            status += (
+                f" - {totals['speed'] / 1024 / 1024:.2f} MB/s, "
+                f"ETA {format_eta(totals['eta'])}"
+            )
+        self.progress_var.set(status)
+        self.refresh_stats()
+
+        # Summarise the pipeline stages whenever the queue runs dry
+        busy = bool(totals["jobs"] or counts.get(QUEUED))
+        if self.queue_busy and not busy:
+            self.log_stage_stats()
+            self.export_metrics()
+        self.queue_busy = busy
+
+    def session_stats(self):
+        """Job metrics and stage summaries, of the service in remote mode."""
+        if self.remote:
+            stats = self.download_queue.service_stats
+            return stats.get("metrics"), stats.get("stages", [])
+        return self.metrics.summary(), [
+            self.download_queue.stats.summary(self.download_queue.max_workers),
+            self.transcoder.stats.summary(self.transcoder.max_workers),
+        ]
+
+    def refresh_stats(self):
+        summary = self.session_stats()[0]
+        if summary is None:
+            return
+        finished = sum(summary["jobs"].values())
+        if not finished:
+            return
+        lines = [
+            f"{finished} jobs, {summary['bytes'] / 1024 / 1024:.1f} MB in "
+            f"{summary['busy_seconds']:.0f}s of downloading"
+        ]
+        if summary["throughput"]:
+            lines[0] += f", {summary['throughput'] / 1024 / 1024:.2f} MB/s"
+        spans = summary["avg_spans"]
+        if spans:
+            lines.append(
+                "Average "
+                + ", ".join(
+                    f"{span.replace('_', ' ')} {seconds:.1f}s"
+                    for span, seconds in spans.items()
+                )
+            )
+        cache = summary["cache"]
+        lines.append(
+            f"{summary['retries']} retries, info from cache {cache['hit']}, "
+            f"prefetched {cache['prefetched']}, extracted {cache['miss']}"
+        )
+        if summary.get("connections"):
+            lines.append(format_connection_stats(summary["connections"]))
+        self.stats_var.set("\n".join(lines))
+
+    def export_metrics(self):
+        # The service exports its own metrics at /metrics
+        if not self.prometheus_file or self.remote:
+            return
+        try:
+            self.metrics.write_prometheus(self.prometheus_file)
+        except OSError as e:
+            self.logger.error(f"Error writing metrics: {str(e)}")
+
+    def selected_jobs(self, action):
+        selected = self.queue_tree.selection()
+        if not selected:
+            self.logger.info(f"Select a job in the queue to {action} it")
+            return []
+        jobs = [self.download_queue.get_job(int(iid)) for iid in selected]
+        return [job for job in jobs if job is not None]
+
+    def cancel_download(self):
+        for job in self.selected_jobs("cancel"):
+            if not job.is_finished:
+                self.job_action(self.download_queue.cancel, job, "Cancelling")
+
+    def pause_download(self):
+        for job in self.selected_jobs("pause"):
+            self.job_action(self.download_queue.pause, job, "Pausing")
+
+    def resume_download(self):
+        for job in self.selected_jobs("resume"):
+            self.job_action(self.download_queue.resume, job, "Resuming")
+
+    def job_action(self, action, job, verb):
+        def done(applied):
+            if applied:
+                self.logger.info(f"{verb} download #{job.id}")
+
+        if self.remote:
+            self.remote_call(lambda: action(job), done)
+        else:
+            done(action(job))
+
+    def restore_jobs(self):
+        jobs = self.download_queue.restore(paused=True)
+        if jobs:
+            self.logger.info(
+                f"Restored {len(jobs)} unfinished download(s), "
+                "select them and click Resume to continue"
+            )
+
+    def stop_playlists(self):
+        running = [ingest for ingest in self.ingests if not ingest.is_done]
+        if not running:
+            self.logger.info("No playlist is being added")
+            return
+        for ingest in running:
+
+            def stopped(_, ingest=ingest):
+                self.logger.info(
+                    f"Stopped adding playlist {ingest.title} "
+                    f"after {ingest.submitted} video(s)"
+                )
+
+            if self.remote:
+                self.remote_call(ingest.stop, stopped)
+            else:
+                stopped(ingest.stop())
+
+    def clear_finished(self):
+        if self.remote:
+            self.remote_call(self.download_queue.clear_finished, self.remove_job_rows)
+        else:
+            self.remove_job_rows(self.download_queue.clear_finished())
+
+    def remove_job_rows(self, jobs):
+        for job in jobs:
+            self.remove_job_row(job.id)
+
+    def remove_job_row(self, job_id):
+        self.progress_board.remove(job_id)
+        if self.queue_tree.exists(str(job_id)):
+            self.queue_tree.delete(str(job_id))
+        self.refresh_overall_progress()
+
+    def update_max_workers(self):
+        def done(applied=True):
+            if applied:
+                self.logger.info(
+                    f"Parallel downloads set to {self.download_queue.max_workers}"
+                )
+
+        count = self.max_workers_var.get()
+        if self.remote:
+            self.remote_call(lambda: self.download_queue.set_max_workers(count), done)
+        else:
+            self.download_queue.set_max_workers(count)
+            done()
+        self.save_settings()
+
+    def update_max_transcodes(self):
+        def done(applied=True):
+            if not applied:
+                return
+            if self.remote:
+                max_transcodes = self.download_queue.settings.get("max_transcodes")
+            else:
+                max_transcodes = self.transcoder.max_workers
+            self.logger.info(f"Parallel MP3 encodes set to {max_transcodes}")
+
+        count = self.max_transcodes_var.get()
+        if self.remote:
+            self.remote_call(
+                lambda: self.download_queue.update_settings({"max_transcodes": count}),
+                done,
+            )
+        else:
+            self.transcoder.set_max_workers(count)
+            done()
+        self.save_settings()
+
+    def update_rate_limits(self):
+        try:
+            rate_limit = max(0, self.rate_limit_var.get()) * 1024
+            job_rate_limit = max(0, self.job_rate_limit_var.get()) * 1024
+        except tk.TclError:
+            self.logger.error("Bandwidth limits must be whole numbers of KB/s")
+            return
+        if self.remote:
+            applied = self.download_queue.settings.get("rate_limit", 0)
+        else:
+            applied = self.bandwidth.global_limit or 0
+        if rate_limit == applied and job_rate_limit == self.applied_job_rate_limit:
+            return
+        self.applied_job_rate_limit = job_rate_limit
+
+        if self.remote:
+            settings = {"rate_limit": rate_limit, "job_rate_limit": job_rate_limit}
+            self.remote_call(lambda: self.download_queue.update_settings(settings))
+        else:
+            self.bandwidth.set_global_limit(rate_limit)
+            # The per-download limit also applies to queued and running jobs
+            for job in list(self.download_queue.jobs):
+                if not job.is_finished:
+                    job.options["rate_limit"] = job_rate_limit
+                    self.bandwidth.set_job_limit(job.id, job_rate_limit)
+        self.logger.info(
+            f"Bandwidth limit set to {format_rate(rate_limit or None)} in total, "
+            f"{format_rate(job_rate_limit or None)} per download"
+        )
+        self.save_settings()
+
+    def log_stage_stats(self):
+        # Which side of the pipeline is the bottleneck
+        for stats in self.session_stats()[1]:
+            if stats["jobs"]:
+                self.logger.info(
+                    f"{stats['stage'].capitalize()} stage: {stats['jobs']} jobs, "
+                    f"avg {stats['avg_busy']}s working, {stats['avg_wait']}s queued, "
+                    f"{stats['utilization']:.0%} utilization"
+                )
+
+    def update_log(self):
+        # Append only the records logged since the last tick
+        records = self.log_handler.drain(self.log_max_lines)
+        if records:
+            # Only follow new output if the user hasn't scrolled up
+            at_bottom = self.log_text.yview()[1] >= 0.999
+
+            self.log_text.config(state=tk.NORMAL)
+            for levelno, message in records:
+                if levelno >= logging.ERROR:
+                    tag = "error"
+                elif levelno >= logging.WARNING:
+                    tag = "warning"
+                else:
+                    tag = ()
+                self.log_text.insert(tk.END, message + "\n", tag)
+
+            # Drop the oldest lines beyond the cap
+            line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+            if line_count > self.log_max_lines:
+                excess = line_count - self.log_max_lines
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.config(state=tk.DISABLED)
+
+            if at_bottom:
+                self.log_text.see(tk.END)
+
+        # Schedule next update
+        self.root.after(100, self.update_log)
+
+    def load_settings(self):
+        try:
+            if os.path.exists(self.settings_file):
+                with open(self.settings_file, "r") as f:
+                    settings = json.load(f)
+                    download_path = settings.get("download_path", "")
+                    if download_path and os.path.exists(download_path):
+                        self.download_path_var.set(download_path)
+                    self.max_workers_var.set(settings.get("max_workers", 2))
+                    self.max_transcodes_var.set(
+                        settings.get("max_transcodes", default_transcode_workers())
+                    )
+                    self.stream_audio_var.set(settings.get("stream_audio", False))
+                    self.connections_var.set(settings.get("connections", 1))
+                    self.rate_limit_var.set(settings.get("rate_limit", 0))
+                    self.job_rate_limit_var.set(settings.get("job_rate_limit", 0))
+                    self.log_max_lines = settings.get("log_max_lines", LOG_MAX_LINES)
+                    self.log_file = settings.get("log_file", "")
+                    self.metrics_file = settings.get("metrics_file", "")
+                    self.prometheus_file = settings.get("prometheus_file", "")
+                    self.service_url = settings.get("service_url", "")
+                    self.logger.info(f"Loaded settings from {self.settings_file}")
+            else:
+                # Set default download path to user's Downloads folder
+                default_download_path = os.path.join(
+                    os.path.expanduser("~"), "Downloads"
+                )
+                self.download_path_var.set(default_download_path)
+        except Exception as e:
+            self.logger.error(f"Error loading settings: {str(e)}")
+            # Set default download path to user's Downloads folder as fallback
+            default_download_path = os.path.join(os.path.expanduser("~"), "Downloads")
+            self.download_path_var.set(default_download_path)
+
+    def save_settings(self):
+        try:
+            settings = {
+                "download_path": self.download_path_var.get(),
+                "max_workers": self.max_workers_var.get(),
+                "max_transcodes": self.max_transcodes_var.get(),
+                "stream_audio": self.stream_audio_var.get(),
+                "connections": self.connections_var.get(),
+                "rate_limit": self.rate_limit_var.get(),
+                "job_rate_limit": self.job_rate_limit_var.get(),
+                "log_max_lines": self.log_max_lines,
+                "log_file": self.log_file,
+                "metrics_file": self.metrics_file,
+                "prometheus_file": self.prometheus_file,
+                "service_url": self.service_url,
+            }
+            with open(self.settings_file, "w") as f:
+                json.dump(settings, f)
+        except Exception as e:
+            self.logger.error(f"Error saving settings: {str(e)}")
+
+    def check_ffmpeg(self):
+        """Probe FFmpeg, on a background thread, and log what it can do."""
+        started = time.perf_counter()
+        try:
+            info = probe_ffmpeg()
+        except Exception as e:
+            self.logger.debug(f"FFmpeg probe failed: {str(e)}")
+            info = {"ffmpeg": None, "ffprobe": None, "encoders": [], "cached": False}
+        if self.profile is not None:
+            cached = " (cached)" if info["cached"] else ""
+            self.profile.record(f"FFmpeg probe{cached}", time.perf_counter() - started)
+        self.root.after(0, lambda: self.report_ffmpeg(info))
+
+    def report_ffmpeg(self, info):
+        self.ffmpeg_info = info
+        if info["ffmpeg"] is None:
+            self.logger.warning(
+                "FFmpeg not found! MP3 conversion and some video formats will not work."
+            )
+            self.logger.warning(
+                "Please install FFmpeg: https://ffmpeg.org/download.html"
+            )
+            return
+        self.logger.info(
+            f"FFmpeg {info['version']} detected. Full functionality available."
+        )
+        if "libmp3lame" not in info["encoders"]:
+            self.logger.warning(
+                "This FFmpeg build has no MP3 encoder (libmp3lame), MP3 downloads will fail."
+            )
+        if info["ffprobe"] is None:
+            self.logger.warning(
+                "ffprobe not found, some post-processing steps will not work."
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YouTube downloader")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print how long each startup phase took to stderr",
+    )
+    parser.add_argument(
+        "--service",
+        metavar="URL",
+        help="run the downloads in the download service at URL, "
+        "e.g. http://127.0.0.1:8765",
+    )
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile_startup:
+        profile = StartupProfile(
+            _IMPORT_STARTED,
+            [
+                ("import stdlib and tkinter", _TK_IMPORTED),
+                ("import application modules", _APP_IMPORTED),
+            ],
+        )
+
+    root = tk.Tk()
+    if profile is not None:
+        profile.mark("create Tk root")
+    app = YouTubeDownloaderApp(root, profile, args.service)
+
+    if profile is not None:
+
+        def report_when_done():
+            if app.background_tasks_done:
+                profile.report()
+            else:
+                root.after(100, report_when_done)
+
+        root.after(100, report_when_done)
+
+    root.mainloop()